@@ -2,7 +2,7 @@
 import cherrypy
 
 from . import describe
-from .v1 import api_key, assetstore, file, collection, folder, group, item, resource, system, token, user, notification, role, requisition
+from .v1 import api_key, assetstore, batch, file, collection, folder, group, item, resource, system, token, user, notification, role, requisition
 
 
 class ApiDocs:
@@ -27,6 +27,7 @@ def _addV1ToNode(node):
 
     node.v1.api_key = api_key.ApiKey()
     node.v1.assetstore = assetstore.Assetstore()
+    node.v1.batch = batch.Batch()
     node.v1.collection = collection.Collection()
     node.v1.file = file.File()
     node.v1.folder = folder.Folder()
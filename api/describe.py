@@ -556,25 +556,26 @@ class autoDescribeRoute(describeRoute):  # noqa: class name
         super().__init__(description=description)
         self.hide = hide
 
-    def _passArg(self, fun, kwargs, name, val):
+    def _argSetter(self, name):
         """
-        This helper passes the arguments to the underlying function if the function
-        has an argument with the given name. Otherwise, it adds it into the "params"
-        argument, which is a dictionary containing other parameters.
+        Return a function that passes an argument to the underlying function
+        if the function has an argument with the given name. Otherwise, it adds
+        it into the "params" argument, which is a dictionary containing other
+        parameters.
 
-        :param fun: The wrapped route handler function
-        :type fun: callable
         :param name: The name of the argument to set
         :type name: str
-        :param kwargs: The arguments to be passed down to the function.
-        :type kwargs: dict
-        :param val: The value of the argument to set
+        :returns: a function taking the arguments to be passed down to the
+            function and the value of the argument to set.
         """
         if name in self._funNamedArgs or self._funHasKwargs:
-            kwargs[name] = val
-            kwargs['params'].pop(name, None)
+            def setArg(kwargs, val):
+                kwargs[name] = val
+                kwargs['params'].pop(name, None)
         else:
-            kwargs['params'][name] = val
+            def setArg(kwargs, val):
+                kwargs['params'][name] = val
+        return setArg
 
     def _mungeKwargs(self, kwargs, fun):
         """
@@ -602,19 +603,144 @@ class autoDescribeRoute(describeRoute):  # noqa: class name
                 # VAR_KEYWORD is the **kwargs parameter
                 self._funHasKwargs = True
 
-    @staticmethod
-    def _destName(info, model):
-        destName = info['destName']
-        if destName is None:
-            if info['isModelClass']:
-                destName = model.name
+    def _modelGetter(self, info):
+        """
+        Return a function that gets the model of a model parameter, along with
+        the argument setters for a loaded document and for a missing one.
+        Plugin models may be registered after their routes are declared, so
+        the model is looked up on first use.
+        """
+        resolved = []
+
+        def getModel():
+            if not resolved:
+                if info['isModelClass']:
+                    model = info['model']()
+                    destName = info['destName'] or model.name
+                else:
+                    model = ModelImporter.model(info['model'], info['plugin'])
+                    destName = info['destName'] or info['model']
+                resolved.append((model, self._argSetter(destName),
+                                 self._argSetter(info['destName'] or model.name)))
+            return resolved[0]
+        return getModel
+
+    def _valueConverter(self, name, descParam):
+        """
+        Return a function that validates and transforms a value passed for a
+        parameter, or None if values are used as they are.  The decisions
+        that depend only on the parameter are made in advance, so that binding
+        a request only does the conversions that apply.
+        """
+        type = descParam.get('type')
+        convert = None
+        if type == 'string':
+            if (descParam['_strip'] or descParam['_lower'] or descParam['_upper']
+                    or descParam.get('format') in ('date', 'date-time')):
+                def convert(value):
+                    return self._handleString(name, descParam, value)
+        elif type == 'boolean':
+            convert = toBool
+        elif type == 'integer':
+            def convert(value):
+                return self._handleInt(name, descParam, value)
+        elif type == 'number':
+            def convert(value):
+                return self._handleNumber(name, descParam, value)
+
+        if 'enum' not in descParam:
+            return convert
+        coerce = convert or (lambda value: value)
+        enum = descParam['enum']
+
+        def validate(value):
+            value = coerce(value)
+            # Enum validation (should be after type coercion)
+            if value not in enum:
+                raise RestException('Invalid value for %s: "%s". Allowed values: %s.' % (
+                    name, value, ', '.join(str(v) for v in enum)))
+            return value
+        return validate
+
+    def _compileParam(self, descParam):
+        """
+        Compile the handling of a parameter of the description into a
+        function that binds its value for a request.  The function takes the
+        combined path, query, and form parameters of the request, and the
+        arguments to be passed to the underlying function, which it updates.
+        """
+        name = descParam['name']
+        description = self.description
+        nameSetArg = self._argSetter(name)
+
+        if name in description.modelParams:
+            info = description.modelParams[name]
+            getModel = self._modelGetter(info)
+
+            def bindPassed(params, kwargs):
+                model, setArg, _ = getModel()
+                kwargs.pop(name, None)  # Remove from path params
+                setArg(kwargs, self._loadModel(name, info, params[name], model))
+
+            def bindMissing(kwargs):
+                _, _, setArg = getModel()
+                kwargs.pop(name, None)  # Remove from path params
+                setArg(kwargs, None)
+        else:
+            setArg = nameSetArg
+            if name in description.jsonParams:
+                info = description.jsonParams[name]
+
+                def bindPassed(params, kwargs):
+                    setArg(kwargs, self._loadJson(name, info, params[name]))
             else:
-                destName = info['model']
+                convert = self._valueConverter(name, descParam)
+                if convert is None:
+                    def bindPassed(params, kwargs):
+                        setArg(kwargs, params[name])
+                else:
+                    def bindPassed(params, kwargs):
+                        setArg(kwargs, convert(params[name]))
+
+            def bindMissing(kwargs):
+                setArg(kwargs, None)
+
+        if descParam['in'] == 'body':
+            if name in description.jsonParams:
+                bodyInfo = description.jsonParams[name].copy()
+                bodyInfo['required'] = descParam['required']
 
-        return destName
+                def bindMissing(kwargs):
+                    nameSetArg(kwargs, self._loadJsonBody(name, bodyInfo))
+            else:
+                def bindMissing(kwargs):
+                    nameSetArg(kwargs, cherrypy.request.body)
+        elif descParam['in'] == 'header':
+            # For now, do nothing with header params
+            def bindMissing(kwargs):
+                pass
+        elif 'default' in descParam:
+            default = descParam['default']
+
+            def bindMissing(kwargs):
+                nameSetArg(kwargs, default)
+        elif descParam['required']:
+            def bindMissing(kwargs):
+                raise RestException('Parameter "%s" is required.' % name)
+
+        def bind(params, kwargs):
+            if name in params:
+                bindPassed(params, kwargs)
+            else:
+                bindMissing(kwargs)
+        return bind
 
     def __call__(self, fun):
         self._inspectFunSignature(fun)
+        # We need either a type or a schema ( for message body )
+        binders = [
+            self._compileParam(descParam) for descParam in self.description.params
+            if 'type' in descParam or 'schema' in descParam]
 
         @wraps(fun)
         def wrapped(*args, **kwargs):
@@ -623,53 +749,13 @@ class autoDescribeRoute(describeRoute):  # noqa: class name
             fill in default values for any params not passed.
             """
             # Combine path params with form/query params into a single lookup table
-            params = {k: v for k, v in kwargs.items() if k != 'params'}
-            params.update(kwargs.get('params', {}))
-
-            kwargs['params'] = kwargs.get('params', {})
-
-            for descParam in self.description.params:
-                # We need either a type or a schema ( for message body )
-                if 'type' not in descParam and 'schema' not in descParam:
-                    continue
-
-                name = descParam['name']
-                model = self._getModel(name, self.description.modelParams)
-                if name in params:
-                    if name in self.description.jsonParams:
-                        info = self.description.jsonParams[name]
-                        val = self._loadJson(name, info, params[name])
-                        self._passArg(fun, kwargs, name, val)
-                    elif name in self.description.modelParams:
-                        info = self.description.modelParams[name]
-                        kwargs.pop(name, None)  # Remove from path params
-                        val = self._loadModel(name, info, params[name], model)
-                        self._passArg(fun, kwargs, self._destName(info, model), val)
-                    else:
-                        val = self._validateParam(name, descParam, params[name])
-                        self._passArg(fun, kwargs, name, val)
-                elif descParam['in'] == 'body':
-                    if name in self.description.jsonParams:
-                        info = self.description.jsonParams[name].copy()
-                        info['required'] = descParam['required']
-                        val = self._loadJsonBody(name, info)
-                        self._passArg(fun, kwargs, name, val)
-                    else:
-                        self._passArg(fun, kwargs, name, cherrypy.request.body)
-                elif descParam['in'] == 'header':
-                    continue  # For now, do nothing with header params
-                elif 'default' in descParam:
-                    self._passArg(fun, kwargs, name, descParam['default'])
-                elif descParam['required']:
-                    raise RestException('Parameter "%s" is required.' % name)
-                else:
-                    # If required=False but no default is specified, use None
-                    if name in self.description.modelParams:
-                        info = self.description.modelParams[name]
-                        kwargs.pop(name, None)  # Remove from path params
-                        self._passArg(fun, kwargs, info['destName'] or model.name, None)
-                    else:
-                        self._passArg(fun, kwargs, name, None)
+            requestParams = kwargs.setdefault('params', {})
+            params = dict(kwargs)
+            del params['params']
+            params.update(requestParams)
+
+            for bind in binders:
+                bind(params, kwargs)
 
             self._mungeKwargs(kwargs, fun)
 
@@ -713,23 +799,19 @@ class autoDescribeRoute(describeRoute):  # noqa: class name
 
         return val
 
-    def _getModel(self, name, modelParams):
-        if name not in self.description.modelParams:
-            return
-        info = self.description.modelParams[name]
-
-        if info['isModelClass']:
-            return info['model']()
-        else:
-            return ModelImporter.model(info['model'], info['plugin'])
-
     def _loadModel(self, name, info, id, model):
+        kwargs = info['kwargs']
+        # Only read the requested fields, if the route is returning this model
+        projection = model.sparseProjection()
+        if projection is not None and 'fields' not in kwargs:
+            kwargs = dict(kwargs, fields=projection)
+
         if info['force']:
-            doc = model.load(id, force=True, **info['kwargs'])
+            doc = model.load(id, force=True, **kwargs)
         elif info['level'] is not None:
-            doc = model.load(id=id, level=info['level'], user=getCurrentUser(), **info['kwargs'])
+            doc = model.load(id=id, level=info['level'], user=getCurrentUser(), **kwargs)
         else:
-            doc = model.load(id, **info['kwargs'])
+            doc = model.load(id, **kwargs)
 
         if doc is None and info['exc']:
             raise RestException('Invalid %s id (%s).' % (model.name, str(id)))
@@ -770,34 +852,3 @@ class autoDescribeRoute(describeRoute):  # noqa: class name
             return float(value)
         except ValueError:
             raise RestException('Invalid value for numeric parameter %s: %s.' % (name, value))
-
-    def _validateParam(self, name, descParam, value):
-        """
-        Validates and transforms a single parameter that was passed. Raises
-        RestException if the passed value is invalid.
-
-        :param name: The name of the param.
-        :type name: str
-        :param descParam: The formal parameter in the Description.
-        :type descParam: dict
-        :param value: The value passed in for this param for the current request.
-        :returns: The value transformed
-        """
-        type = descParam.get('type')
-
-        # Coerce to the correct data type
-        if type == 'string':
-            value = self._handleString(name, descParam, value)
-        elif type == 'boolean':
-            value = toBool(value)
-        elif type == 'integer':
-            value = self._handleInt(name, descParam, value)
-        elif type == 'number':
-            value = self._handleNumber(name, descParam, value)
-
-        # Enum validation (should be after type coercion)
-        if 'enum' in descParam and value not in descParam['enum']:
-            raise RestException('Invalid value for %s: "%s". Allowed values: %s.' % (
-                name, value, ', '.join(str(v) for v in descParam['enum'])))
-
-        return value
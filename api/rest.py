@@ -2,9 +2,11 @@
 import html
 import cherrypy
 import collections
+import copy
 import datetime
 from functools import wraps
 import inspect
+import itertools
 import json
 import posixpath
 import pymongo
@@ -12,12 +14,18 @@ import sys
 import traceback
 import types
 import unicodedata
+import zlib
 import urllib.parse
 import uuid
 import fnmatch
 
 from dogpile.cache.util import kwarg_function_key_generator
 
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
 from . import docs
 from girder import auditLogger, events, logger, logprint
 from girder.constants import TokenScope, SortDir, ServerMode
@@ -26,7 +34,8 @@ from girder.models.setting import Setting
 from girder.models.token import Token
 from girder.models.user import User
 from girder.settings import SettingKey
-from girder.utility import toBool, config, JsonEncoder, optionalArgumentDecorator
+from girder.utility import toBool, config, jsonutil, metrics, profiling, JsonEncoder, \
+    optionalArgumentDecorator
 from girder.utility._cache import requestCache
 from girder.utility.model_importer import ModelImporter
 
@@ -36,6 +45,18 @@ READ_BUFFER_LEN = 65536
 
 _MONGO_CURSOR_TYPES = (pymongo.cursor.Cursor, pymongo.command_cursor.CommandCursor)
 
+# Content type of newline-delimited JSON, which list responses are streamed as
+# when a client asks for it in the Accept header
+NDJSON_MIME_TYPE = 'application/x-ndjson'
+# Streamed list responses are sent in pieces of at least this many bytes
+LIST_STREAM_BUFFER_LEN = 65536
+
+# Response content types that are compressed when the client accepts it
+COMPRESSIBLE_MIME_TYPES = ('application/json', 'application/javascript', 'application/xml')
+# Compression levels, chosen to favor speed over the last few percent of size
+GZIP_COMPRESS_LEVEL = 6
+BROTLI_COMPRESS_QUALITY = 4
+
 
 def getUrlParts(url=None):
     """
@@ -179,9 +200,10 @@ def getCurrentUser(returnToken=False):
     if not returnToken and hasattr(cherrypy.request, 'girderUser'):
         return cherrypy.request.girderUser
 
-    event = events.trigger('auth.user.get')
-    if event.defaultPrevented and len(event.responses) > 0:
-        return event.responses[0]
+    if events.hasHandlers('auth.user.get'):
+        event = events.trigger('auth.user.get')
+        if event.defaultPrevented and len(event.responses) > 0:
+            return event.responses[0]
 
     token = getCurrentToken()
 
@@ -401,13 +423,118 @@ class loadmodel:  # noqa: class name
         return wrapped
 
 
+def getRequestedFields():
+    """
+    Get the fields that the client asked for with the ``fields`` parameter,
+    a comma-separated list of top-level field names.  This only applies to
+    GET requests, so that documents that are modified and saved are never
+    loaded partially.
+
+    :returns: A frozenset of field names, or None if all fields should be
+        returned.
+    """
+    request = cherrypy.request
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    value = request.params.get('fields')
+    if not isinstance(value, str):
+        return None
+    fields = frozenset(field.strip() for field in value.split(',') if field.strip())
+    for field in fields:
+        if field.startswith('$') or '.' in field:
+            raise RestException('Invalid field name: "%s".' % field)
+    return fields or None
+
+
+def _sparseFilter(filter, fields):
+    """
+    Wrap a document filter function so that it only keeps the requested
+    fields, plus the ones that identify the document.
+    """
+    keep = fields | _SPARSE_ALWAYS_FIELDS
+
+    def sparseFilter(doc):
+        doc = filter(doc)
+        if doc is not None:
+            doc = {k: v for k, v in doc.items() if k in keep}
+        return doc
+    return sparseFilter
+
+
+class FilteredResults:
+    """
+    The results of a route wrapped with ``filtermodel`` that returned a
+    cursor or generator.  Documents are filtered as they are read, so that a
+    long list can be streamed to the client without holding it all in
+    memory.  These can only be iterated once, unless they have first been
+    read in full by taking their length or indexing them.
+
+    :param results: The unfiltered documents.
+    :type results: iterable
+    :param filter: A function that filters a single document.
+    :type filter: callable
+    :param context: A function returning a context manager within which each
+        document is read and filtered, such as the route's sparse fieldset.
+    :type context: callable or None
+    """
+
+    def __init__(self, results, filter, context=None):
+        self._results = results
+        self._filter = filter
+        self._context = context
+        self._list = None
+
+    def __iter__(self):
+        if self._list is not None:
+            return iter(self._list)
+        if self._context is None:
+            return map(self._filter, self._results)
+        return self._readInContext()
+
+    def _readInContext(self):
+        # The context is only entered while a document is being read, as it
+        # must not stay in effect on this thread while the reader is paused.
+        results = iter(self._results)
+        while True:
+            with self._context():
+                try:
+                    doc = next(results)
+                except StopIteration:
+                    return
+                doc = self._filter(doc)
+            yield doc
+
+    def _materialize(self):
+        if self._list is None:
+            self._list = list(self)
+        return self._list
+
+    def __len__(self):
+        return len(self._materialize())
+
+    def __getitem__(self, index):
+        return self._materialize()[index]
+
+
+# Fields of a filtered document that are returned even if not requested
+_SPARSE_ALWAYS_FIELDS = frozenset({'_id', '_modelType', '_accessLevel'})
+
+# Route return values that are sent as lists, and may be streamed
+_LIST_STREAM_TYPES = _MONGO_CURSOR_TYPES + (types.GeneratorType, FilteredResults)
+
+
 class filtermodel:  # noqa: class name
     def __init__(self, model, plugin='_core', addFields=None):
         """
         This creates a decorator that will filter a model or list of models
         returned by the wrapped function using the specified model's
         ``filter`` method. Filters the results for the user making the current
-        request (i.e. the value of ``getCurrentUser()``).
+        request (i.e. the value of ``getCurrentUser()``).  Cursors and
+        generators are filtered lazily, as a ``FilteredResults`` object.
+
+        If a GET request has a ``fields`` parameter, only those fields of the
+        documents are returned, and documents of the model that the route
+        loads or finds are read with a matching projection.
 
         :param model: The model class, or the model name.
         :type model: class or str
@@ -427,27 +554,36 @@ class filtermodel:  # noqa: class name
     def __call__(self, fun):
         @wraps(fun)
         def wrapped(*args, **kwargs):
-            val = fun(*args, **kwargs)
-            if val is None:
-                return None
-
             if self._isModelClass:
                 model = self.model()
             else:
                 model = ModelImporter.model(self.model, self.plugin)
 
+            fields = getRequestedFields()
+            with model.sparseFields(fields):
+                val = fun(*args, **kwargs)
+            if val is None:
+                return None
+
             user = getCurrentUser()
 
+            def filter(doc):
+                return model.filter(doc, user, self.addFields)
+            if fields:
+                filter = _sparseFilter(filter, fields)
+
             if isinstance(val, _MONGO_CURSOR_TYPES):
-                if callable(getattr(val, 'count_documents', None)):
-                    cherrypy.response.headers['Girder-Total-Count'] = val.count_documents()
-                elif callable(getattr(val, 'count', None)):
-                    cherrypy.response.headers['Girder-Total-Count'] = val.count()
-                return [model.filter(m, user, self.addFields) for m in val]
-            elif isinstance(val, (list, tuple, types.GeneratorType)):
-                return [model.filter(m, user, self.addFields) for m in val]
+                _setTotalCount(val)
+                return FilteredResults(val, filter)
+            elif isinstance(val, types.GeneratorType):
+                # A generator may find documents as it is read, which happens
+                # after the route returns.
+                return FilteredResults(
+                    val, filter, (lambda: model.sparseFields(fields)) if fields else None)
+            elif isinstance(val, (list, tuple)):
+                return [filter(m) for m in val]
             elif isinstance(val, dict):
-                return model.filter(val, user, self.addFields)
+                return filter(val)
             else:
                 raise Exception('Cannot call filtermodel on return type: %s.' % type(val))
         return wrapped
@@ -479,6 +615,39 @@ def setResponseHeader(header, value):
     cherrypy.response.headers[header] = value
 
 
+def setRangedResponse(length, etag=None):
+    """
+    For a response whose full length is known in advance, honor a single
+    range in the request's Range header, setting the Content-Length and, for
+    a partial response, Content-Range headers.  If an ETag is given, it is
+    sent and a Range request is only honored if any If-Range header matches.
+
+    :param length: The full length of the response body in bytes.
+    :type length: int
+    :param etag: The entity tag of the response, if any.
+    :type etag: str or None
+    :returns: the (start, end) byte offsets of the body to send, where end is
+        exclusive.
+    """
+    setResponseHeader('Accept-Ranges', 'bytes')
+    if etag:
+        setResponseHeader('ETag', etag)
+    start, end = 0, length
+    rangeHeader = cherrypy.request.headers.get('Range')
+    ifRange = cherrypy.request.headers.get('If-Range')
+    if rangeHeader and (ifRange is None or ifRange == etag):
+        ranges = cherrypy.lib.httputil.get_ranges(rangeHeader, length)
+        if ranges == []:
+            setResponseHeader('Content-Range', 'bytes */%d' % length)
+            raise RestException('Requested range not satisfiable.', code=416)
+        # Multiple ranges are not supported here; send the whole body.
+        if ranges and len(ranges) == 1:
+            start, end = ranges[0]
+            setResponseHeader('Content-Range', 'bytes %d-%d/%d' % (start, end - 1, length))
+    setResponseHeader('Content-Length', end - start)
+    return start, end
+
+
 def rawResponse(fun):
     """
     This is a decorator that can be placed on REST route handlers, and is
@@ -515,8 +684,8 @@ def _createResponse(val):
             # Pretty-print and HTML-ify the response for the browser
             setResponseHeader('Content-Type', 'text/html')
             resp = html.escape(json.dumps(
-                val, indent=4, sort_keys=True, allow_nan=False, separators=(',', ': '),
-                cls=JsonEncoder))
+                val, indent=4, sort_keys=jsonutil.shouldSortKeys(), allow_nan=False,
+                separators=(',', ': '), cls=JsonEncoder))
             resp = resp.replace(' ', '&nbsp;').replace('\n', '<br />')
             resp = '<div style="font-family:monospace;">%s</div>' % resp
             return resp.encode('utf8')
@@ -524,8 +693,100 @@ def _createResponse(val):
     # Default behavior will just be normal JSON output. Keep this
     # outside of the loop body in case no Accept header is passed.
     setResponseHeader('Content-Type', 'application/json')
-    return json.dumps(val, sort_keys=True, allow_nan=False,
-                      cls=JsonEncoder).encode('utf8')
+    return jsonutil.dumps(val)
+
+
+def _negotiateEncoding(allowBrotli=True):
+    """
+    Choose a content encoding for the response from the request's
+    Accept-Encoding header.
+
+    :param allowBrotli: Whether brotli may be chosen.
+    :type allowBrotli: bool
+    :returns: 'br', 'gzip', or None.
+    """
+    accepted = {
+        element.value.lower(): element.qvalue
+        for element in cherrypy.request.headers.elements('Accept-Encoding')}
+    if allowBrotli and brotli is not None and accepted.get('br', 0) > 0:
+        return 'br'
+    if accepted.get('gzip', accepted.get('*', 0)) > 0:
+        return 'gzip'
+    return None
+
+
+def _varyOnAcceptEncoding():
+    """
+    Mark the response as depending on the request's Accept-Encoding header.
+    """
+    headers = cherrypy.response.headers
+    vary = headers.get('Vary')
+    if not vary:
+        headers['Vary'] = 'Accept-Encoding'
+    elif 'accept-encoding' not in vary.lower():
+        headers['Vary'] = vary + ', Accept-Encoding'
+
+
+def _compressStream(stream):
+    """
+    Gzip a streamed list as it is sent, if compression is enabled and the
+    client accepts gzip.  The length of the list isn't known in advance, so
+    the size threshold doesn't apply.  Each chunk of the stream is flushed
+    through the compressor, so that clients can read the elements as they
+    arrive.
+
+    :param stream: The generator of the encoded list.
+    :returns: a generator of the response body, compressed or not.
+    """
+    if (not Setting().get(SettingKey.RESPONSE_COMPRESSION)
+            or 'Content-Encoding' in cherrypy.response.headers):
+        return stream
+    _varyOnAcceptEncoding()
+    if _negotiateEncoding(allowBrotli=False) != 'gzip':
+        return stream
+    setResponseHeader('Content-Encoding', 'gzip')
+
+    def compress():
+        compressor = zlib.compressobj(GZIP_COMPRESS_LEVEL, zlib.DEFLATED, 31)
+        try:
+            for data in stream:
+                yield compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            yield compressor.flush()
+        finally:
+            stream.close()
+    return compress()
+
+
+def _compressResponse(resp):
+    """
+    Compress a serialized response if compression is enabled, the response
+    is JSON or text above the size threshold, and the client accepts a
+    supported encoding.  Streamed responses, such as file downloads, are
+    never passed here; streamed lists are compressed by ``_compressStream``.
+
+    :param resp: The response body.
+    :returns: the response body, compressed or not.
+    """
+    if not isinstance(resp, bytes) or not Setting().get(SettingKey.RESPONSE_COMPRESSION):
+        return resp
+    headers = cherrypy.response.headers
+    contentType = headers.get('Content-Type', '').split(';', 1)[0].strip().lower()
+    if ('Content-Encoding' in headers or 'Content-Range' in headers
+            or not (contentType.startswith('text/') or contentType in COMPRESSIBLE_MIME_TYPES)
+            or len(resp) < Setting().get(SettingKey.RESPONSE_COMPRESSION_MIN_SIZE)):
+        return resp
+
+    _varyOnAcceptEncoding()
+    encoding = _negotiateEncoding()
+    if encoding == 'br':
+        resp = brotli.compress(resp, quality=BROTLI_COMPRESS_QUALITY)
+    elif encoding == 'gzip':
+        compressor = zlib.compressobj(GZIP_COMPRESS_LEVEL, zlib.DEFLATED, 31)
+        resp = compressor.compress(resp) + compressor.flush()
+    else:
+        return resp
+    headers['Content-Encoding'] = encoding
+    return resp
 
 
 def _handleRestException(e):
@@ -560,6 +821,40 @@ def _handleGirderException(e):
     return val
 
 
+def _handleUnexpectedException():
+    # These are unexpected failures; send a 500 status
+    logger.exception('500 Error')
+    cherrypy.response.status = 500
+    val = dict(type='internal', uid=cherrypy.request.girderRequestUid)
+
+    if config.getServerMode() == ServerMode.PRODUCTION:
+        # Sanitize errors in production mode
+        val['message'] = 'An unexpected error occurred on the server.'
+    else:
+        # Provide error details in non-production modes
+        t, value, tb = sys.exc_info()
+        val['message'] = '%s: %s' % (t.__name__, repr(value))
+        val['trace'] = traceback.extract_tb(tb)
+    return val
+
+
+def _handleException(e):
+    """
+    Convert an exception raised while handling a request into the response
+    value, and set the response status.  This must be called from the
+    ``except`` block that caught the exception.
+    """
+    if isinstance(e, RestException):
+        return _handleRestException(e)
+    elif isinstance(e, AccessException):
+        return _handleAccessException(e)
+    elif isinstance(e, GirderException):
+        return _handleGirderException(e)
+    elif isinstance(e, ValidationException):
+        return _handleValidationException(e)
+    return _handleUnexpectedException()
+
+
 def _handleValidationException(e):
     cherrypy.response.status = 400
     val = {'message': str(e), 'type': 'validation'}
@@ -599,29 +894,94 @@ def _logRestRequest(resource, path, params):
             'details': {
                 'method': cherrypy.request.method.upper(),
                 'route': (getattr(resource, 'resourceName', resource.__class__.__name__),) + path,
-                'params': params,
+                # Copied, as the record may be written after the request ends
+                'params': dict(params),
                 'status': cherrypy.response.status or 200
             }
         })
 
 
-def _mongoCursorToList(val):
+def _setTotalCount(cursor):
     """
-    If the specified value is a Mongo cursor, convert it to a list.
-    Otherwise, just return the passed values.
+    Set the Girder-Total-Count header from a Mongo cursor, if it can be
+    counted.
 
-    :param val: a value that might be a Mongo cursor.
-    :returns: a list if val was a Mongo cursor, otherwise the original val.
+    :param cursor: a Mongo cursor.
     """
-    # This needs to be before the callable check, as mongo cursors can
-    # be callable.
-    if isinstance(val, _MONGO_CURSOR_TYPES):
-        if callable(getattr(val, 'count_documents', None)):
-            cherrypy.response.headers['Girder-Total-Count'] = val.count_documents()
-        elif callable(getattr(val, 'count', None)):
-            cherrypy.response.headers['Girder-Total-Count'] = val.count()
-        val = list(val)
-    return val
+    if callable(getattr(cursor, 'count_documents', None)):
+        cherrypy.response.headers['Girder-Total-Count'] = cursor.count_documents()
+    elif callable(getattr(cursor, 'count', None)):
+        cherrypy.response.headers['Girder-Total-Count'] = cursor.count()
+
+
+def _listStreamType():
+    """
+    Determine how a list response to the current request can be streamed,
+    following the same handling of the Accept header as ``_createResponse``.
+
+    :returns: the content type to stream the list as, or None if the list
+        must be serialized as a whole.
+    """
+    if getattr(cherrypy.request, 'girderRawResponse', False) is True:
+        return None
+    for accept in cherrypy.request.headers.elements('Accept'):
+        if accept.value in ('application/json', NDJSON_MIME_TYPE):
+            return accept.value
+        elif accept.value == 'text/html':
+            return None
+    return 'application/json'
+
+
+def _streamList(val, contentType):
+    """
+    Stream an iterable as a JSON array, or as newline-delimited JSON.  The
+    first element is read before anything is sent, so that errors that occur
+    while running a query are reported with the appropriate status.  Once
+    sending has started, an error in the middle of a JSON array aborts the
+    response, so that the client sees an incomplete array rather than a short
+    one; newline-delimited JSON ends with a line describing the error.
+
+    :param val: The elements to send.
+    :type val: iterable
+    :param contentType: 'application/json' or NDJSON_MIME_TYPE.
+    :type contentType: str
+    :returns: a generator of the encoded response.
+    """
+    ndjson = contentType == NDJSON_MIME_TYPE
+    elements = iter(val)
+    try:
+        elements = itertools.chain((next(elements),), elements)
+    except StopIteration:
+        pass
+    setResponseHeader('Content-Type', contentType)
+
+    def stream():
+        buf = [] if ndjson else [b'[']
+        bufLen = 0
+        try:
+            for index, element in enumerate(elements):
+                data = jsonutil.dumps(element)
+                if ndjson:
+                    buf.extend((data, b'\n'))
+                else:
+                    if index:
+                        buf.append(b',')
+                    buf.append(data)
+                bufLen += len(data)
+                if bufLen >= LIST_STREAM_BUFFER_LEN:
+                    yield b''.join(buf)
+                    buf = []
+                    bufLen = 0
+        except Exception:
+            error = _handleUnexpectedException()
+            if not ndjson:
+                yield b''.join(buf)
+                raise
+            buf.extend((jsonutil.dumps(error), b'\n'))
+        if not ndjson:
+            buf.append(b']')
+        yield b''.join(buf)
+    return stream()
 
 
 def endpoint(fun):
@@ -635,70 +995,224 @@ def endpoint(fun):
 
     If you want a streamed response, simply return a generator function
     from the inner method.
+
+    The latency, status, and response size of each request are recorded in
+    the metrics of the route that handled it.  While a profiling session is
+    running, requests it samples are profiled until the handler returns.
     """
     @wraps(fun)
     def endpointDecorator(self, *path, **params):
-        _setCommonCORSHeaders()
-        cherrypy.lib.caching.expires(0)
-        cherrypy.request.girderRequestUid = str(uuid.uuid4())
-        setResponseHeader('Girder-Request-Uid', cherrypy.request.girderRequestUid)
-
+        request = cherrypy.request
+        start = metrics.requestStarted()
+        profiler = profiling.profileRequest(self, path)
         try:
-            _preventRepeatedParams(params)
+            resp = _endpointResponse(fun, self, path, params)
+        except BaseException as e:
+            if profiler is not None:
+                profiling.finishRequest(profiler)
+            route = getattr(request, 'girderRoute', None) or 'unmatched'
+            status = e.code if isinstance(e, cherrypy.HTTPRedirect) else 500
+            metrics.requestHandled(start, request.method, route, status)
+            metrics.requestFinished(request.method, route, 0)
+            raise
+        if profiler is not None:
+            profiling.finishRequest(profiler)
+        route = getattr(request, 'girderRoute', None) or 'unmatched'
+        metrics.requestHandled(start, request.method, route, _responseStatus())
+        if cherrypy.response.stream or isinstance(resp, cherrypy.lib.file_generator):
+            return metrics.countStream(resp, request.method, route)
+        metrics.requestFinished(
+            request.method, route, len(resp) if isinstance(resp, (bytes, str)) else 0)
+        return resp
+    return endpointDecorator
 
-            val = fun(self, path, params)
 
-            # If this is a partial response, we set the status appropriately
-            if 'Content-Range' in cherrypy.response.headers:
-                cherrypy.response.status = 206
+def _responseStatus():
+    """
+    Get the status code of the current response.
+    """
+    return int(str(cherrypy.response.status or 200).split()[0])
 
-            val = _mongoCursorToList(val)
 
-            if callable(val):
-                # If the endpoint returned anything callable (function,
-                # lambda, functools.partial), we assume it's a generator
-                # function for a streaming response.
+def _endpointResponse(fun, self, path, params):
+    """
+    Handle a request for the ``endpoint`` decorator, returning the response
+    body.
+    """
+    _setCommonCORSHeaders()
+    cherrypy.request.girderRequestUid = str(uuid.uuid4())
+    setResponseHeader('Girder-Request-Uid', cherrypy.request.girderRequestUid)
+
+    try:
+        _preventRepeatedParams(params)
+
+        val = fun(self, path, params)
+
+        # If this is a partial response, we set the status appropriately
+        if 'Content-Range' in cherrypy.response.headers:
+            cherrypy.response.status = 206
+
+        # This needs to be before the callable check, as mongo cursors
+        # can be callable.
+        if isinstance(val, _MONGO_CURSOR_TYPES):
+            _setTotalCount(val)
+
+        if isinstance(val, _LIST_STREAM_TYPES):
+            contentType = _listStreamType()
+            if contentType is None:
+                val = list(val)
+            else:
+                val = _compressStream(_streamList(val, contentType))
                 cherrypy.response.stream = True
+                _setCachingHeaders()
                 _logRestRequest(self, path, params)
-                return val()
-
-            if isinstance(val, cherrypy.lib.file_generator):
-                # Don't do any post-processing of static files
                 return val
 
-            if isinstance(val, types.GeneratorType):
-                val = list(val)
+        if callable(val):
+            # If the endpoint returned anything callable (function,
+            # lambda, functools.partial), we assume it's a generator
+            # function for a streaming response.
+            cherrypy.response.stream = True
+            _setCachingHeaders()
+            _logRestRequest(self, path, params)
+            return val()
 
-        except RestException as e:
-            val = _handleRestException(e)
-        except AccessException as e:
-            val = _handleAccessException(e)
-        except GirderException as e:
-            val = _handleGirderException(e)
-        except ValidationException as e:
-            val = _handleValidationException(e)
-        except cherrypy.HTTPRedirect:
-            raise
-        except Exception:
-            # These are unexpected failures; send a 500 status
-            logger.exception('500 Error')
-            cherrypy.response.status = 500
-            val = dict(type='internal', uid=cherrypy.request.girderRequestUid)
-
-            if config.getServerMode() == ServerMode.PRODUCTION:
-                # Sanitize errors in production mode
-                val['message'] = 'An unexpected error occurred on the server.'
-            else:
-                # Provide error details in non-production modes
-                t, value, tb = sys.exc_info()
-                val['message'] = '%s: %s' % (t.__name__, repr(value))
-                val['trace'] = traceback.extract_tb(tb)
+        if isinstance(val, cherrypy.lib.file_generator):
+            # Don't do any post-processing of static files
+            return val
 
-        resp = _createResponse(val)
-        _logRestRequest(self, path, params)
+    except cherrypy.HTTPRedirect:
+        raise
+    except Exception as e:
+        val = _handleException(e)
 
-        return resp
-    return endpointDecorator
+    _setCachingHeaders()
+    resp = _compressResponse(_createResponse(val))
+    _logRestRequest(self, path, params)
+
+    return resp
+
+
+def getTokenUser(token):
+    """
+    Get the user that a token authenticates, without regard to the token's
+    scopes.
+
+    :param token: The token document, or None.
+    :type token: dict or None
+    :returns: the user document, or None if the token is missing, expired, or
+        not associated with a user.
+    """
+    if (token is None
+            or token['expires'] < datetime.datetime.utcnow()
+            or 'userId' not in token):
+        return None
+    return User().load(token['userId'], force=True)
+
+
+class _EmptyRequestBody:
+    """
+    The body of a sub-request.  Sub-requests pass everything, including
+    parameters that would otherwise be sent in a body, as params.
+    """
+
+    length = 0
+
+    def read(self, size=None):
+        return b''
+
+    def readline(self, size=None):
+        return b''
+
+    def process(self):
+        pass
+
+
+def runSubRequest(resource, method, path, params, token=None, user=None, request=None):
+    """
+    Handle a request for a route of a resource as part of the current
+    request, as the batch endpoint does.  The sub-request is handled with its
+    own copy of the request and a separate response, so its status and
+    headers don't affect the outer response.  Authentication uses the given
+    token and user rather than reading them again, but the token's scopes are
+    checked against the route as usual.  Cookies are never used.
+
+    :param resource: The resource that the route belongs to.
+    :type resource: Resource
+    :param method: The HTTP method of the sub-request.
+    :type method: str
+    :param path: The path of the sub-request, relative to the resource.
+    :type path: tuple[str]
+    :param params: The parameters of the sub-request.
+    :type params: dict
+    :param token: The token the outer request was authenticated with.
+    :type token: dict or None
+    :param user: The user of the token, as returned by ``getTokenUser``.
+    :type user: dict or None
+    :param request: The outer request.  This must be passed when running on a
+        thread other than the one handling the outer request.
+    :returns: a tuple of the status code, the response value, and the value
+        of the Girder-Total-Count header (or None).
+    """
+    serving = cherrypy.serving
+    outer = serving.request, serving.response
+    request = request or serving.request
+    subRequest = copy.copy(request)
+    for attr in ('girderUser', 'requiredScopes', 'girderAllowCookie', 'girderRawResponse',
+                 'girderNoAuditLog', 'girderRoute'):
+        subRequest.__dict__.pop(attr, None)
+    subRequest.method = method.upper()
+    subRequest.params = params
+    subRequest.cookie = type(request.cookie)()
+    # The outer request's body has already been read, and isn't this one's
+    subRequest.body = _EmptyRequestBody()
+    subRequest.headers = type(request.headers)(
+        (key, value) for key, value in request.headers.items()
+        if key.lower() not in ('content-length', 'content-type', 'transfer-encoding'))
+    subRequest.headers['Content-Length'] = '0'
+    serving.load(subRequest, type(serving.response)())
+    try:
+        try:
+            compiled, _ = resource._matchCompiledRoute(method.lower(), path)
+            subUser = None
+            if user is not None:
+                try:
+                    ensureTokenScopes(token, compiled.requiredScopes)
+                    subUser = user
+                except AccessException:
+                    pass
+            setCurrentUser(subUser)
+
+            val = resource.handleRoute(method, path, params)
+            if isinstance(val, _MONGO_CURSOR_TYPES):
+                _setTotalCount(val)
+            if isinstance(val, _LIST_STREAM_TYPES):
+                val = list(val)
+            elif callable(val) or isinstance(val, cherrypy.lib.file_generator):
+                raise RestException('Streamed responses cannot be part of a batch request.')
+        except cherrypy.HTTPRedirect as e:
+            serving.response.status = e.code
+            val = {'location': e.urls[0] if e.urls else None}
+        except Exception as e:
+            val = _handleException(e)
+        _logRestRequest(resource, path, params)
+        return _responseStatus(), val, serving.response.headers.get('Girder-Total-Count')
+    finally:
+        serving.load(*outer)
+
+
+def _setCachingHeaders():
+    """
+    Responses are not cacheable unless the endpoint set its own Cache-Control
+    header, as file downloads do.  Error responses are never cacheable.
+    """
+    headers = cherrypy.response.headers
+    status = cherrypy.response.status
+    if status and int(str(status).split()[0]) >= 400:
+        for key in ('Cache-Control', 'ETag', 'Last-Modified'):
+            headers.pop(key, None)
+    if 'Cache-Control' not in headers:
+        cherrypy.lib.caching.expires(0)
 
 
 def ensureTokenScopes(token, scope):
@@ -757,6 +1271,100 @@ def _setCommonCORSHeaders():
             setResponseHeader('Access-Control-Allow-Origin', '*')
 
 
+class _CompiledRoute:
+    """
+    A registered route, with everything that handling a request for it needs
+    that can be worked out in advance.
+    """
+
+    __slots__ = ('route', 'handler', 'priority', 'wildcards', 'routeStr', 'beforeEvent',
+                 'afterEvent', 'requiredScopes', 'cookieAuth')
+
+    def __init__(self, method, route, handler, priority, resource):
+        self.route = route
+        self.handler = handler
+        self.priority = priority
+        self.wildcards = tuple(
+            (i, component[1:]) for i, component in enumerate(route) if component[:1] == ':')
+        self.routeStr = '/'.join((resource, '/'.join(route))).rstrip('/')
+        eventPrefix = '.'.join(('rest', method, self.routeStr))
+        self.beforeEvent = eventPrefix + '.before'
+        self.afterEvent = eventPrefix + '.after'
+        self.requiredScopes = getattr(handler, 'requiredScopes', None) or TokenScope.USER_AUTH
+        self.cookieAuth = getattr(handler, 'cookieAuth', False)
+
+
+class _RouteTrieNode:
+    __slots__ = ('literals', 'wildcard', 'route')
+
+    def __init__(self):
+        self.literals = {}
+        self.wildcard = None
+        self.route = None
+
+
+class _RouteDispatcher:
+    """
+    The routes of a resource, compiled into a trie for each HTTP method and
+    route length.  A path matches the same route as it would by checking the
+    routes in their registered order: if it matches several, the one that
+    comes first in that order is used.
+
+    :param routes: The routes of the resource, as kept by ``Resource._routes``.
+    :param resourceName: A function that returns the resource name used in
+        event names for a route handler.
+    """
+
+    def __init__(self, routes, resourceName):
+        self._tries = {}
+        for method, lengths in routes.items():
+            for length, nLengthRoutes in lengths.items():
+                root = _RouteTrieNode()
+                for priority, (route, handler) in enumerate(nLengthRoutes):
+                    node = root
+                    for component in route:
+                        if component[:1] == ':':
+                            if node.wildcard is None:
+                                node.wildcard = _RouteTrieNode()
+                            node = node.wildcard
+                        else:
+                            node = node.literals.setdefault(component, _RouteTrieNode())
+                    if node.route is None:
+                        node.route = _CompiledRoute(
+                            method, route, handler, priority, resourceName(handler))
+                self._tries[(method, length)] = root
+
+    def match(self, method, path):
+        """
+        Find the route matching a request.
+
+        :param method: The HTTP method, in lowercase.
+        :type method: str
+        :param path: The requested path.
+        :type path: tuple[str]
+        :returns: The matching ``_CompiledRoute``, or None.
+        """
+        root = self._tries.get((method, len(path)))
+        if root is None:
+            return None
+        best = None
+        pathLen = len(path)
+        stack = [(root, 0)]
+        while stack:
+            node, depth = stack.pop()
+            if depth == pathLen:
+                if node.route is not None and (
+                        best is None or node.route.priority < best.priority):
+                    best = node.route
+                continue
+            if node.wildcard is not None:
+                stack.append((node.wildcard, depth + 1))
+            child = node.literals.get(path[depth])
+            if child is not None:
+                stack.append((child, depth + 1))
+        return best
+
+
 class Resource:
     """
     All REST resources should inherit from this class, which provides utilities
@@ -768,6 +1376,7 @@ class Resource:
     def __init__(self):
         self._routes = collections.defaultdict(
             lambda: collections.defaultdict(list))
+        self._dispatcher = None
 
     def _ensureInit(self):
         """
@@ -816,6 +1425,7 @@ class Resource:
                 break
         else:
             nLengthRoutes.append((route, handler))
+        self._dispatcher = None
 
         # Now handle the api doc if the handler has any attached
         if resource is None and hasattr(self, 'resourceName'):
@@ -863,6 +1473,7 @@ class Resource:
                 break
         else:
             raise GirderException('No such route: %s %s' % (method, '/'.join(route)))
+        self._dispatcher = None
 
         # Remove the api doc
         if resource is None:
@@ -938,30 +1549,23 @@ class Resource:
         """
         method = method.lower()
 
-        route, handler, kwargs = self._matchRoute(method, path)
+        compiled, kwargs = self._matchCompiledRoute(method, path)
+        handler = compiled.handler
 
-        cherrypy.request.requiredScopes = getattr(
-            handler, 'requiredScopes', None) or TokenScope.USER_AUTH
+        cherrypy.request.requiredScopes = compiled.requiredScopes
+        cherrypy.request.girderRoute = compiled.routeStr
 
-        if getattr(handler, 'cookieAuth', False):
+        if compiled.cookieAuth:
             cherrypy.request.girderAllowCookie = True
 
         kwargs['params'] = params
         # Add before call for the API method. Listeners can return
         # their own responses by calling preventDefault() and
         # adding a response on the event.
-
-        if hasattr(self, 'resourceName'):
-            resource = self.resourceName
-        else:
-            resource = handler.__module__.rsplit('.', 1)[-1]
-
-        routeStr = '/'.join((resource, '/'.join(route))).rstrip('/')
-        eventPrefix = '.'.join(('rest', method, routeStr))
-
-        event = events.trigger('.'.join((eventPrefix, 'before')),
-                               kwargs, pre=self._defaultAccess)
-        if event.defaultPrevented and len(event.responses) > 0:
+        event = None
+        if events.hasHandlers(compiled.beforeEvent):
+            event = events.trigger(compiled.beforeEvent, kwargs, pre=self._defaultAccess)
+        if event is not None and event.defaultPrevented and len(event.responses) > 0:
             val = event.responses[0]
         else:
             self._defaultAccess(handler)
@@ -971,10 +1575,15 @@ class Resource:
         # return value of the API method that was called. You can
         # reassign the return value completely by adding a response to
         # the event and calling preventDefault() on it.
-        kwargs['returnVal'] = val
-        event = events.trigger('.'.join((eventPrefix, 'after')), kwargs)
-        if event.defaultPrevented and len(event.responses) > 0:
-            val = event.responses[0]
+        if events.hasHandlers(compiled.afterEvent):
+            if isinstance(val, FilteredResults):
+                # Handlers expect a list that they can read and modify, rather
+                # than results that can only be read once.
+                val = val._materialize()
+            kwargs['returnVal'] = val
+            event = events.trigger(compiled.afterEvent, kwargs)
+            if event.defaultPrevented and len(event.responses) > 0:
+                val = event.responses[0]
 
         return val
 
@@ -994,20 +1603,41 @@ class Resource:
         :raises: `GirderException`, when no routes are defined on this resource.
         :raises: `RestException`, when no route can be matched.
         """
+        compiled, wildcards = self._matchCompiledRoute(method, path)
+        return compiled.route, compiled.handler, wildcards
+
+    def _matchCompiledRoute(self, method, path):
+        """
+        Match the requested ``method`` and ``path`` against the compiled routes,
+        compiling them first if routes have changed since they last were.
+
+        :param method: The requested HTTP method, in lowercase.
+        :type method: str
+        :param path: The requested path.
+        :type path: tuple[str]
+        :returns: A tuple of ``(compiled route, wildcards)``.
+        :raises: `GirderException`, when no routes are defined on this resource.
+        :raises: `RestException`, when no route can be matched.
+        """
         if not self._routes:
             raise GirderException('No routes defined for resource')
 
-        for route, handler in self._routes[method][len(path)]:
-            wildcards = {}
-            for routeComponent, pathComponent in zip(route, path):
-                if routeComponent[0] == ':':  # Wildcard token
-                    wildcards[routeComponent[1:]] = pathComponent
-                elif routeComponent != pathComponent:  # Exact match token
-                    break
-            else:
-                return route, handler, wildcards
+        dispatcher = getattr(self, '_dispatcher', None)
+        if dispatcher is None:
+            dispatcher = self._dispatcher = _RouteDispatcher(self._routes, self._routeResourceName)
+        compiled = dispatcher.match(method, path)
+        if compiled is None:
+            raise RestException(
+                'No matching route for "%s %s"' % (method.upper(), '/'.join(path)))
+        return compiled, {name: path[i] for i, name in compiled.wildcards}
 
-        raise RestException('No matching route for "%s %s"' % (method.upper(), '/'.join(path)))
+    def _routeResourceName(self, handler):
+        """
+        The resource name used in the event names of a route handler.
+        """
+        if hasattr(self, 'resourceName'):
+            return self.resourceName
+        return handler.__module__.rsplit('.', 1)[-1]
 
     def requireParams(self, required, provided=None):
         """
@@ -60,6 +60,11 @@ class Assetstore(Resource):
         .param('type', 'Type of the assetstore.', dataType='integer')
         .param('root', 'Root path on disk (for filesystem type).', required=False)
         .param('perms', 'File creation permissions (for filesystem type).', required=False)
+        .param('downloadOffload', 'Whether downloads are served by a fronting proxy '
+               '(for filesystem type).', required=False,
+               enum=('none', 'x-sendfile', 'x-accel-redirect'))
+        .param('downloadOffloadPrefix', 'The proxy location that maps to the root, for '
+               'X-Accel-Redirect (for filesystem type).', required=False)
         .param('db', 'Database name (for GridFS type)', required=False)
         .param('mongohost', 'Mongo host URI (for GridFS type)', required=False)
         .param('replicaset', 'Replica set name (for GridFS type)', required=False)
@@ -83,16 +88,26 @@ class Assetstore(Resource):
                'ignore accessKeyId and secret.', dataType='boolean', required=False)
         .param('serverSideEncryption', 'Whether to use S3 SSE to encrypt the objects uploaded to '
                'this bucket (for S3 type).', dataType='boolean', required=False, default=False)
+        .param('proxiedUploadConcurrency', 'The number of parts of uploads proxied through the '
+               'server that may be sent to S3 concurrently.  If 0, each part is sent before '
+               'its chunk request returns (for S3 type).', dataType='integer', required=False,
+               default=0)
+        .param('proxiedDownloadConcurrency', 'The number of ranged parts of large objects that '
+               'are fetched from S3 concurrently when they are streamed through the server.  If '
+               '0, each object is streamed with a single request (for S3 type).',
+               dataType='integer', required=False, default=0)
         .errorResponse()
         .errorResponse('You are not an administrator.', 403)
     )
-    def createAssetstore(self, name, type, root, perms, db, mongohost, replicaset, bucket,
-                         prefix, accessKeyId, secret, service, readOnly, region, inferCredentials,
-                         serverSideEncryption):
+    def createAssetstore(self, name, type, root, perms, downloadOffload, downloadOffloadPrefix,
+                         db, mongohost, replicaset, bucket, prefix, accessKeyId, secret, service,
+                         readOnly, region, inferCredentials, serverSideEncryption,
+                         proxiedUploadConcurrency):
         if type == AssetstoreType.FILESYSTEM:
             self.requireParams({'root': root})
             return self._model.createFilesystemAssetstore(
-                name=name, root=root, perms=perms)
+                name=name, root=root, perms=perms, downloadOffload=downloadOffload or 'none',
+                downloadOffloadPrefix=downloadOffloadPrefix or '')
         elif type == AssetstoreType.GRIDFS:
             self.requireParams({'db': db})
             return self._model.createGridFsAssetstore(
@@ -102,7 +117,9 @@ class Assetstore(Resource):
             return self._model.createS3Assetstore(
                 name=name, bucket=bucket, prefix=prefix, secret=secret,
                 accessKeyId=accessKeyId, service=service, readOnly=readOnly, region=region,
-                inferCredentials=inferCredentials, serverSideEncryption=serverSideEncryption)
+                inferCredentials=inferCredentials, serverSideEncryption=serverSideEncryption,
+                proxiedUploadConcurrency=proxiedUploadConcurrency,
+                proxiedDownloadConcurrency=proxiedDownloadConcurrency)
         else:
             raise RestException('Invalid type parameter')
 
@@ -154,6 +171,11 @@ class Assetstore(Resource):
         .param('name', 'Unique name for the assetstore.', strip=True)
         .param('root', 'Root path on disk (for Filesystem type)', required=False)
         .param('perms', 'File creation permissions (for Filesystem type)', required=False)
+        .param('downloadOffload', 'Whether downloads are served by a fronting proxy '
+               '(for filesystem type).', required=False,
+               enum=('none', 'x-sendfile', 'x-accel-redirect'))
+        .param('downloadOffloadPrefix', 'The proxy location that maps to the root, for '
+               'X-Accel-Redirect (for filesystem type).', required=False)
         .param('db', 'Database name (for GridFS type)', required=False)
         .param('mongohost', 'Mongo host URI (for GridFS type)', required=False)
         .param('replicaset', 'Replica set name (for GridFS type)', required=False)
@@ -178,12 +200,22 @@ class Assetstore(Resource):
                'ignore accessKeyId and secret.', dataType='boolean', required=False)
         .param('serverSideEncryption', 'Whether to use S3 SSE to encrypt the objects uploaded to '
                'this bucket (for S3 type).', dataType='boolean', required=False, default=False)
+        .param('proxiedUploadConcurrency', 'The number of parts of uploads proxied through the '
+               'server that may be sent to S3 concurrently.  If 0, each part is sent before '
+               'its chunk request returns (for S3 type).', dataType='integer', required=False,
+               default=0)
+        .param('proxiedDownloadConcurrency', 'The number of ranged parts of large objects that '
+               'are fetched from S3 concurrently when they are streamed through the server.  If '
+               '0, each object is streamed with a single request (for S3 type).',
+               dataType='integer', required=False, default=0)
         .errorResponse()
         .errorResponse('You are not an administrator.', 403)
     )
-    def updateAssetstore(self, assetstore, name, root, perms, db, mongohost, replicaset,
-                         bucket, prefix, accessKeyId, secret, service, readOnly, region, current,
-                         inferCredentials, serverSideEncryption, params):
+    def updateAssetstore(self, assetstore, name, root, perms, downloadOffload,
+                         downloadOffloadPrefix, db, mongohost, replicaset, bucket, prefix,
+                         accessKeyId, secret, service, readOnly, region, current,
+                         inferCredentials, serverSideEncryption, proxiedUploadConcurrency,
+                         proxiedDownloadConcurrency, params):
         assetstore['name'] = name
         assetstore['current'] = current
 
@@ -192,6 +224,10 @@ class Assetstore(Resource):
             assetstore['root'] = root
             if perms is not None:
                 assetstore['perms'] = perms
+            if downloadOffload is not None:
+                assetstore['downloadOffload'] = downloadOffload
+            if downloadOffloadPrefix is not None:
+                assetstore['downloadOffloadPrefix'] = downloadOffloadPrefix
         elif assetstore['type'] == AssetstoreType.GRIDFS:
             self.requireParams({'db': db})
             assetstore['db'] = db
@@ -211,6 +247,8 @@ class Assetstore(Resource):
             assetstore['region'] = region
             assetstore['inferCredentials'] = inferCredentials
             assetstore['serverSideEncryption'] = serverSideEncryption
+            assetstore['proxiedUploadConcurrency'] = proxiedUploadConcurrency
+            assetstore['proxiedDownloadConcurrency'] = proxiedDownloadConcurrency
             if readOnly is not None:
                 assetstore['readOnly'] = readOnly
         else:
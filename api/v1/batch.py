@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import concurrent.futures
+import json
+import threading
+
+import cherrypy
+
+from ..describe import Description, autoDescribeRoute
+from ..rest import Resource, getCurrentToken, getTokenUser, runSubRequest
+from girder.api import access
+from girder.exceptions import RestException
+from girder.utility.resource import _apiRouteMap
+
+# The largest number of sub-requests accepted in a single batch
+MAX_BATCH_REQUESTS = 100
+# The number of threads used to run read-only sub-requests concurrently
+BATCH_WORKERS = 8
+
+_BATCH_METHODS = {'GET', 'POST', 'PUT', 'PATCH', 'DELETE'}
+
+_pool = None
+_poolLock = threading.Lock()
+
+
+def _getPool():
+    global _pool
+    with _poolLock:
+        if _pool is None:
+            _pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=BATCH_WORKERS, thread_name_prefix='girder-batch')
+        return _pool
+
+
+class Batch(Resource):
+    """
+    API Endpoint for sending several requests at once.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.resourceName = 'batch'
+        self.route('POST', (), self.batch)
+
+    @access.public
+    @autoDescribeRoute(
+        Description('Send several API requests at once.')
+        .notes('Each sub-request is an object with a "method", a "path" relative to the '
+               'API root (e.g. "folder/:id"), and optionally "params".  Parameters that '
+               'would otherwise be sent in a request body, such as JSON metadata, are '
+               'passed in "params".  The response is a list with an object for each '
+               'sub-request, in order, holding its "status", its "body", and for paged '
+               'lists its "totalCount".  Sub-requests are authenticated with the token of '
+               'this request and are subject to the same access checks as if they were '
+               'sent separately.  Streamed responses, such as file downloads, are not '
+               'supported.')
+        .jsonParam('requests', 'A JSON list of sub-requests.', paramType='body',
+                   requireArray=True)
+        .param('concurrent', 'Whether consecutive GET sub-requests may be run at the '
+               'same time.  Other sub-requests always run in order, one at a time.',
+               required=False, dataType='boolean', default=False)
+        .errorResponse('The list of sub-requests was invalid.')
+    )
+    def batch(self, requests, concurrent):
+        if len(requests) > MAX_BATCH_REQUESTS:
+            raise RestException(
+                'A batch may contain at most %d requests.' % MAX_BATCH_REQUESTS)
+        subRequests = [self._parseSubRequest(index, sub) for index, sub in enumerate(requests)]
+
+        token = getCurrentToken()
+        user = getTokenUser(token)
+        request = cherrypy.request
+        results = [None] * len(subRequests)
+
+        def run(index):
+            resource, method, path, params = subRequests[index]
+            if resource is None:
+                results[index] = {
+                    'status': 400,
+                    'body': {'message': 'No matching resource for "%s".' % '/'.join(path),
+                             'type': 'rest'}}
+                return
+            status, body, totalCount = runSubRequest(
+                resource, method, path, params, token=token, user=user, request=request)
+            results[index] = {'status': status, 'body': body}
+            if totalCount is not None:
+                results[index]['totalCount'] = totalCount
+
+        index = 0
+        while index < len(subRequests):
+            # Run a sequence of GET requests concurrently, if allowed
+            end = index
+            while concurrent and end < len(subRequests) and subRequests[end][1] == 'GET':
+                end += 1
+            if end - index > 1:
+                list(_getPool().map(run, range(index, end)))
+                index = end
+            else:
+                run(index)
+                index += 1
+        return results
+
+    def _parseSubRequest(self, index, sub):
+        """
+        Validate a sub-request and find the resource it is for.
+
+        :returns: a tuple of the resource (or None if there is no resource
+            at the path), method, path relative to the resource, and params.
+        """
+        if not isinstance(sub, dict) or not isinstance(sub.get('path'), str):
+            raise RestException('Request %d must be an object with a "path".' % index)
+        method = str(sub.get('method', 'GET')).upper()
+        if method not in _BATCH_METHODS:
+            raise RestException('Request %d has an unsupported method "%s".' % (index, method))
+        params = sub.get('params') or {}
+        if not isinstance(params, dict):
+            raise RestException('The params of request %d must be an object.' % index)
+        # Parameters normally arrive as strings; encode anything else as JSON
+        params = {
+            key: value if isinstance(value, str) else json.dumps(value)
+            for key, value in params.items()}
+
+        path = tuple(component for component in sub['path'].split('/') if component)
+        resource = None
+        for candidate, mountPath in _apiRouteMap().items():
+            mountPath = tuple(mountPath)
+            if path[:len(mountPath)] == mountPath and (
+                    resource is None or len(mountPath) > len(resourcePath)):
+                resource, resourcePath = candidate, mountPath
+        if resource is None:
+            return None, method, path, params
+        if resource is self:
+            raise RestException('Request %d cannot be a batch request.' % index)
+        return resource, method, path[len(resourcePath):], params
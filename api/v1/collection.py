@@ -1,11 +1,12 @@
 # -*- coding: utf-8 -*-
 from ..describe import Description, autoDescribeRoute
-from ..rest import Resource, filtermodel, setResponseHeader, setContentDisposition
+from ..rest import Resource, filtermodel, setRangedResponse, setResponseHeader, \
+    setContentDisposition
 from girder.api import access
 from girder.constants import AccessType, TokenScope
 from girder.models.collection import Collection as CollectionModel
-from girder.exceptions import AccessException
-from girder.utility import ziputil
+from girder.exceptions import AccessException, RestException
+from girder.utility import bandwidth, tarutil, ziputil
 from girder.utility.progress import ProgressContext
 
 
@@ -108,22 +109,46 @@ class Collection(Resource):
         .modelParam('id', model=CollectionModel, level=AccessType.READ)
         .jsonParam('mimeFilter', 'JSON list of MIME types to include.', requireArray=True,
                    required=False)
-        .produces('application/zip')
+        .param('seekable', 'Build an uncompressed archive whose length is known in advance.  '
+               'The response then has a Content-Length and supports Range requests, so an '
+               'interrupted download can be resumed.', required=False, dataType='boolean',
+               default=False)
+        .param('format', 'The archive format.', required=False,
+               enum=['zip', 'tar', 'tgz'], default='zip')
+        .produces(['application/zip', 'application/x-tar', 'application/gzip'])
         .errorResponse('ID was invalid.')
         .errorResponse('Read access was denied for the collection.', 403)
     )
-    def downloadCollection(self, collection, mimeFilter):
+    def downloadCollection(self, collection, mimeFilter, seekable, format):
+        if format != 'zip':
+            if seekable:
+                raise RestException('Seekable downloads are only supported in zip format.')
+            mimeType, extension = tarutil.FORMATS[format]
+            setResponseHeader('Content-Type', mimeType)
+            setContentDisposition(collection['name'] + extension)
+            return bandwidth.throttle(tarutil.TarGenerator(collection['name']).stream(
+                tarutil.fileEntries(self._model.fileList(
+                    collection, user=self.getCurrentUser(), subpath=False,
+                    mimeFilter=mimeFilter, data=False)),
+                compress=format == 'tgz'))
+
         setResponseHeader('Content-Type', 'application/zip')
         setContentDisposition(collection['name'] + '.zip')
 
+        if seekable:
+            plan = ziputil.ZipPlan(ziputil.seekableEntries(self._model.fileList(
+                collection, user=self.getCurrentUser(), subpath=False, mimeFilter=mimeFilter,
+                data=False)), collection['name'])
+            start, end = setRangedResponse(plan.size, plan.etag)
+            return bandwidth.throttle(lambda: plan.generate(start, end))
+
         def stream():
-            zip = ziputil.ZipGenerator(collection['name'])
-            for (path, file) in self._model.fileList(
-                    collection, user=self.getCurrentUser(), subpath=False, mimeFilter=mimeFilter):
-                for data in zip.addFile(file, path):
-                    yield data
+            zip = ziputil.ZipGenerator(collection['name'], compression=ziputil.DEFLATE)
+            yield from zip.addFiles(ziputil.fileEntries(self._model.fileList(
+                collection, user=self.getCurrentUser(), subpath=False, mimeFilter=mimeFilter,
+                data=False)))
             yield zip.footer()
-        return stream
+        return bandwidth.throttle(stream)
 
     @access.user(scope=TokenScope.DATA_OWN)
     @autoDescribeRoute(
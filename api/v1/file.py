@@ -3,7 +3,7 @@ import cherrypy
 import errno
 
 from ..describe import Description, autoDescribeRoute, describeRoute
-from ..rest import Resource, filtermodel
+from ..rest import Resource, filtermodel, setResponseHeader
 from ...constants import AccessType, TokenScope
 from girder.exceptions import AccessException, GirderException, RestException
 from girder.models.assetstore import Assetstore
@@ -17,6 +17,10 @@ from girder.utility.progress import ProgressContext
 
 import logging
 
+# How long, in seconds, downloads of immutable content may be cached
+IMMUTABLE_CACHE_MAX_AGE = 365 * 24 * 60 * 60
+
+
 class File(Resource):
     """
     API Endpoint for files. Includes utilities for uploading and downloading
@@ -154,6 +158,12 @@ class File(Resource):
         if upload['userId'] != user['_id']:
             raise AccessException('You did not initiate this upload.')
 
+        if upload['received'] != upload['size'] and 'behavior' not in upload:
+            # Upload progress is only checkpointed periodically, so the stored
+            # data may be ahead of the upload document.
+            upload = Upload().restoreProgress(upload)
+            if upload['received'] != upload['size']:
+                upload = Upload().reconcileUpload(upload)
         # If we don't have as much data as we were told would be uploaded and
         # the upload hasn't specified it has an alternate behavior, refuse to
         # complete the upload.
@@ -162,6 +172,11 @@ class File(Resource):
                 'Server has only received %s bytes, but the file should be %s bytes.' %
                 (upload['received'], upload['size']))
 
+        if 'pendingFileId' in upload:
+            pending = self._model.load(upload['pendingFileId'], force=True)
+            if pending and pending.get('finalizing') and not pending.get('finalizeError'):
+                raise RestException('This upload is already being finalized.')
+
         file = Upload().finalizeUpload(upload)
         extraKeys = file.get('additionalFinalizeKeys', ())
         return self._model.filter(file, user, additionalKeys=extraKeys)
@@ -231,6 +246,14 @@ class File(Resource):
         if upload['userId'] != user['_id']:
             raise AccessException('You did not initiate this upload.')
 
+        if upload['received'] != offset:
+            # Upload progress is only checkpointed periodically, so the stored
+            # data may be ahead of the upload document.  This process usually
+            # has the rest of the progress; otherwise, such as after a
+            # restart, it has to be recovered from the stored data.
+            upload = Upload().restoreProgress(upload)
+            if upload['received'] != offset:
+                upload = Upload().reconcileUpload(upload)
         if upload['received'] != offset:
             raise RestException(
                 'Server has received %s bytes, but client sent offset %s.' % (
@@ -247,7 +270,8 @@ class File(Resource):
     @autoDescribeRoute(
         Description('Download a file.')
         .notes('This endpoint also accepts the HTTP "Range" header for partial '
-               'file downloads.')
+               'file downloads.  Multiple ranges are returned as a '
+               'multipart/byteranges response.')
         .modelParam('id', model=FileModel, level=AccessType.READ)
         .param('offset', 'Start downloading at this offset in bytes within '
                'the file.', dataType='integer', required=False, default=0)
@@ -262,20 +286,30 @@ class File(Resource):
                enum=['inline', 'attachment'], default='attachment')
         .param('extraParameters', 'Arbitrary data to send along with the download request.',
                required=False)
+        .param('sha512', 'The SHA-512 hash of the file.  If this matches, the URL refers to '
+               'immutable content, so the response may be cached indefinitely.',
+               required=False)
         .errorResponse('ID was invalid.')
         .errorResponse('Read access was denied on the parent folder.', 403)
     )
-    def download(self, file, offset, endByte, contentDisposition, extraParameters):
+    def download(self, file, offset, endByte, contentDisposition, extraParameters, sha512):
         """
         Defers to the underlying assetstore adapter to stream a file out.
         Requires read permission on the folder that contains the file's item.
         """
+        if sha512 and sha512 == file.get('sha512'):
+            setResponseHeader(
+                'Cache-Control', 'private, max-age=%d, immutable' % IMMUTABLE_CACHE_MAX_AGE)
+
         rangeHeader = cherrypy.lib.httputil.get_ranges(
             cherrypy.request.headers.get('Range'), file.get('size', 0))
 
         # The HTTP Range header takes precedence over query params
+        if rangeHeader and len(rangeHeader) > 1:
+            return self._model.downloadRanges(
+                file, rangeHeader, contentDisposition=contentDisposition,
+                extraParameters=extraParameters)
         if rangeHeader and len(rangeHeader):
-            # Currently we only support a single range.
             offset, endByte = rangeHeader[0]
 
         return self._model.download(
@@ -1,11 +1,12 @@
 # -*- coding: utf-8 -*-
 from ..describe import Description, autoDescribeRoute
-from ..rest import Resource, filtermodel, setResponseHeader, setContentDisposition
+from ..rest import Resource, filtermodel, setRangedResponse, setResponseHeader, \
+    setContentDisposition
 from girder.api import access
 from girder.constants import AccessType, TokenScope, SortDir
 from girder.exceptions import RestException
 from girder.models.folder import Folder as FolderModel
-from girder.utility import ziputil
+from girder.utility import bandwidth, tarutil, ziputil
 from girder.utility.model_importer import ModelImporter
 from girder.utility.progress import ProgressContext
 
@@ -150,27 +151,50 @@ class Folder(Resource):
         .modelParam('id', model=FolderModel, level=AccessType.READ)
         .jsonParam('mimeFilter', 'JSON list of MIME types to include.', required=False,
                    requireArray=True)
-        .produces('application/zip')
+        .param('seekable', 'Build an uncompressed archive whose length is known in advance.  '
+               'The response then has a Content-Length and supports Range requests, so an '
+               'interrupted download can be resumed.', required=False, dataType='boolean',
+               default=False)
+        .param('format', 'The archive format.', required=False,
+               enum=['zip', 'tar', 'tgz'], default='zip')
+        .produces(['application/zip', 'application/x-tar', 'application/gzip'])
         .errorResponse('ID was invalid.')
         .errorResponse('Read access was denied for the folder.', 403)
     )
-    def downloadFolder(self, folder, mimeFilter):
+    def downloadFolder(self, folder, mimeFilter, seekable, format):
         """
-        Returns a generator function that will be used to stream out a zip
-        file containing this folder's contents, filtered by permissions.
+        Returns a generator function that will be used to stream out an
+        archive file containing this folder's contents, filtered by
+        permissions.
         """
+        user = self.getCurrentUser()
+        if format != 'zip':
+            if seekable:
+                raise RestException('Seekable downloads are only supported in zip format.')
+            mimeType, extension = tarutil.FORMATS[format]
+            setResponseHeader('Content-Type', mimeType)
+            setContentDisposition(folder['name'] + extension)
+            return bandwidth.throttle(tarutil.TarGenerator(folder['name']).stream(
+                tarutil.fileEntries(self._model.fileList(
+                    folder, user=user, subpath=False, mimeFilter=mimeFilter, data=False)),
+                compress=format == 'tgz'))
+
         setResponseHeader('Content-Type', 'application/zip')
         setContentDisposition(folder['name'] + '.zip')
-        user = self.getCurrentUser()
+
+        if seekable:
+            plan = ziputil.ZipPlan(ziputil.seekableEntries(self._model.fileList(
+                folder, user=user, subpath=False, mimeFilter=mimeFilter, data=False)),
+                folder['name'])
+            start, end = setRangedResponse(plan.size, plan.etag)
+            return bandwidth.throttle(lambda: plan.generate(start, end))
 
         def stream():
-            zip = ziputil.ZipGenerator(folder['name'])
-            for (path, file) in self._model.fileList(
-                    folder, user=user, subpath=False, mimeFilter=mimeFilter):
-                for data in zip.addFile(file, path):
-                    yield data
+            zip = ziputil.ZipGenerator(folder['name'], compression=ziputil.DEFLATE)
+            yield from zip.addFiles(ziputil.fileEntries(self._model.fileList(
+                folder, user=user, subpath=False, mimeFilter=mimeFilter, data=False)))
             yield zip.footer()
-        return stream
+        return bandwidth.throttle(stream)
 
     @access.user(scope=TokenScope.DATA_WRITE)
     @filtermodel(model=FolderModel)
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 from ..describe import Description, autoDescribeRoute
 from ..rest import Resource, filtermodel, setResponseHeader, setContentDisposition
-from girder.utility import ziputil
+from girder.utility import bandwidth, ziputil
 from girder.constants import AccessType, TokenScope, SortDir
 from girder.exceptions import RestException
 from girder.api import access
@@ -250,12 +250,11 @@ class Item(Resource):
         setContentDisposition(item['name'] + '.zip')
 
         def stream():
-            zip = ziputil.ZipGenerator(item['name'])
-            for (path, file) in self._model.fileList(item, subpath=False):
-                for data in zip.addFile(file, path):
-                    yield data
+            zip = ziputil.ZipGenerator(item['name'], compression=ziputil.DEFLATE)
+            yield from zip.addFiles(ziputil.fileEntries(
+                self._model.fileList(item, subpath=False, data=False)))
             yield zip.footer()
-        return stream
+        return bandwidth.throttle(stream)
 
     @access.public(scope=TokenScope.DATA_READ)
     @filtermodel(model=File)
@@ -1,12 +1,13 @@
 # -*- coding: utf-8 -*-
 from ..describe import Description, autoDescribeRoute
-from ..rest import Resource as BaseResource, setResponseHeader, setContentDisposition
+from ..rest import Resource as BaseResource, setRangedResponse, setResponseHeader, \
+    setContentDisposition
 from girder.constants import AccessType, TokenScope
 from girder.exceptions import RestException
 from girder.api import access
 from girder.utility import parseTimestamp
 from girder.utility.search import getSearchModeHandler
-from girder.utility import ziputil
+from girder.utility import bandwidth, tarutil, ziputil
 from girder.utility import path as path_util
 from girder.utility.model_importer import ModelImporter
 from girder.utility.progress import ProgressContext
@@ -145,43 +146,65 @@ class Resource(BaseResource):
                    '"folder": [(folder id 1)]}.', requireObject=True)
         .param('includeMetadata', 'Include any metadata in JSON files in the '
                'archive.', required=False, dataType='boolean', default=False)
-        .produces('application/zip')
+        .param('seekable', 'Build an uncompressed archive whose length is known in advance.  '
+               'The response then has a Content-Length and supports Range requests, so an '
+               'interrupted download can be resumed.', required=False, dataType='boolean',
+               default=False)
+        .param('format', 'The archive format.', required=False,
+               enum=['zip', 'tar', 'tgz'], default='zip')
+        .produces(['application/zip', 'application/x-tar', 'application/gzip'])
         .errorResponse('Unsupported or unknown resource type.')
         .errorResponse('Invalid resources format.')
         .errorResponse('No resources specified.')
         .errorResponse('Resource not found.')
         .errorResponse('Read access was denied for a resource.', 403)
     )
-    def download(self, resources, includeMetadata):
+    def download(self, resources, includeMetadata, seekable, format):
         """
-        Returns a generator function that will be used to stream out a zip
-        file containing the listed resource's contents, filtered by
+        Returns a generator function that will be used to stream out an
+        archive file containing the listed resource's contents, filtered by
         permissions.
         """
         user = self.getCurrentUser()
         self._validateResourceSet(resources)
-        # Check that all the resources are valid, so we don't download the zip
+        # Check that all the resources are valid, so we don't download the archive
         # file if it would throw an error.
         for kind in resources:
             model = self._getResourceModel(kind, 'fileList')
             for id in resources[kind]:
                 if not model.load(id=id, user=user, level=AccessType.READ):
                     raise RestException('Resource %s %s not found.' % (kind, id))
-        setResponseHeader('Content-Type', 'application/zip')
-        setContentDisposition('Resources.zip')
 
-        def stream():
-            zip = ziputil.ZipGenerator()
+        def fileList():
             for kind in resources:
                 model = ModelImporter.model(kind)
                 for id in resources[kind]:
                     doc = model.load(id=id, user=user, level=AccessType.READ)
-                    for (path, file) in model.fileList(
-                            doc=doc, user=user, includeMetadata=includeMetadata, subpath=True):
-                        for data in zip.addFile(file, path):
-                            yield data
+                    yield from model.fileList(
+                        doc=doc, user=user, includeMetadata=includeMetadata, subpath=True,
+                        data=False)
+
+        if format != 'zip':
+            if seekable:
+                raise RestException('Seekable downloads are only supported in zip format.')
+            mimeType, extension = tarutil.FORMATS[format]
+            setResponseHeader('Content-Type', mimeType)
+            setContentDisposition('Resources' + extension)
+            return bandwidth.throttle(tarutil.TarGenerator().stream(
+                tarutil.fileEntries(fileList()), compress=format == 'tgz'))
+
+        setResponseHeader('Content-Type', 'application/zip')
+        setContentDisposition('Resources.zip')
+        if seekable:
+            plan = ziputil.ZipPlan(ziputil.seekableEntries(fileList()))
+            start, end = setRangedResponse(plan.size, plan.etag)
+            return bandwidth.throttle(lambda: plan.generate(start, end))
+
+        def stream():
+            zip = ziputil.ZipGenerator(compression=ziputil.DEFLATE)
+            yield from zip.addFiles(ziputil.fileEntries(fileList()))
             yield zip.footer()
-        return stream
+        return bandwidth.throttle(stream)
 
     @access.user(scope=TokenScope.DATA_OWN)
     @autoDescribeRoute(
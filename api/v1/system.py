@@ -10,7 +10,7 @@ import logging
 from girder import plugin
 from girder.api import access
 from girder.constants import TokenScope, ACCESS_FLAGS, VERSION
-from girder.exceptions import GirderException, ResourcePathNotFound
+from girder.exceptions import GirderException, ResourcePathNotFound, RestException
 from girder.models.collection import Collection
 from girder.models.file import File
 from girder.models.folder import Folder
@@ -20,10 +20,10 @@ from girder.models.setting import Setting
 from girder.models.upload import Upload
 from girder.models.user import User
 from girder.settings import SettingKey
-from girder.utility import config, system
+from girder.utility import config, metrics, profiling, system
 from girder.utility.progress import ProgressContext
 from ..describe import Description, autoDescribeRoute
-from ..rest import Resource
+from ..rest import Resource, setContentDisposition, setResponseHeader
 
 ModuleStartTime = datetime.datetime.utcnow()
 LOG_BUF_SIZE = 65536
@@ -50,6 +50,11 @@ class System(Resource):
         self.route('PUT', ('check',), self.systemConsistencyCheck)
         self.route('GET', ('log',), self.getLog)
         self.route('GET', ('log', 'level'), self.getLogLevel)
+        self.route('GET', ('metrics',), self.getMetrics)
+        self.route('GET', ('profile',), self.getProfileStatus)
+        self.route('POST', ('profile',), self.startProfile)
+        self.route('DELETE', ('profile',), self.stopProfile)
+        self.route('GET', ('profile', 'download'), self.downloadProfile)
         self.route('PUT', ('log', 'level'), self.setLogLevel)
         self.route('GET', ('setting', 'collection_creation_policy', 'access'),
                    self.getCollectionCreationPolicyAccess)
@@ -317,6 +322,86 @@ class System(Resource):
         # * for gridfs assetstores, find chunks that are not tracked.
         # * for s3 assetstores, find elements that are not tracked.
 
+    @access.admin
+    @autoDescribeRoute(
+        Description('Get request metrics in the Prometheus text format.')
+        .notes('Must be a system administrator to call this.  This reports a '
+               'latency histogram, response status counts, and response bytes '
+               'for each route, and the requests in flight on each thread, '
+               'since the server started.')
+        .produces(metrics.PROMETHEUS_MIME_TYPE)
+        .errorResponse('You are not a system administrator.', 403)
+    )
+    def getMetrics(self):
+        self.setRawResponse()
+        setResponseHeader('Content-Type', metrics.PROMETHEUS_MIME_TYPE)
+        return metrics.render().encode('utf8')
+
+    @access.admin
+    @autoDescribeRoute(
+        Description('Get the status of the current or last profiling session.')
+        .notes('Must be a system administrator to call this.  Returns null if '
+               'no session has been started.')
+        .errorResponse('You are not a system administrator.', 403)
+    )
+    def getProfileStatus(self):
+        return profiling.getStatus()
+
+    @access.admin
+    @autoDescribeRoute(
+        Description('Start profiling a sample of requests.')
+        .notes('Must be a system administrator to call this.  The call stats '
+               'of the sampled requests are aggregated until the session is '
+               'stopped or its duration elapses.  Starting a session discards '
+               'the results of the previous one.')
+        .param('rate', 'The fraction of requests to profile, from 0 to 1.',
+               dataType='number', required=False, default=0.0)
+        .param('route', 'A glob pattern for paths below the API root, such as '
+               '"item/*/download".  Matching requests are always profiled.',
+               required=False)
+        .param('duration', 'How long to profile for, in seconds.',
+               dataType='integer', required=False, default=300)
+        .errorResponse('You are not a system administrator.', 403)
+    )
+    def startProfile(self, rate, route, duration):
+        return profiling.startProfiling(rate=rate, route=route, duration=duration)
+
+    @access.admin
+    @autoDescribeRoute(
+        Description('Stop profiling requests.')
+        .notes('Must be a system administrator to call this.  The results of '
+               'the session can still be downloaded.')
+        .errorResponse('You are not a system administrator.', 403)
+    )
+    def stopProfile(self):
+        return profiling.stopProfiling()
+
+    @access.admin
+    @autoDescribeRoute(
+        Description('Download the results of the current or last profiling session.')
+        .notes('Must be a system administrator to call this.  The "pstats" '
+               'format can be loaded with Python\'s pstats module or tools such '
+               'as snakeviz; the "collapsed" format is a list of sampled stacks '
+               'for flame graph tools.')
+        .param('format', 'The format of the profile.', required=False,
+               enum=('pstats', 'collapsed'), default='pstats')
+        .errorResponse('You are not a system administrator.', 403)
+        .errorResponse('No requests have been profiled.')
+    )
+    def downloadProfile(self, format):
+        if format == 'pstats':
+            data = profiling.getPstats()
+            if data is None:
+                raise RestException('No requests have been profiled.')
+            setResponseHeader('Content-Type', 'application/octet-stream')
+            setContentDisposition('girder.pstats')
+        else:
+            data = profiling.getCollapsedStacks().encode('utf8')
+            setResponseHeader('Content-Type', 'text/plain; charset=utf-8')
+            setContentDisposition('girder.collapsed.txt')
+        self.setRawResponse()
+        return data
+
     @access.admin
     @autoDescribeRoute(
         Description('Show the most recent contents of the server logs.')
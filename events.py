@@ -25,12 +25,22 @@ receive the Event object as its only argument.
 
 import contextlib
 import girder
-import queue
+import heapq
+import itertools
 import threading
+import time
 
 from collections import OrderedDict
 from girder.utility import config
 
+# The default number of events that can wait on each lane of the daemon
+EVENT_QUEUE_SIZE = 10000
+# Lanes of the daemon used when the config doesn't set any, keeping slow data
+# processing from holding up other events
+DEFAULT_EVENT_LANES = {
+    'data': {'events': ['data.process'], 'workers': 1},
+}
+
 
 class Event:
     """
@@ -98,7 +108,7 @@ class ForegroundEventsDaemon:
     config file chooses to disable using the background thread for the daemon.
     It executes all bound handlers in the current thread, and provides
     no-op start() and stop() implementations to remain compatible with the
-    API of AsyncEventsThread.
+    API of AsyncEventsDaemon.
     """
 
     def start(self):
@@ -107,7 +117,7 @@ class ForegroundEventsDaemon:
     def stop(self):
         pass
 
-    def trigger(self, eventName=None, info=None, callback=None):
+    def trigger(self, eventName=None, info=None, callback=None, priority=0):
         if eventName is None:
             event = Event(None, info, asynchronous=False)
         else:
@@ -115,34 +125,103 @@ class ForegroundEventsDaemon:
 
         if callable(callback):
             callback(event)
+        return True
+
+    def getStats(self):
+        return {'lanes': {}, 'handlers': getHandlerStats()}
 
 
-class AsyncEventsThread(threading.Thread):
+class _EventLane:
     """
-    This class is used to execute the pipeline for events asynchronously.
-    This should not be invoked directly by callers; instead, they should use
-    girder.events.daemon.trigger().
+    A priority queue of asynchronous events with a pool of worker threads
+    that handle them.  When the queue is full, triggering an event either
+    waits for room or drops the event, depending on the lane's policy.  Events
+    triggered by a lane's own workers are never waited for, since that could
+    deadlock; they are dropped if the queue is full.
+
+    :param name: The name of the lane.
+    :type name: str
+    :param workers: The number of worker threads.
+    :type workers: int
+    :param queueSize: The most events that can be waiting in the queue.
+    :type queueSize: int
+    :param block: Whether triggering an event waits for room in a full queue.
+    :type block: bool
     """
 
-    def __init__(self):
-        super().__init__()
+    def __init__(self, name, workers, queueSize, block):
+        self.name = name
+        self.workers = max(1, workers)
+        self.queueSize = max(1, queueSize)
+        self.block = block
+        self.threads = []
+        self.stopping = False
+        self._heap = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._notEmpty = threading.Condition(self._lock)
+        self._notFull = threading.Condition(self._lock)
+        self.stats = {
+            'processed': 0,
+            'failed': 0,
+            'dropped': 0,
+            'blocked': 0,
+            'active': 0,
+            'lastLag': 0.0,
+            'maxLag': 0.0,
+        }
 
-        self.daemon = True
-        self.terminate = False
-        self.eventQueue = queue.Queue()
-        self.queueNotEmpty = threading.Condition()
+    def start(self):
+        with self._lock:
+            self.stopping = False
+            self.threads = [t for t in self.threads if t.is_alive()]
+            for _ in range(self.workers - len(self.threads)):
+                thread = threading.Thread(
+                    target=self._run, name='girder-events-%s' % self.name, daemon=True)
+                self.threads.append(thread)
+                thread.start()
 
-    def run(self):
-        """
-        Loops over all queued events. If the queue is empty, this thread gets
-        put to sleep until someone calls trigger() on it with a new event to
-        dispatch.
+    def stop(self):
+        with self._lock:
+            self.stopping = True
+            self._notEmpty.notify_all()
+            self._notFull.notify_all()
+
+    def put(self, priority, item):
         """
-        girder.logprint.info('Started asynchronous event manager thread.')
+        Add an event to the queue.
 
-        while not self.terminate:
+        :returns: whether the event was queued.
+        """
+        with self._lock:
+            if len(self._heap) >= self.queueSize:
+                # Only wait while there are workers that can make room
+                if (not self.block or self.stopping or not self.threads
+                        or threading.current_thread() in self.threads):
+                    self.stats['dropped'] += 1
+                    return False
+                self.stats['blocked'] += 1
+                while len(self._heap) >= self.queueSize and not self.stopping:
+                    self._notFull.wait()
+            heapq.heappush(self._heap, (priority, next(self._counter), time.monotonic(), item))
+            self._notEmpty.notify()
+            return True
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._heap and not self.stopping:
+                    self._notEmpty.wait()
+                if self.stopping:
+                    return
+                _, _, queued, (eventName, info, callback) = heapq.heappop(self._heap)
+                self._notFull.notify()
+                lag = time.monotonic() - queued
+                self.stats['lastLag'] = lag
+                self.stats['maxLag'] = max(self.stats['maxLag'], lag)
+                self.stats['active'] += 1
+            failed = False
             try:
-                eventName, info, callback = self.eventQueue.get(block=False)
                 if eventName is None:
                     event = Event(None, info, asynchronous=True)
                 else:
@@ -150,17 +229,75 @@ class AsyncEventsThread(threading.Thread):
 
                 if callable(callback):
                     callback(event)
-            except queue.Empty:
-                self.queueNotEmpty.acquire()
-                self.queueNotEmpty.wait()
-                self.queueNotEmpty.release()
             except Exception:
                 # Must continue the event loop even if handler failed
+                failed = True
                 girder.logger.exception('In handler for event "%s":' % eventName)
+            finally:
+                with self._lock:
+                    self.stats['active'] -= 1
+                    self.stats['processed'] += 1
+                    if failed:
+                        self.stats['failed'] += 1
+
+    def getStats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['depth'] = len(self._heap)
+            # How long the oldest waiting event has been queued
+            stats['oldestWait'] = (
+                time.monotonic() - min(entry[2] for entry in self._heap) if self._heap else 0.0)
+        stats['workers'] = self.workers
+        stats['queueSize'] = self.queueSize
+        stats['policy'] = 'block' if self.block else 'drop'
+        return stats
+
+
+class AsyncEventsDaemon:
+    """
+    This class is used to execute the pipeline for events asynchronously.
+    This should not be invoked directly by callers; instead, they should use
+    girder.events.daemon.trigger().
+
+    Events are handled on lanes, each with its own bounded queue and pool of
+    worker threads, so that slow handlers on one lane don't hold up events on
+    the others.  Events that aren't assigned to a lane are handled on the
+    "default" lane.  Within a lane, events with a lower priority number are
+    handled first, and events of the same priority in the order they were
+    triggered.
+
+    :param workers: The number of workers on the default lane.
+    :type workers: int
+    :param queueSize: The queue size of the default lane, and of other lanes
+        that don't set their own.
+    :type queueSize: int
+    :param block: Whether triggering an event waits for room in a full queue,
+        rather than dropping the event.
+    :type block: bool
+    :param lanes: Additional lanes, as a dict of lane names to dicts with an
+        "events" list of the names of the events handled on the lane, and
+        optionally "workers", "queue_size", and "policy" ("block" or "drop").
+    :type lanes: dict or None
+    """
+
+    def __init__(self, workers=1, queueSize=EVENT_QUEUE_SIZE, block=True, lanes=None):
+        self.lanes = {'default': _EventLane('default', workers, queueSize, block)}
+        self._eventLanes = {}
+        for name, spec in (lanes or {}).items():
+            policy = spec.get('policy')
+            lane = _EventLane(
+                name, int(spec.get('workers', 1)), int(spec.get('queue_size', queueSize)),
+                block if policy is None else policy == 'block')
+            self.lanes[name] = lane
+            for eventName in spec.get('events', ()):
+                self._eventLanes[eventName] = lane
 
-        girder.logprint.info('Stopped asynchronous event manager thread.')
+    def start(self):
+        girder.logprint.info('Started asynchronous event manager threads.')
+        for lane in self.lanes.values():
+            lane.start()
 
-    def trigger(self, eventName=None, info=None, callback=None):
+    def trigger(self, eventName=None, info=None, callback=None, priority=0):
         """
         Adds a new event on the queue to trigger asynchronously.
 
@@ -169,28 +306,46 @@ class AsyncEventsThread(threading.Thread):
         :param callback: Optional callable to be called upon completion of
             all bound event handlers. It takes one argument, which is the
             event object itself.
+        :param priority: Events with lower numbers are handled before those
+            with higher numbers on the same lane.
+        :type priority: int
+        :returns: whether the event was queued; it is not if its lane's queue
+            is full and the lane drops events.
         """
-        self.queueNotEmpty.acquire()
-        self.eventQueue.put((eventName, info, callback))
-        self.queueNotEmpty.notify()
-        self.queueNotEmpty.release()
+        lane = self._eventLanes.get(eventName, self.lanes['default'])
+        queued = lane.put(priority, (eventName, info, callback))
+        if not queued:
+            girder.logger.warning(
+                'Event "%s" was dropped, as the "%s" event queue is full.' % (
+                    eventName, lane.name))
+        return queued
 
     def stop(self):
         """
-        Gracefully stops this thread. Will finish the currently processing
-        event before stopping.
+        Gracefully stops the worker threads. Each will finish the event it is
+        currently processing before stopping.
+        """
+        for lane in self.lanes.values():
+            lane.stop()
+
+    def getStats(self):
+        """
+        Get the queue and handler statistics of the daemon.
+
+        :returns: a dict with the stats of each lane and of each handler.
         """
-        self.queueNotEmpty.acquire()
-        self.terminate = True
-        self.queueNotEmpty.notify()
-        self.queueNotEmpty.release()
+        return {
+            'lanes': {name: lane.getStats() for name, lane in self.lanes.items()},
+            'handlers': getHandlerStats(),
+        }
 
     def __del__(self):
-        # Make sure we stop this thread if it's getting GCed, i.e. daemon was reassigned
+        # Make sure we stop the threads if this is getting GCed, i.e. daemon was reassigned
         self.stop()
-        # We had been calling the super class's __del__, but it doesn't have
-        # such a method, so doing so would raise an AttributeError.
-        # super().__del__()
+
+
+# The former name of the asynchronous daemon, which was a single thread
+AsyncEventsThread = AsyncEventsDaemon
 
 
 def bind(eventName, handlerName, handler):
@@ -220,6 +375,7 @@ def bind(eventName, handlerName, handler):
     if handlerName in _mapping[eventName]:
         girder.logger.warning('Event binding already exists: %s -> %s' % (eventName, handlerName))
     _mapping[eventName][handlerName] = handler
+    _boundNames.add(eventName)
 
 
 def unbind(eventName, handlerName):
@@ -231,7 +387,11 @@ def unbind(eventName, handlerName):
     :param handlerName: The name that identifies the handler calling bind().
     :type handlerName: str
     """
-    _mapping.get(eventName, {}).pop(handlerName, None)
+    handlers = _mapping.get(eventName, {})
+    handlers.pop(handlerName, None)
+    if not handlers:
+        _mapping.pop(eventName, None)
+        _boundNames.discard(eventName)
 
 
 def unbindAll():
@@ -243,6 +403,19 @@ def unbindAll():
        never be called outside of testing.
     """
     _mapping.clear()
+    _boundNames.clear()
+
+
+def hasHandlers(eventName):
+    """
+    Whether any handlers are bound to an event.  This is much cheaper than
+    triggering an event, so code that triggers events frequently can use it
+    to skip building the event's info when nothing would receive it.
+
+    :param eventName: The name that identifies the event.
+    :type eventName: str
+    """
+    return eventName in _boundNames
 
 
 @contextlib.contextmanager
@@ -281,7 +454,9 @@ def trigger(eventName, info=None, pre=None, asynchronous=False, daemon=False):
     :type daemon: bool
     """
     e = Event(eventName, info, asynchronous=asynchronous)
-    for name, handler in _mapping.get(eventName, {}).items():
+    if eventName not in _boundNames:
+        return e
+    for name, handler in _mapping[eventName].items():
         if daemon and not asynchronous:
             girder.logprint.warning(
                 'WARNING: Handler "%s" for event "%s" was triggered on the daemon, but is '
@@ -289,7 +464,16 @@ def trigger(eventName, info=None, pre=None, asynchronous=False, daemon=False):
         e.currentHandlerName = name
         if pre is not None:
             pre(info=info, handler=handler, eventName=eventName, handlerName=name)
-        handler(e)
+        if asynchronous:
+            start = time.perf_counter()
+            try:
+                handler(e)
+            except Exception:
+                _recordHandler(eventName, name, time.perf_counter() - start, True)
+                raise
+            _recordHandler(eventName, name, time.perf_counter() - start, False)
+        else:
+            handler(e)
 
         if e.propagate is False:
             break
@@ -297,14 +481,47 @@ def trigger(eventName, info=None, pre=None, asynchronous=False, daemon=False):
     return e
 
 
+def _recordHandler(eventName, handlerName, seconds, failed):
+    with _handlerStatsLock:
+        stats = _handlerStats.get((eventName, handlerName))
+        if stats is None:
+            stats = _handlerStats[(eventName, handlerName)] = {
+                'calls': 0, 'failures': 0, 'totalSeconds': 0.0, 'maxSeconds': 0.0}
+        stats['calls'] += 1
+        stats['failures'] += failed
+        stats['totalSeconds'] += seconds
+        stats['maxSeconds'] = max(stats['maxSeconds'], seconds)
+
+
+def getHandlerStats():
+    """
+    Get the timing and failure counts of the handlers that have run for
+    asynchronous events.
+
+    :returns: a dict of "event name: handler name" to a dict of stats.
+    """
+    with _handlerStatsLock:
+        return {'%s: %s' % key: dict(stats) for key, stats in _handlerStats.items()}
+
+
 _deprecated = {}
 _mapping = {}
+# Timing of handlers run for asynchronous events, by event and handler name
+_handlerStats = {}
+_handlerStatsLock = threading.Lock()
+# The names of events that have at least one handler bound
+_boundNames = set()
 daemon = ForegroundEventsDaemon()
 
 
 def setupDaemon():
     global daemon
-    if config.getConfig()['server'].get('disable_event_daemon', False):
+    serverCfg = config.getConfig()['server']
+    if serverCfg.get('disable_event_daemon', False):
         daemon = ForegroundEventsDaemon()
     else:
-        daemon = AsyncEventsThread()
+        daemon = AsyncEventsDaemon(
+            workers=int(serverCfg.get('event_daemon_workers', 1)),
+            queueSize=int(serverCfg.get('event_daemon_queue_size', EVENT_QUEUE_SIZE)),
+            block=serverCfg.get('event_daemon_queue_policy', 'block') == 'block',
+            lanes=serverCfg.get('event_daemon_lanes', DEFAULT_EVENT_LANES))
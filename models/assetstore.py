@@ -111,13 +111,16 @@ class Assetstore(Model):
         assetstore['capacity'] = adapter.capacityInfo()
         assetstore['hasFiles'] = File().findOne({'assetstoreId': assetstore['_id']}) is not None
 
-    def createFilesystemAssetstore(self, name, root, perms=None):
+    def createFilesystemAssetstore(self, name, root, perms=None, downloadOffload='none',
+                                   downloadOffloadPrefix=''):
         return self.save({
             'type': AssetstoreType.FILESYSTEM,
             'created': datetime.datetime.utcnow(),
             'name': name,
             'root': root,
-            'perms': perms
+            'perms': perms,
+            'downloadOffload': downloadOffload,
+            'downloadOffloadPrefix': downloadOffloadPrefix
         })
 
     def createGridFsAssetstore(self, name, db, mongohost=None,
@@ -133,7 +136,8 @@ class Assetstore(Model):
 
     def createS3Assetstore(self, name, bucket, accessKeyId, secret, prefix='',
                            service='', readOnly=False, region=None, inferCredentials=False,
-                           serverSideEncryption=False):
+                           serverSideEncryption=False, proxiedUploadConcurrency=0,
+                           proxiedDownloadConcurrency=0):
         return self.save({
             'type': AssetstoreType.S3,
             'created': datetime.datetime.utcnow(),
@@ -146,7 +150,9 @@ class Assetstore(Model):
             'service': service,
             'region': region,
             'inferCredentials': inferCredentials,
-            'serverSideEncryption': serverSideEncryption
+            'serverSideEncryption': serverSideEncryption,
+            'proxiedUploadConcurrency': proxiedUploadConcurrency,
+            'proxiedDownloadConcurrency': proxiedDownloadConcurrency
         })
 
     def getCurrent(self):
@@ -154,7 +154,7 @@ class Collection(AccessControlledModel):
             exc=exc)
 
         if doc is not None:
-            if 'meta' not in doc:
+            if 'meta' not in doc and self._isFieldProjected(fields, 'meta'):
                 doc['meta'] = {}
                 self.update({'_id': doc['_id']}, {'$set': {
                     'meta': doc['meta']
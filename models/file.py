@@ -1,16 +1,17 @@
 # -*- coding: utf-8 -*-
 import cherrypy
 import datetime
+import email.utils
 import os
 
 from .model_base import Model, AccessControlledModel
 import girder
 from girder import auditLogger, events
 from girder.constants import AccessType, CoreEventHandler
-from girder.exceptions import FilePathException, ValidationException
+from girder.exceptions import FilePathException, GirderException, ValidationException
 from girder.models.setting import Setting
 from girder.settings import SettingKey
-from girder.utility import acl_mixin, path as path_util
+from girder.utility import acl_mixin, bandwidth, path as path_util
 from girder.utility.model_importer import ModelImporter
 
 
@@ -32,7 +33,7 @@ class File(acl_mixin.AccessControlMixin, Model):
 
         self.exposeFields(level=AccessType.READ, fields=(
             '_id', 'mimeType', 'itemId', 'exts', 'name', 'created', 'creatorId',
-            'size', 'updated', 'linkUrl'))
+            'size', 'updated', 'linkUrl', 'finalizing', 'finalizeError'))
 
         self.exposeFields(level=AccessType.SITE_ADMIN, fields=('assetstoreId',))
 
@@ -79,7 +80,8 @@ class File(acl_mixin.AccessControlMixin, Model):
         :param offset: The start byte within the file.
         :type offset: int
         :param headers: Whether to set headers (i.e. is this an HTTP request
-            for a single file, or something else).
+            for a single file, or something else).  HTTP downloads are paced
+            by the configured download rate limits.
         :type headers: bool
         :param endByte: Final byte to download. If ``None``, downloads to the
             end of the file.
@@ -89,10 +91,17 @@ class File(acl_mixin.AccessControlMixin, Model):
         :type contentDisposition: str or None
         :type extraParameters: str or None
         """
-        events.trigger('model.file.download.request', info={
-            'file': file,
-            'startByte': offset,
-            'endByte': endByte})
+        if file.get('finalizing'):
+            raise GirderException('This file is still being finalized.')
+
+        if events.hasHandlers('model.file.download.request'):
+            events.trigger('model.file.download.request', info={
+                'file': file,
+                'startByte': offset,
+                'endByte': endByte})
+
+        if headers and file.get('assetstoreId'):
+            self.checkConditionalRequest(file)
 
         auditLogger.info('file.download', extra={
             'details': {
@@ -119,21 +128,30 @@ class File(acl_mixin.AccessControlMixin, Model):
                             'startByte': offset,
                             'endByte': endByte,
                             'redirect': False})
+
+                if not events.hasHandlers('model.file.download.complete'):
+                    # Nothing needs to know when the download finishes, so
+                    # skip the extra generator.
+                    downloadGenerator = fileDownload
+                if headers:
+                    return bandwidth.throttle(downloadGenerator)
                 return downloadGenerator
             except cherrypy.HTTPRedirect:
-                events.trigger('model.file.download.complete', info={
-                    'file': file,
-                    'startByte': offset,
-                    'endByte': endByte,
-                    'redirect': True})
+                if events.hasHandlers('model.file.download.complete'):
+                    events.trigger('model.file.download.complete', info={
+                        'file': file,
+                        'startByte': offset,
+                        'endByte': endByte,
+                        'redirect': True})
                 raise
         elif file.get('linkUrl'):
             if headers:
-                events.trigger('model.file.download.complete', info={
-                    'file': file,
-                    'startByte': offset,
-                    'endByte': endByte,
-                    'redirect': True})
+                if events.hasHandlers('model.file.download.complete'):
+                    events.trigger('model.file.download.complete', info={
+                        'file': file,
+                        'startByte': offset,
+                        'endByte': endByte,
+                        'redirect': True})
                 raise cherrypy.HTTPRedirect(file['linkUrl'])
             else:
                 endByte = endByte or len(file['linkUrl'])
@@ -141,15 +159,127 @@ class File(acl_mixin.AccessControlMixin, Model):
                 def stream():
                     yield file['linkUrl'][offset:endByte]
                     if endByte >= len(file['linkUrl']):
-                        events.trigger('model.file.download.complete', info={
-                            'file': file,
-                            'startByte': offset,
-                            'endByte': endByte,
-                            'redirect': False})
+                        if events.hasHandlers('model.file.download.complete'):
+                            events.trigger('model.file.download.complete', info={
+                                'file': file,
+                                'startByte': offset,
+                                'endByte': endByte,
+                                'redirect': False})
                 return stream
         else:
             raise Exception('File has no known download mechanism.')
 
+    def getModifiedTime(self, file):
+        """
+        Return when a file was last modified.  Replacing the contents of a
+        file used to set only its created time, so this is the later of that
+        and its updated time.
+
+        :param file: The file document.
+        :type file: dict
+        :returns: the modification time, as a naive UTC datetime.
+        """
+        return max(file['created'], file.get('updated') or file['created'])
+
+    def getETag(self, file):
+        """
+        Return a strong entity tag for the contents of a file.  This is derived
+        from the SHA-512 hash if the file has one, and otherwise from the file
+        ID and modification time.
+
+        :param file: The file document.
+        :type file: dict
+        :returns: the quoted entity tag.
+        """
+        if file.get('sha512'):
+            return '"%s"' % file['sha512']
+        modified = self.getModifiedTime(file)
+        return '"%s-%x"' % (file['_id'], int(modified.replace(
+            tzinfo=datetime.timezone.utc).timestamp() * 1000000))
+
+    def checkConditionalRequest(self, file):
+        """
+        Set the ETag, Last-Modified, and (unless it has already been set)
+        Cache-Control headers for an HTTP download of a file.  If the request's
+        If-None-Match or If-Modified-Since header shows that the client already
+        has the current contents, this responds with 304 Not Modified without
+        touching the assetstore.
+
+        :param file: The file being downloaded.
+        :type file: dict
+        """
+        etag = self.getETag(file)
+        modified = self.getModifiedTime(file).replace(
+            microsecond=0, tzinfo=datetime.timezone.utc)
+        headers = cherrypy.response.headers
+        headers['ETag'] = etag
+        headers['Last-Modified'] = email.utils.format_datetime(modified, usegmt=True)
+        if 'Cache-Control' not in headers:
+            # The client may keep the file, but must check that it is current.
+            headers['Cache-Control'] = 'private, no-cache'
+
+        requestHeaders = cherrypy.request.headers
+        ifNoneMatch = requestHeaders.get('If-None-Match')
+        if ifNoneMatch is not None:
+            tags = {tag.strip() for tag in ifNoneMatch.split(',')}
+            if '*' in tags or etag in tags or 'W/' + etag in tags:
+                raise cherrypy.HTTPRedirect([], 304)
+        elif requestHeaders.get('If-Modified-Since'):
+            try:
+                since = email.utils.parsedate_to_datetime(requestHeaders['If-Modified-Since'])
+            except (TypeError, ValueError):
+                return
+            if since.tzinfo is not None and modified <= since:
+                raise cherrypy.HTTPRedirect([], 304)
+
+    def downloadRanges(self, file, ranges, contentDisposition=None, extraParameters=None):
+        """
+        Download several byte ranges of a file as a single
+        ``multipart/byteranges`` HTTP response.  Files that are not stored in
+        an assetstore are downloaded as usual.
+
+        :param file: The file to download.
+        :param ranges: (start, end) pairs, where end is exclusive.
+        :type ranges: list
+        :param contentDisposition: Content-Disposition response header
+            disposition-type value.
+        :type contentDisposition: str or None
+        :type extraParameters: str or None
+        """
+        if not file.get('assetstoreId'):
+            return self.download(
+                file, contentDisposition=contentDisposition, extraParameters=extraParameters)
+        if file.get('finalizing'):
+            raise GirderException('This file is still being finalized.')
+
+        if events.hasHandlers('model.file.download.request'):
+            events.trigger('model.file.download.request', info={
+                'file': file,
+                'ranges': ranges})
+
+        self.checkConditionalRequest(file)
+
+        auditLogger.info('file.download', extra={
+            'details': {
+                'fileId': file['_id'],
+                'ranges': ranges,
+                'extraParameters': extraParameters
+            }
+        })
+
+        fileDownload = self.getAssetstoreAdapter(file).downloadRanges(
+            file, ranges, contentDisposition=contentDisposition,
+            extraParameters=extraParameters)
+
+        def downloadGenerator():
+            yield from fileDownload()
+            if events.hasHandlers('model.file.download.complete'):
+                events.trigger('model.file.download.complete', info={
+                    'file': file,
+                    'ranges': ranges,
+                    'redirect': False})
+        return bandwidth.throttle(downloadGenerator)
+
     def validate(self, doc):
         if doc.get('assetstoreId') is None:
             if 'linkUrl' not in doc:
@@ -141,12 +141,12 @@ class Folder(AccessControlledModel):
                 self.update({'_id': doc['_id']}, {'$set': {
                     'lowerName': doc['lowerName']
                 }})
-            if 'meta' not in doc:
+            if 'meta' not in doc and self._isFieldProjected(fields, 'meta'):
                 doc['meta'] = {}
                 self.update({'_id': doc['_id']}, {'$set': {
                     'meta': {}
                 }})
-            if 'assign' not in doc:
+            if 'assign' not in doc and self._isFieldProjected(fields, 'assign'):
                 doc['assign'] = {}
                 self.update({'_id': doc['_id']}, {'$set': {
                     'assign': {}
@@ -129,7 +129,7 @@ class Item(acl_mixin.AccessControlMixin, Model):
                 self.update({'_id': doc['_id']}, {'$set': {
                     'lowerName': doc['lowerName']
                 }})
-            if 'meta' not in doc:
+            if 'meta' not in doc and self._isFieldProjected(fields, 'meta'):
                 doc['meta'] = {}
                 self.update({'_id': doc['_id']}, {'$set': {
                     'meta': {}
@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
+import contextlib
 import copy
 import functools
 import itertools
 import pymongo
 import re
+import threading
 
 from bson.objectid import ObjectId
 from bson.errors import InvalidId
@@ -20,6 +22,8 @@ _allowedFindArgs = ('cursor_type', 'allow_partial_results', 'oplog_replay',
 # the database is dropped between each test case. If we find a cleverer way to do
 # that, we don't need to store these here.
 _modelSingletons = []
+# The sparse fieldset that is active on this thread, as set by Model.sparseFields
+_sparseFieldsState = threading.local()
 
 
 def _permissionClauses(user=None, level=None, prefix=''):
@@ -84,6 +88,10 @@ class Model(metaclass=_ModelSingleton):
     model layer.
     """
 
+    # Fields that are always read for a sparse fieldset, as they are needed to
+    # check access to and filter documents of this model.
+    _sparseRequiredFields = frozenset({'_id'})
+
     def __init__(self):
         self.name = None
         self._indices = []
@@ -161,6 +169,40 @@ class Model(metaclass=_ModelSingleton):
 
         self._filterKeys[level].difference_update(fields)
 
+    @contextlib.contextmanager
+    def sparseFields(self, fields):
+        """
+        A context manager within which documents of this model only need to
+        include the given top-level fields.  Inside it, ``find`` and
+        ``findWithPermissions`` calls on this model that don't specify
+        ``fields`` use the projection returned by ``sparseProjection``, so
+        MongoDB only sends the requested fields.  This is used for the
+        ``fields`` parameter of REST requests.
+
+        :param fields: The names of the top-level fields to include, or None
+            to include every field.
+        :type fields: `set, list, tuple, or None`
+        """
+        previous = getattr(_sparseFieldsState, 'value', None)
+        _sparseFieldsState.value = (type(self), fields) if fields else None
+        try:
+            yield
+        finally:
+            _sparseFieldsState.value = previous
+
+    def sparseProjection(self):
+        """
+        Get the projection for the sparse fieldset that is active for this
+        model, if any.  Besides the requested fields, this includes those
+        needed to check access to and filter the documents.
+
+        :returns: A projection dict, or None if all fields should be read.
+        """
+        state = getattr(_sparseFieldsState, 'value', None)
+        if state is None or not isinstance(self, state[0]):
+            return None
+        return dict.fromkeys(set(state[1]) | self._sparseRequiredFields, True)
+
     def filter(self, doc, user=None, additionalKeys=None):
         """
         Filter this model for the given user. This is a default implementation
@@ -299,6 +341,8 @@ class Model(metaclass=_ModelSingleton):
         """
         query = query or {}
         kwargs = {k: kwargs[k] for k in kwargs if k in _allowedFindArgs}
+        if fields is None:
+            fields = self.sparseProjection()
 
         cursor = self.collection.find(
             filter=query, skip=offset, limit=limit, projection=fields,
@@ -470,17 +514,18 @@ class Model(metaclass=_ModelSingleton):
             pre- and post-save hooks.
         """
         if validate and triggerEvents:
-            event = events.trigger('.'.join(('model', self.name, 'validate')),
-                                   document)
-            if event.defaultPrevented:
+            eventName = 'model.%s.validate' % self.name
+            if events.hasHandlers(eventName) and events.trigger(
+                    eventName, document).defaultPrevented:
                 validate = False
 
         if validate:
             document = self.validate(document)
 
         if triggerEvents:
-            event = events.trigger('model.%s.save' % self.name, document)
-            if event.defaultPrevented:
+            eventName = 'model.%s.save' % self.name
+            if events.hasHandlers(eventName) and events.trigger(
+                    eventName, document).defaultPrevented:
                 return document
 
         isNew = '_id' not in document
@@ -502,8 +547,12 @@ class Model(metaclass=_ModelSingleton):
                         'id': document['_id']
                     }
                 })
-                events.trigger('model.%s.save.created' % self.name, document)
-            events.trigger('model.%s.save.after' % self.name, document)
+                eventName = 'model.%s.save.created' % self.name
+                if events.hasHandlers(eventName):
+                    events.trigger(eventName, document)
+            eventName = 'model.%s.save.after' % self.name
+            if events.hasHandlers(eventName):
+                events.trigger(eventName, document)
 
         return document
 
@@ -557,15 +606,18 @@ class Model(metaclass=_ModelSingleton):
         """
         assert '_id' in document
 
-        event = events.trigger('.'.join(('model', self.name, 'remove')),
-                               document)
-        kwargsEvent = events.trigger(
-            '.'.join(('model', self.name, 'remove_with_kwargs')), {
+        prevented = False
+        eventName = 'model.%s.remove' % self.name
+        if events.hasHandlers(eventName):
+            prevented = events.trigger(eventName, document).defaultPrevented
+        eventName = 'model.%s.remove_with_kwargs' % self.name
+        if events.hasHandlers(eventName):
+            prevented = events.trigger(eventName, {
                 'document': document,
                 'kwargs': kwargs
-            })
+            }).defaultPrevented or prevented
 
-        if not event.defaultPrevented and not kwargsEvent.defaultPrevented:
+        if not prevented:
             return self.collection.delete_one({'_id': document['_id']})
 
     def removeWithQuery(self, query):
@@ -716,6 +768,26 @@ class Model(metaclass=_ModelSingleton):
                 copy.pop(entry, None)
         return copy
 
+    @staticmethod
+    def _isFieldProjected(fields, field):
+        """
+        Test whether a top-level field is read with a projection filter, so that a document
+        lacking it does not have it in the database either.
+
+        :param fields: A mask for filtering result documents by key, or None to return the full
+            document, passed to MongoDB find() as the `projection` param.
+        :type fields: list or dict or None
+        :param field: The name of the field.
+        :type field: str
+        """
+        if fields is None:
+            return True
+        if Model._isInclusionProjection(fields):
+            if isinstance(fields, dict):
+                return bool(fields.get(field))
+            return field in fields
+        return bool(fields.get(field, True))
+
     @staticmethod
     def _removeSupplementalFields(doc, fields):
         """
@@ -757,6 +829,8 @@ class AccessControlledModel(Model):
     resource.
     """
 
+    _sparseRequiredFields = frozenset({'_id', 'access', 'public'})
+
     def __init__(self):
         # Do the bindings before calling __init__(), in case a derived class
         # wants to change things in initialize()
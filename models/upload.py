@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
+import collections
+import concurrent.futures
 import datetime
 import io
+import threading
 from bson.objectid import ObjectId
 
 from girder import events, logger
@@ -11,6 +14,35 @@ from girder.settings import SettingKey
 from girder.utility import RequestBodyStream
 from girder.utility.progress import noProgress
 
+# How long upload finalization notifications are kept, in seconds
+UPLOAD_FINALIZE_NOTIFICATION_TTL = 3600
+
+# The most uploads whose uncheckpointed progress is kept in memory
+UPLOAD_PROGRESS_CACHE_SIZE = 1000
+
+# Progress of uploads that this process received but did not checkpoint, by
+# upload id, so the next chunk doesn't have to reconcile it from the stored data
+_uncheckpointed = collections.OrderedDict()
+_uncheckpointedLock = threading.Lock()
+
+# Worker pool for finalizing uploads in the background, created on first use
+_finalizePool = None
+_finalizePoolSize = None
+_finalizePoolLock = threading.Lock()
+
+
+def _getFinalizePool(workers):
+    global _finalizePool, _finalizePoolSize
+
+    with _finalizePoolLock:
+        if _finalizePool is None or _finalizePoolSize != workers:
+            if _finalizePool is not None:
+                _finalizePool.shutdown(wait=False)
+            _finalizePool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix='girder-upload-finalize')
+            _finalizePoolSize = workers
+        return _finalizePool
+
 
 class Upload(Model):
     """
@@ -135,12 +167,18 @@ class Upload(Model):
         adapter = assetstore_utilities.getAssetstoreAdapter(assetstore)
 
         upload = adapter.uploadChunk(upload, chunk)
-        if '_id' in upload or upload['received'] != upload['size']:
-            upload = self.save(upload)
+        if '_id' not in upload:
+            if upload['received'] != upload['size']:
+                upload = self.save(upload)
+        elif upload['received'] != upload['size'] or not adapter.canReconcileUploads:
+            self._checkpoint(upload, adapter)
 
         # If upload is finished, we finalize it
         if upload['received'] == upload['size']:
-            file = self.finalizeUpload(upload, assetstore)
+            if '_id' in upload and self._finalizeAsync():
+                file = self.finalizeUploadAsync(upload, assetstore)
+            else:
+                file = self.finalizeUpload(upload, assetstore)
             if filter:
                 return File().filter(file, user=user)
             else:
@@ -148,6 +186,100 @@ class Upload(Model):
         else:
             return upload
 
+    def _checkpoint(self, upload, adapter):
+        """
+        Persist the progress of an upload that already exists in the database.
+        If the adapter can reconcile the upload from its stored data, this is
+        only done once the configured checkpoint byte count or time interval
+        has passed since the last checkpoint; a setting of 0 disables that
+        criterion, and with both at 0 it is always done.  If the adapter can't
+        reconcile the upload, it is always done.  Progress that isn't saved
+        is kept in memory for ``restoreProgress``.
+
+        Only the adapter's progress fields are written, so this does not
+        trigger validation or the model save events.
+
+        :param upload: The upload document to checkpoint.
+        :type upload: dict
+        :param adapter: The assetstore adapter for the upload.
+        """
+        from .setting import Setting
+
+        now = datetime.datetime.utcnow()
+        progress = {
+            field: upload[field] for field in adapter.uploadProgressFields if field in upload}
+        if adapter.canReconcileUploads:
+            checkpointBytes = Setting().get(SettingKey.UPLOAD_CHECKPOINT_BYTES)
+            checkpointSeconds = Setting().get(SettingKey.UPLOAD_CHECKPOINT_SECONDS)
+            sinceBytes = upload['received'] - upload.get('checkpointReceived', 0)
+            sinceUpdated = now - upload.get('updated', upload['created'])
+            due = (
+                (checkpointBytes and sinceBytes >= checkpointBytes)
+                or (checkpointSeconds and sinceUpdated.total_seconds() >= checkpointSeconds))
+            if (checkpointBytes or checkpointSeconds) and not due:
+                # Keep the progress so that the next chunk can pick it up
+                # without reading back the data stored since the last
+                # checkpoint.
+                with _uncheckpointedLock:
+                    _uncheckpointed[upload['_id']] = progress
+                    _uncheckpointed.move_to_end(upload['_id'])
+                    if len(_uncheckpointed) > UPLOAD_PROGRESS_CACHE_SIZE:
+                        _uncheckpointed.popitem(last=False)
+                return
+            self._forgetProgress(upload)
+        upload['updated'] = now
+        upload['checkpointReceived'] = upload['received']
+        progress['updated'] = upload['updated']
+        progress['checkpointReceived'] = upload['checkpointReceived']
+        self.update({'_id': upload['_id']}, {'$set': progress})
+
+    def _forgetProgress(self, upload):
+        with _uncheckpointedLock:
+            _uncheckpointed.pop(upload.get('_id'), None)
+
+    def restoreProgress(self, upload):
+        """
+        Bring an upload document up to date with progress that this process
+        received but did not checkpoint, if the assetstore confirms that it
+        matches the stored data.  Unlike ``reconcileUpload``, this doesn't
+        read the stored data.
+
+        :param upload: The upload document.
+        :type upload: dict
+        :returns: The upload document, with its progress restored if possible.
+        """
+        from .assetstore import Assetstore
+        from girder.utility import assetstore_utilities
+
+        with _uncheckpointedLock:
+            progress = _uncheckpointed.get(upload['_id'])
+        if progress is None or progress['received'] == upload['received']:
+            return upload
+        restored = dict(upload, **progress)
+        assetstore = Assetstore().load(upload['assetstoreId'])
+        adapter = assetstore_utilities.getAssetstoreAdapter(assetstore)
+        if not adapter.isUploadCurrent(restored):
+            self._forgetProgress(upload)
+            return upload
+        return restored
+
+    def reconcileUpload(self, upload):
+        """
+        Bring an upload document up to date with the data its assetstore has
+        actually stored, since progress may not have been saved after every
+        chunk.
+
+        :param upload: The upload document to reconcile.
+        :type upload: dict
+        :returns: The reconciled upload document.
+        """
+        from .assetstore import Assetstore
+        from girder.utility import assetstore_utilities
+
+        assetstore = Assetstore().load(upload['assetstoreId'])
+        adapter = assetstore_utilities.getAssetstoreAdapter(assetstore)
+        return adapter.reconcileUpload(upload)
+
     def requestOffset(self, upload):
         """
         Requests the offset that should be used to resume uploading. This
@@ -158,8 +290,14 @@ class Upload(Model):
 
         assetstore = Assetstore().load(upload['assetstoreId'])
         adapter = assetstore_utilities.getAssetstoreAdapter(assetstore)
+        upload = adapter.reconcileUpload(upload)
         return adapter.requestOffset(upload)
 
+    def _finalizeAsync(self):
+        from .setting import Setting
+
+        return Setting().get(SettingKey.UPLOAD_FINALIZE_ASYNC)
+
     def finalizeUpload(self, upload, assetstore=None):
         """
         This should only be called manually in the case of creating an
@@ -172,15 +310,89 @@ class Upload(Model):
         :returns: The file object that was created.
         """
         from .assetstore import Assetstore
+
+        events.trigger('model.upload.finalize', upload)
+        if assetstore is None:
+            assetstore = Assetstore().load(upload['assetstoreId'])
+
+        file = self._prepareFinalFile(upload, assetstore)
+        return self._completeFinalize(
+            upload, assetstore, file, rest.getCurrentToken(), rest.getCurrentUser())
+
+    def finalizeUploadAsync(self, upload, assetstore=None):
+        """
+        Finalize an upload on the background worker pool. A file record marked
+        as ``finalizing`` is saved and returned immediately; it cannot be
+        downloaded until finalization completes. When it does, an
+        ``upload.finalized`` or ``upload.finalize_failed`` notification is sent
+        to the uploading user. If finalization fails, the upload is kept and
+        may be completed again, which reuses the pending file record.
+
+        :param upload: The upload document. This must already be saved.
+        :type upload: dict
+        :param assetstore: If known, the containing assetstore for the upload.
+        :type assetstore: dict
+        :returns: The pending file document.
+        """
+        from .assetstore import Assetstore
         from .file import File
-        from .item import Item
+        from .setting import Setting
         from girder.utility import assetstore_utilities
 
         events.trigger('model.upload.finalize', upload)
         if assetstore is None:
             assetstore = Assetstore().load(upload['assetstoreId'])
+        adapter = assetstore_utilities.getAssetstoreAdapter(assetstore)
 
-        if 'fileId' in upload:  # Updating an existing file's contents
+        file = self._prepareFinalFile(upload, assetstore)
+        file['finalizing'] = True
+        file.pop('finalizeError', None)
+        file = File().save(file)
+        upload['pendingFileId'] = file['_id']
+        # The progress of the final chunk may not have been checkpointed; it
+        # is needed to finalize again if this attempt fails.
+        update = {
+            field: upload[field] for field in adapter.uploadProgressFields if field in upload}
+        update['pendingFileId'] = file['_id']
+        self.update({'_id': upload['_id']}, {'$set': update})
+
+        pool = _getFinalizePool(Setting().get(SettingKey.UPLOAD_FINALIZE_WORKERS))
+        pool.submit(self._finalizeInBackground, upload, assetstore, file,
+                    rest.getCurrentToken(), rest.getCurrentUser())
+        return file
+
+    def _finalizeInBackground(self, upload, assetstore, file, token, user):
+        from .file import File
+        from .notification import Notification
+
+        data = {'uploadId': upload['_id'], 'fileId': file['_id'], 'itemId': file.get('itemId')}
+        expires = datetime.datetime.utcnow() + datetime.timedelta(
+            seconds=UPLOAD_FINALIZE_NOTIFICATION_TTL)
+        try:
+            self._completeFinalize(upload, assetstore, file, token, user)
+        except Exception as exc:
+            logger.exception('Failed to finalize upload %s' % upload['_id'])
+            File().update({'_id': file['_id']}, {'$set': {'finalizeError': str(exc)}})
+            Notification().createNotification(
+                'upload.finalize_failed', dict(data, message=str(exc)),
+                {'_id': upload['userId']}, expires=expires)
+        else:
+            Notification().createNotification(
+                'upload.finalized', data, {'_id': upload['userId']}, expires=expires)
+
+    def _prepareFinalFile(self, upload, assetstore):
+        """
+        Create or update the file document that an upload will be finalized
+        into, without yet saving it.
+        """
+        from .assetstore import Assetstore
+        from .file import File
+        from .item import Item
+        from girder.utility import assetstore_utilities
+
+        if 'pendingFileId' in upload:  # Retrying a failed background finalization
+            file = File().load(upload['pendingFileId'], force=True)
+        elif 'fileId' in upload:  # Updating an existing file's contents
             file = File().load(upload['fileId'], force=True)
 
             # Delete the previous file contents from the containing assetstore
@@ -192,9 +404,15 @@ class Upload(Model):
 
             # Update file info
             file['creatorId'] = upload['userId']
-            file['created'] = datetime.datetime.utcnow()
+            file['created'] = file['updated'] = datetime.datetime.utcnow()
             file['assetstoreId'] = assetstore['_id']
             file['size'] = upload['size']
+            # The hash of the previous contents must not outlive them; the
+            # assetstore sets the new one if it computes it.
+            file.pop('sha512', None)
+            # The cached checksum for archive downloads no longer applies.
+            file.pop('crc32', None)
+            file.pop('crc32Source', None)
             # If the file was previously imported, it is no longer.
             if file.get('imported'):
                 file['imported'] = False
@@ -220,15 +438,27 @@ class Upload(Model):
                 if upload['parentType'] and upload['parentId']:
                     file['attachedToType'] = upload['parentType']
                     file['attachedToId'] = upload['parentId']
+        return file
+
+    def _completeFinalize(self, upload, assetstore, file, currentToken, currentUser):
+        """
+        Have the assetstore adapter finalize the upload into the file, save
+        the file, remove the upload, and notify data processing handlers.
+        """
+        from .file import File
+        from girder.utility import assetstore_utilities
 
         adapter = assetstore_utilities.getAssetstoreAdapter(assetstore)
         file = adapter.finalizeUpload(upload, file)
+        file.pop('finalizing', None)
+        file.pop('finalizeError', None)
 
         event_document = {'file': file, 'upload': upload}
         events.trigger('model.file.finalizeUpload.before', event_document)
         file = File().save(file)
         events.trigger('model.file.finalizeUpload.after', event_document)
         if '_id' in upload:
+            self._forgetProgress(upload)
             self.remove(upload)
 
         logger.info('Upload complete. Upload=%s File=%s User=%s' % (
@@ -238,8 +468,8 @@ class Upload(Model):
         eventParams = {
             'file': file,
             'assetstore': assetstore,
-            'currentToken': rest.getCurrentToken(),
-            'currentUser': rest.getCurrentUser()
+            'currentToken': currentToken,
+            'currentUser': currentUser
         }
         if 'reference' in upload:
             eventParams['reference'] = upload['reference']
@@ -488,6 +718,7 @@ class Upload(Model):
                 # this assetstore is currently unreachable, so skip it
                 pass
         if '_id' in upload:
+            self._forgetProgress(upload)
             self.remove(upload)
 
     def untrackedUploads(self, action='list', assetstoreId=None):
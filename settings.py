@@ -27,14 +27,21 @@ class SettingKey:
     CORS_ALLOW_METHODS = 'core.cors.allow_methods'
     CORS_ALLOW_ORIGIN = 'core.cors.allow_origin'
     CORS_EXPOSE_HEADERS = 'core.cors.expose_headers'
+    DOWNLOAD_RATE_LIMIT = 'core.download_rate_limit'
+    DOWNLOAD_RATE_LIMIT_PER_USER = 'core.download_rate_limit_per_user'
+    DOWNLOAD_RATE_LIMIT_SCOPES = 'core.download_rate_limit_scopes'
     EMAIL_FROM_ADDRESS = 'core.email_from_address'
     EMAIL_HOST = 'core.email_host'
     EMAIL_VERIFICATION = 'core.email_verification'
     ENABLE_NOTIFICATION_STREAM = 'core.enable_notification_stream'
     ENABLE_PASSWORD_LOGIN = 'core.enable_password_login'
+    FILE_HANDLE_CACHE_SIZE = 'core.file_handle_cache_size'
+    FILE_HANDLE_READ_AHEAD = 'core.file_handle_read_ahead'
     GIRDER_MOUNT_INFORMATION = 'core.girder_mount_information'
     PRIVACY_NOTICE = 'core.privacy_notice'
     REGISTRATION_POLICY = 'core.registration_policy'
+    RESPONSE_COMPRESSION = 'core.response_compression'
+    RESPONSE_COMPRESSION_MIN_SIZE = 'core.response_compression_min_size'
     ROUTE_TABLE = 'core.route_table'
     SERVER_ROOT = 'core.server_root'
     SMTP_ENCRYPTION = 'core.smtp.encryption'
@@ -42,6 +49,10 @@ class SettingKey:
     SMTP_PASSWORD = 'core.smtp.password'
     SMTP_PORT = 'core.smtp.port'
     SMTP_USERNAME = 'core.smtp.username'
+    UPLOAD_CHECKPOINT_BYTES = 'core.upload_checkpoint_bytes'
+    UPLOAD_CHECKPOINT_SECONDS = 'core.upload_checkpoint_seconds'
+    UPLOAD_FINALIZE_ASYNC = 'core.upload_finalize_async'
+    UPLOAD_FINALIZE_WORKERS = 'core.upload_finalize_workers'
     UPLOAD_MINIMUM_CHUNK_SIZE = 'core.upload_minimum_chunk_size'
     USER_DEFAULT_FOLDERS = 'core.user_default_folders'
 
@@ -72,6 +83,9 @@ class SettingDefault:
         SettingKey.CORS_ALLOW_METHODS: 'GET, POST, PUT, HEAD, DELETE',
         SettingKey.CORS_ALLOW_ORIGIN: '',
         SettingKey.CORS_EXPOSE_HEADERS: 'Girder-Total-Count',
+        SettingKey.DOWNLOAD_RATE_LIMIT: 0,
+        SettingKey.DOWNLOAD_RATE_LIMIT_PER_USER: 0,
+        SettingKey.DOWNLOAD_RATE_LIMIT_SCOPES: {},
         # An apache server using reverse proxy would also need
         #  X-Requested-With, X-Forwarded-Server, X-Forwarded-For,
         #  X-Forwarded-Host, Remote-Addr
@@ -80,9 +94,13 @@ class SettingDefault:
         SettingKey.EMAIL_VERIFICATION: 'disabled',
         SettingKey.ENABLE_NOTIFICATION_STREAM: True,
         SettingKey.ENABLE_PASSWORD_LOGIN: True,
+        SettingKey.FILE_HANDLE_CACHE_SIZE: 64 * 1024 * 1024,
+        SettingKey.FILE_HANDLE_READ_AHEAD: 1024 * 1024,
         SettingKey.GIRDER_MOUNT_INFORMATION: None,
         SettingKey.PRIVACY_NOTICE: 'https://www.kitware.com/privacy',
         SettingKey.REGISTRATION_POLICY: 'open',
+        SettingKey.RESPONSE_COMPRESSION: True,
+        SettingKey.RESPONSE_COMPRESSION_MIN_SIZE: 1024,
         # SettingKey.ROUTE_TABLE is provided by a function
         SettingKey.SERVER_ROOT: '',
         SettingKey.SMTP_ENCRYPTION: 'none',
@@ -90,6 +108,12 @@ class SettingDefault:
         SettingKey.SMTP_PASSWORD: '',
         SettingKey.SMTP_PORT: 25,
         SettingKey.SMTP_USERNAME: '',
+        # With both checkpoint intervals at 0, upload progress is saved after
+        # every chunk.
+        SettingKey.UPLOAD_CHECKPOINT_BYTES: 0,
+        SettingKey.UPLOAD_CHECKPOINT_SECONDS: 0,
+        SettingKey.UPLOAD_FINALIZE_ASYNC: False,
+        SettingKey.UPLOAD_FINALIZE_WORKERS: 4,
         SettingKey.UPLOAD_MINIMUM_CHUNK_SIZE: 1024 * 1024 * 5,
         SettingKey.USER_DEFAULT_FOLDERS: 'public_private'
     }
@@ -226,6 +250,41 @@ class SettingValidator:
         if not isinstance(doc['value'], str):
             raise ValidationException('CORS exposed headers must be a string', 'value')
 
+    @staticmethod
+    @setting_utilities.validator(SettingKey.DOWNLOAD_RATE_LIMIT)
+    def _validateDownloadRateLimit(doc):
+        try:
+            doc['value'] = int(doc['value'])
+            if doc['value'] >= 0:
+                return
+        except ValueError:
+            pass  # We want to raise the ValidationException
+        raise ValidationException('Download rate limit must be an integer >= 0.', 'value')
+
+    @staticmethod
+    @setting_utilities.validator(SettingKey.DOWNLOAD_RATE_LIMIT_PER_USER)
+    def _validateDownloadRateLimitPerUser(doc):
+        try:
+            doc['value'] = int(doc['value'])
+            if doc['value'] >= 0:
+                return
+        except ValueError:
+            pass  # We want to raise the ValidationException
+        raise ValidationException(
+            'Per-user download rate limit must be an integer >= 0.', 'value')
+
+    @staticmethod
+    @setting_utilities.validator(SettingKey.DOWNLOAD_RATE_LIMIT_SCOPES)
+    def _validateDownloadRateLimitScopes(doc):
+        if not isinstance(doc['value'], dict):
+            raise ValidationException(
+                'Download rate limits by token scope must be a JSON object.', 'value')
+        for scope, limit in doc['value'].items():
+            if not isinstance(limit, int) or isinstance(limit, bool) or limit < 0:
+                raise ValidationException(
+                    'Download rate limit for scope "%s" must be an integer >= 0.' % scope,
+                    'value')
+
     @staticmethod
     @setting_utilities.validator(SettingKey.EMAIL_FROM_ADDRESS)
     def _validateEmailFromAddress(doc):
@@ -262,6 +321,28 @@ class SettingValidator:
         if not isinstance(doc['value'], bool):
             raise ValidationException('Enable password login setting must be boolean.', 'value')
 
+    @staticmethod
+    @setting_utilities.validator(SettingKey.FILE_HANDLE_CACHE_SIZE)
+    def _validateFileHandleCacheSize(doc):
+        try:
+            doc['value'] = int(doc['value'])
+            if doc['value'] >= 0:
+                return
+        except ValueError:
+            pass  # We want to raise the ValidationException
+        raise ValidationException('File handle cache size must be an integer >= 0.', 'value')
+
+    @staticmethod
+    @setting_utilities.validator(SettingKey.FILE_HANDLE_READ_AHEAD)
+    def _validateFileHandleReadAhead(doc):
+        try:
+            doc['value'] = int(doc['value'])
+            if doc['value'] >= 0:
+                return
+        except ValueError:
+            pass  # We want to raise the ValidationException
+        raise ValidationException('File handle read-ahead must be an integer >= 0.', 'value')
+
     @staticmethod
     @setting_utilities.validator(SettingKey.GIRDER_MOUNT_INFORMATION)
     def _validateGirderMountInformation(doc):
@@ -284,6 +365,24 @@ class SettingValidator:
             raise ValidationException(
                 'Registration policy must be "open", "closed", or "approve".', 'value')
 
+    @staticmethod
+    @setting_utilities.validator(SettingKey.RESPONSE_COMPRESSION)
+    def _validateResponseCompression(doc):
+        if not isinstance(doc['value'], bool):
+            raise ValidationException('Response compression setting must be boolean.', 'value')
+
+    @staticmethod
+    @setting_utilities.validator(SettingKey.RESPONSE_COMPRESSION_MIN_SIZE)
+    def _validateResponseCompressionMinSize(doc):
+        try:
+            doc['value'] = int(doc['value'])
+            if doc['value'] >= 0:
+                return
+        except ValueError:
+            pass  # We want to raise the ValidationException
+        raise ValidationException(
+            'Response compression minimum size must be an integer >= 0.', 'value')
+
     @staticmethod
     @setting_utilities.validator(SettingKey.ROUTE_TABLE)
     def _validateRouteTable(doc):
@@ -341,6 +440,45 @@ class SettingValidator:
         if not isinstance(doc['value'], str):
             raise ValidationException('SMTP username must be a string', 'value')
 
+    @staticmethod
+    @setting_utilities.validator(SettingKey.UPLOAD_CHECKPOINT_BYTES)
+    def _validateUploadCheckpointBytes(doc):
+        try:
+            doc['value'] = int(doc['value'])
+            if doc['value'] >= 0:
+                return
+        except ValueError:
+            pass  # We want to raise the ValidationException
+        raise ValidationException('Upload checkpoint bytes must be an integer >= 0.', 'value')
+
+    @staticmethod
+    @setting_utilities.validator(SettingKey.UPLOAD_CHECKPOINT_SECONDS)
+    def _validateUploadCheckpointSeconds(doc):
+        try:
+            doc['value'] = float(doc['value'])
+            if doc['value'] >= 0:
+                return
+        except ValueError:
+            pass  # We want to raise the ValidationException
+        raise ValidationException('Upload checkpoint seconds must be a number >= 0.', 'value')
+
+    @staticmethod
+    @setting_utilities.validator(SettingKey.UPLOAD_FINALIZE_ASYNC)
+    def _validateUploadFinalizeAsync(doc):
+        if not isinstance(doc['value'], bool):
+            raise ValidationException('Upload finalize async setting must be boolean.', 'value')
+
+    @staticmethod
+    @setting_utilities.validator(SettingKey.UPLOAD_FINALIZE_WORKERS)
+    def _validateUploadFinalizeWorkers(doc):
+        try:
+            doc['value'] = int(doc['value'])
+            if doc['value'] >= 1:
+                return
+        except ValueError:
+            pass  # We want to raise the ValidationException
+        raise ValidationException('Upload finalize workers must be an integer >= 1.', 'value')
+
     @staticmethod
     @setting_utilities.validator(SettingKey.UPLOAD_MINIMUM_CHUNK_SIZE)
     def _validateUploadMinimumChunkSize(doc):
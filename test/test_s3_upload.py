@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+import io
+
+import boto3
+import moto
+import pytest
+
+from girder.exceptions import GirderException
+from girder.utility import RequestBodyStream
+from girder.utility.s3_assetstore_adapter import S3AssetstoreAdapter
+
+BUCKET = 'bucketname'
+PART_SIZE = 5 * 1024 * 1024
+DATA = b''.join(bytes([i]) * PART_SIZE for i in range(2)) + b'\x02' * 1024
+
+
+@pytest.fixture
+def adapter(monkeypatch):
+    with moto.mock_aws():
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket=BUCKET)
+        monkeypatch.setattr(S3AssetstoreAdapter, 'CHUNK_LEN', PART_SIZE)
+        yield S3AssetstoreAdapter({
+            '_id': 's3-upload-test',
+            'bucket': BUCKET,
+            'accessKeyId': 'access',
+            'secret': 'secret',
+            'service': '',
+            'region': 'us-east-1',
+            'proxiedUploadConcurrency': 2
+        })
+
+
+def _startUpload(adapter):
+    return adapter.initUpload({
+        'name': 'data.bin',
+        'size': len(DATA),
+        'received': 0,
+        'userId': 'user',
+        'mimeType': 'application/octet-stream'
+    })
+
+
+def _sendChunks(adapter, upload):
+    while upload['received'] < upload['size']:
+        data = DATA[upload['received']:upload['received'] + PART_SIZE]
+        upload = adapter.uploadChunk(upload, RequestBodyStream(io.BytesIO(data), len(data)))
+    return upload
+
+
+def _finalize(adapter, upload):
+    file = adapter.finalizeUpload(upload, {})
+    return adapter.client.get_object(Bucket=BUCKET, Key=file['s3Key'])['Body'].read()
+
+
+def testPipelinedUpload(adapter):
+    upload = _sendChunks(adapter, _startUpload(adapter))
+    assert _finalize(adapter, upload) == DATA
+
+
+def testFailedPartRollsBackUpload(adapter, monkeypatch):
+    putPart = S3AssetstoreAdapter._putPart
+    failures = []
+
+    def failSecondPart(self, upload, url, data, size):
+        if 'partNumber=2' in url and not failures:
+            failures.append(url)
+            raise GirderException('Upload failed (bad gateway)')
+        return putPart(self, upload, url, data, size)
+
+    monkeypatch.setattr(S3AssetstoreAdapter, '_putPart', failSecondPart)
+    upload = _startUpload(adapter)
+    # The failure is found by a later chunk or when finalizing, whichever
+    # comes after the part's upload has finished
+    with pytest.raises(GirderException):
+        _sendChunks(adapter, upload)
+        _finalize(adapter, upload)
+    assert failures
+    assert upload['received'] == PART_SIZE
+    assert upload['s3']['partNumber'] == 1
+    assert [part['PartNumber'] for part in upload['s3']['parts']] == [1]
+
+    # Resuming from the rolled back offset completes the upload
+    upload = _sendChunks(adapter, upload)
+    assert _finalize(adapter, upload) == DATA
+
+
+def testMissingPartIsNotCompleted(adapter, monkeypatch):
+    putPart = S3AssetstoreAdapter._putPart
+
+    def dropSecondPart(self, upload, url, data, size):
+        if 'partNumber=2' in url:
+            return None
+        return putPart(self, upload, url, data, size)
+
+    monkeypatch.setattr(S3AssetstoreAdapter, '_putPart', dropSecondPart)
+    upload = _sendChunks(adapter, _startUpload(adapter))
+    with pytest.raises(GirderException, match='part 2 is missing'):
+        _finalize(adapter, upload)
+    assert upload['received'] == PART_SIZE
+    assert upload['s3']['partNumber'] == 1
@@ -10,6 +10,8 @@ import pytz
 import re
 import string
 
+from bson.objectid import ObjectId
+
 import girder
 import girder.events
 
@@ -114,15 +116,20 @@ class JsonEncoder(json.JSONEncoder):
     """
     This extends the standard json.JSONEncoder to allow for more types to be
     sensibly serialized. This is used in Girder's REST layer to serialize
-    route return values when JSON is requested.
+    route return values when JSON is requested.  The ``rest.json_encode``
+    event is triggered for any type that JSON does not support, but only if
+    it has handlers, since this is called for every ObjectId and datetime.
     """
 
     def default(self, obj):
-        event = girder.events.trigger('rest.json_encode', obj)
-        if len(event.responses):
-            return event.responses[-1]
-
-        if isinstance(obj, set):
+        if girder.events.hasHandlers('rest.json_encode'):
+            event = girder.events.trigger('rest.json_encode', obj)
+            if len(event.responses):
+                return event.responses[-1]
+
+        if isinstance(obj, ObjectId):
+            return str(obj)
+        elif isinstance(obj, set):
             return tuple(obj)
         elif isinstance(obj, datetime.datetime):
             return obj.replace(tzinfo=pytz.UTC).isoformat()
@@ -1,7 +1,10 @@
+import collections
 import io
 import itertools
 import os
 import re
+import threading
+import uuid
 
 import cherrypy
 from cherrypy._cpreqbody import Part
@@ -12,6 +15,68 @@ from girder.models.setting import Setting
 from girder.settings import SettingKey
 from girder.utility import progress, RequestBodyStream
 
+# The most parts that a multipart/byteranges response will contain.  Requests
+# for more ranges than this (after coalescing) are served as a single range.
+MAX_DOWNLOAD_RANGES = 256
+
+
+def coalesceRanges(ranges, gap=0):
+    """
+    Sort a list of byte ranges and merge those that overlap or are separated
+    by no more than ``gap`` bytes.
+
+    :param ranges: (start, end) pairs, where end is exclusive.
+    :type ranges: list
+    :param gap: The largest gap between two ranges that will be merged.
+    :type gap: int
+    :returns: a sorted list of non-overlapping (start, end) pairs.
+    """
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + gap:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+# File handles read and cache file data in blocks of this many bytes
+FILE_HANDLE_BLOCK_SIZE = 256 * 1024
+
+
+class _BlockCache:
+    """
+    A thread-safe LRU cache of file data blocks, bounded by the total number of
+    bytes held.  A single instance is shared by all file handles.
+    """
+
+    def __init__(self):
+        self.maxSize = 0
+        self._size = 0
+        self._blocks = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            data = self._blocks.get(key)
+            if data is not None:
+                self._blocks.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        with self._lock:
+            if key in self._blocks:
+                self._size -= len(self._blocks.pop(key))
+            if len(data) > self.maxSize:
+                return
+            self._blocks[key] = data
+            self._size += len(data)
+            while self._size > self.maxSize:
+                self._size -= len(self._blocks.popitem(last=False)[1])
+
+
+_blockCache = _BlockCache()
+
 
 class FileHandle:
     """
@@ -19,8 +84,9 @@ class FileHandle:
     Girder file objects. The ``open`` method of assetstore implementations
     is responsible for returning an instance of this class or one of its
     subclasses. This base class implementation is returned by the
-    abstract assetstore adapter, and does not leverage any details of the
-    assetstore implementations.
+    abstract assetstore adapter. For adapters that support efficient range
+    reads, data is read in blocks with read-ahead for sequential access, and
+    the blocks are kept in an LRU cache shared by all handles.
 
     These file handles are stateful, and therefore not safe for concurrent
     access. If used by multiple threads, mutexes should be used.
@@ -39,6 +105,19 @@ class FileHandle:
         # an exception.  This prevents unbounded memory use.
         self._maximumReadSize = 16 * 1024 * 1024
 
+        # Adapters with efficient range reads are read in cached blocks rather
+        # than as a single stream that has to be restarted on every seek.
+        self._blockReads = adapter.supportsRangeReads
+        if self._blockReads:
+            self._readAhead = Setting().get(SettingKey.FILE_HANDLE_READ_AHEAD)
+            _blockCache.maxSize = Setting().get(SettingKey.FILE_HANDLE_CACHE_SIZE)
+            # Blocks are keyed by the file's entity tag, which changes with
+            # its contents, so a changed file never uses stale blocks.
+            from girder.models.file import File
+
+            self._cacheKey = (str(file['_id']), File().getETag(file))
+            self._lastReadEnd = None
+
         self.seek(0)
 
     def __enter__(self):
@@ -63,6 +142,10 @@ class FileHandle:
             size = self._file['size'] - self._pos
         if size > self._maximumReadSize:
             raise GirderException('Read exceeds maximum allowed size.')
+        if self._blockReads:
+            data = self._readBlocks(self._pos, min(self._pos + size, self._file['size']))
+            self._pos += len(data)
+            return data
         data = io.BytesIO()
         length = 0
         for chunk in itertools.chain(self._prev, self._stream):
@@ -88,6 +171,41 @@ class FileHandle:
         self._pos += length
         return data.getvalue()
 
+    def _readBlocks(self, start, end):
+        """
+        Read a range of the file through the shared block cache.  Missing
+        blocks are fetched with a single range read, which is extended by the
+        read-ahead size when the file is being read sequentially.
+        """
+        if end <= start:
+            return b''
+        blockSize = FILE_HANDLE_BLOCK_SIZE
+        firstBlock, lastBlock = start // blockSize, (end - 1) // blockSize
+        blocks = {}
+        missing = []
+        for index in range(firstBlock, lastBlock + 1):
+            data = _blockCache.get(self._cacheKey + (index,))
+            if data is None:
+                missing.append(index)
+            else:
+                blocks[index] = data
+
+        if missing:
+            fetchStart = missing[0] * blockSize
+            fetchEnd = (missing[-1] + 1) * blockSize
+            if start == self._lastReadEnd:
+                fetchEnd += -(-self._readAhead // blockSize) * blockSize
+            fetchEnd = min(fetchEnd, self._file['size'])
+            data = self._adapter.readRange(self._file, fetchStart, fetchEnd)
+            for offset in range(0, len(data), blockSize):
+                index = (fetchStart + offset) // blockSize
+                blocks[index] = data[offset:offset + blockSize]
+                _blockCache.put(self._cacheKey + (index,), blocks[index])
+
+        self._lastReadEnd = end
+        data = b''.join(blocks.get(index, b'') for index in range(firstBlock, lastBlock + 1))
+        return data[start - firstBlock * blockSize:end - firstBlock * blockSize]
+
     def tell(self):
         return self._pos
 
@@ -101,7 +219,7 @@ class FileHandle:
         elif whence == os.SEEK_END:
             self._pos = max(self._file['size'] + offset, 0)
 
-        if self._pos != oldPos:
+        if self._pos != oldPos and not self._blockReads:
             self._prev = []
             self._stream = self._adapter.downloadFile(self._file, offset=self._pos, headers=False)()
 
@@ -114,6 +232,23 @@ class AbstractAssetstoreAdapter:
     This defines the interface to be used by all assetstore adapters.
     """
 
+    # Whether reconcileUpload can recover upload progress from the stored data.
+    # If not, upload progress is saved after every chunk.
+    canReconcileUploads = False
+
+    # The fields of an upload document that uploadChunk changes.  Only these
+    # are written when upload progress is saved.
+    uploadProgressFields = ('received', 'sha512state')
+
+    # Whether readRange is efficient for random access.  If so, file handles
+    # read through a block cache rather than streaming with downloadFile.
+    supportsRangeReads = False
+
+    # Requested ranges separated by no more than this many bytes are sent as
+    # one part of a multi-range download.  This is roughly the size of a part
+    # header; adapters for which each read is expensive may raise it.
+    rangeCoalesceGap = 128
+
     def __init__(self, assetstore):
         self.assetstore = assetstore
 
@@ -199,6 +334,35 @@ class AbstractAssetstoreAdapter:
         """
         return upload['received']
 
+    def reconcileUpload(self, upload):
+        """
+        Bring the upload document up to date with the data that has actually
+        been stored in the assetstore, so that uploads whose progress was not
+        saved after every chunk can be resumed. Adapters that implement this
+        should set ``canReconcileUploads`` to True. Default behavior is to
+        return the upload document unmodified.
+
+        :param upload: The upload document, which may lag the stored data.
+        :type upload: dict
+        :returns: The upload document with its received count and any other
+            progress information updated.
+        """
+        return upload
+
+    def isUploadCurrent(self, upload):
+        """
+        Check, without reading the stored data, whether an upload document's
+        progress matches the data that has been stored.  This is used to trust
+        progress that a process kept in memory instead of checkpointing.
+        Adapters that set ``canReconcileUploads`` should implement this;
+        the default never trusts such progress.
+
+        :param upload: The upload document.
+        :type upload: dict
+        :rtype: bool
+        """
+        return False
+
     def deleteFile(self, file):
         """
         This is called when a File is deleted to allow the adapter to remove
@@ -262,6 +426,90 @@ class AbstractAssetstoreAdapter:
         raise NotImplementedError('Must override downloadFile in %s.' %
                                   self.__class__.__name__)
 
+    def downloadRanges(self, file, ranges, contentDisposition=None, extraParameters=None):
+        """
+        Return a generator function that streams several byte ranges of a file
+        as a ``multipart/byteranges`` response, setting the response headers.
+        Ranges are coalesced according to ``rangeCoalesceGap``; if that leaves
+        a single range, this is the same as calling ``downloadFile`` for it.
+
+        :param file: The file document being downloaded.
+        :type file: dict
+        :param ranges: (start, end) pairs, where end is exclusive.
+        :type ranges: list
+        :param contentDisposition: Value for Content-Disposition response
+            header disposition-type value.
+        :type contentDisposition: str or None
+        :type extraParameters: str or None
+        """
+        ranges = coalesceRanges(ranges, self.rangeCoalesceGap)
+        if len(ranges) > MAX_DOWNLOAD_RANGES:
+            ranges = [(ranges[0][0], ranges[-1][1])]
+        if len(ranges) == 1:
+            return self.downloadFile(
+                file, offset=ranges[0][0], endByte=ranges[0][1],
+                contentDisposition=contentDisposition, extraParameters=extraParameters)
+
+        boundary = uuid.uuid4().hex
+        mimeType = file.get('mimeType') or 'application/octet-stream'
+        partHeaders = [(
+            '--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n' % (
+                boundary, mimeType, start, end - 1, file['size'])).encode('utf8')
+            for start, end in ranges]
+        closing = ('--%s--\r\n' % boundary).encode('utf8')
+        length = sum(len(header) + end - start + 2
+                     for header, (start, end) in zip(partHeaders, ranges)) + len(closing)
+
+        cherrypy.response.status = 206
+        setResponseHeader('Accept-Ranges', 'bytes')
+        setResponseHeader('Content-Type', 'multipart/byteranges; boundary=%s' % boundary)
+        setContentDisposition(file['name'], contentDisposition or 'attachment')
+        setResponseHeader('Content-Length', length)
+
+        def stream():
+            for header, part in zip(partHeaders, self.iterRanges(
+                    file, ranges, extraParameters=extraParameters)):
+                yield header
+                yield from part
+                yield b'\r\n'
+            yield closing
+
+        return stream
+
+    def iterRanges(self, file, ranges, extraParameters=None):
+        """
+        Generate an iterable of the bytes of each of a list of sorted,
+        non-overlapping ranges of a file.  Each iterable must be consumed
+        before advancing to the next.  The default implementation calls
+        ``downloadFile`` once per range; adapters may override this to share
+        work between ranges.
+
+        :param file: The file document.
+        :type file: dict
+        :param ranges: sorted (start, end) pairs, where end is exclusive.
+        :type ranges: list
+        :type extraParameters: str or None
+        """
+        for start, end in ranges:
+            yield self.downloadFile(
+                file, offset=start, endByte=end, headers=False,
+                extraParameters=extraParameters)()
+
+    def readRange(self, file, start, end):
+        """
+        Read a range of bytes of a file.  Adapters that set
+        ``supportsRangeReads`` should make this efficient for random access.
+
+        :param file: The file document.
+        :type file: dict
+        :param start: The first byte to read.
+        :type start: int
+        :param end: The byte after the last byte to read.
+        :type end: int
+        :rtype: bytes
+        """
+        return b''.join(next(iter(self.iterRanges(file, [(start, end)]))))
+
     def findInvalidFiles(self, progress=progress.noProgress, filters=None,
                          checkSize=True, **kwargs):
         """
@@ -271,6 +271,8 @@ class AccessControlMixin:
         :returns: A pymongo Cursor, CommandCursor, or an iterable.  If a
             CommandCursor, it has been augmented with a count function.
         """
+        if fields is None:
+            fields = self.sparseProjection()
         if level is not None and (not user or not user['admin']):
             # If the resourceColl isn't an access controlled model that we
             # know how to reach, fall back to performing the ordinary query and
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""
+Asynchronous delivery of audit log records.  While the server is running, the
+handlers of the audit logger are moved to a background writer, and records are
+passed to it through a bounded queue, so that a slow audit sink doesn't add
+latency to requests.  The writer hands records to its handlers in batches;
+handlers with an ``emitBatch`` method, such as ``MongoAuditLogHandler``, get a
+whole batch at once.  Handlers added to the audit logger after the writer has
+started are still called synchronously; use ``addHandler`` for those that
+should run on the writer.
+
+Handlers run on the writer's thread, so they can't read the current request.
+The identifying parts of the request are copied to each record when it is
+logged, as ``requestUid``, ``remoteIp``, and ``userId`` attributes.
+
+This is configured in the ``[logging]`` section of the config file:
+
+    ``audit_log_queue_size``: the number of records the queue holds.
+    ``audit_log_queue_policy``: what to do with records when the queue is full,
+    ``drop`` them or ``block`` the request for up to a second waiting for room.
+    ``audit_log_file``: a file to write records to, rotated like the other logs.
+    ``audit_log_collection``: a database collection to write records to.
+"""
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+
+import cherrypy
+
+from girder import auditLogger, logger
+from girder.constants import LOG_BACKUP_COUNT, MAX_LOG_SIZE
+from girder.utility import config, JsonEncoder
+
+AUDIT_QUEUE_SIZE = 10000
+# The most records passed to the handlers at once
+AUDIT_BATCH_SIZE = 500
+# How long a request waits for room in the queue with the "block" policy
+AUDIT_BLOCK_TIMEOUT = 1.0
+
+_STOP = object()
+
+_lock = threading.Lock()
+_writer = None
+_extraHandlers = []
+_configured = None
+_stats = {
+    'queued': 0,
+    'written': 0,
+    'dropped': 0,
+    'blocked': 0,
+    'batches': 0,
+    'errors': 0,
+}
+
+
+def _count(name, amount=1):
+    with _lock:
+        _stats[name] += amount
+
+
+class MongoAuditLogHandler(logging.Handler):
+    """
+    A log handler that inserts audit records into a database collection, a
+    batch at a time.
+
+    :param collection: The name of the collection.
+    :type collection: str
+    """
+
+    def __init__(self, collection):
+        super().__init__()
+        self.collectionName = collection
+        self._collection = None
+
+    def _getCollection(self):
+        if self._collection is None:
+            from girder.models import getDbConnection
+            self._collection = getDbConnection().get_database()[self.collectionName]
+        return self._collection
+
+    def _toDocument(self, record):
+        return {
+            'type': record.getMessage(),
+            'details': getattr(record, 'details', None),
+            'when': datetime.datetime.utcfromtimestamp(record.created),
+            'requestUid': getattr(record, 'requestUid', None),
+            'ip': getattr(record, 'remoteIp', None),
+            'userId': getattr(record, 'userId', None),
+        }
+
+    def emitBatch(self, records):
+        self._getCollection().insert_many(
+            [self._toDocument(record) for record in records], ordered=False)
+
+    def emit(self, record):
+        try:
+            self.emitBatch([record])
+        except Exception:
+            self.handleError(record)
+
+
+class _AuditQueueHandler(logging.handlers.QueueHandler):
+    """
+    Puts audit records on the writer's queue, after recording details of the
+    current request on them.
+    """
+
+    def __init__(self, queue, block):
+        super().__init__(queue)
+        self.block = block
+
+    def prepare(self, record):
+        request = cherrypy.request
+        record.requestUid = getattr(request, 'girderRequestUid', None)
+        record.remoteIp = getattr(getattr(request, 'remote', None), 'ip', None)
+        # Don't look the user up just to log it; use it if it is known
+        user = getattr(request, 'girderUser', None)
+        record.userId = user['_id'] if user else None
+        return super().prepare(record)
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if not self.block:
+                _count('dropped')
+                return
+            _count('blocked')
+            try:
+                self.queue.put(record, timeout=AUDIT_BLOCK_TIMEOUT)
+            except queue.Full:
+                _count('dropped')
+                return
+        _count('queued')
+
+
+class _AuditWriter(threading.Thread):
+    """
+    Drains the audit queue, passing records to the handlers in batches.
+    """
+
+    def __init__(self, handlers, queueSize):
+        super().__init__(name='girder-audit-writer', daemon=True)
+        self.handlers = handlers
+        self.queue = queue.Queue(maxsize=queueSize)
+
+    def _write(self, batch):
+        for handler in self.handlers:
+            records = [
+                record for record in batch
+                if record.levelno >= handler.level and handler.filter(record)]
+            if not records:
+                continue
+            if hasattr(handler, 'emitBatch'):
+                try:
+                    handler.emitBatch(records)
+                except Exception:
+                    _count('errors')
+                    logger.exception('Failed to write %d audit log records.', len(records))
+            else:
+                for record in records:
+                    handler.handle(record)
+        _count('written', len(batch))
+        _count('batches')
+
+    def run(self):
+        stopping = False
+        while True:
+            batch = []
+            try:
+                # Once stopping, write whatever is left without waiting
+                record = self.queue.get_nowait() if stopping else self.queue.get()
+            except queue.Empty:
+                return
+            while True:
+                if record is _STOP:
+                    stopping = True
+                else:
+                    batch.append(record)
+                if len(batch) >= AUDIT_BATCH_SIZE:
+                    break
+                try:
+                    record = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            if batch:
+                self._write(batch)
+
+
+class _AuditFormatter(logging.Formatter):
+    """
+    Formats audit records with their details as JSON.
+    """
+
+    def format(self, record):
+        return '%s %s' % (super().format(record), json.dumps(
+            getattr(record, 'details', None), cls=JsonEncoder, sort_keys=True))
+
+
+def _configuredHandlers():
+    """
+    Get the handlers for the sinks set in the config.  These are only
+    created once, so that restarting the writer doesn't add them twice.
+    """
+    global _configured
+    if _configured is None:
+        logCfg = config.getConfig().get('logging', {})
+        _configured = []
+        if logCfg.get('audit_log_file'):
+            handler = logging.handlers.RotatingFileHandler(
+                logCfg['audit_log_file'], maxBytes=MAX_LOG_SIZE,
+                backupCount=int(logCfg.get('log_backup_count', LOG_BACKUP_COUNT)))
+            handler.setFormatter(_AuditFormatter('[%(asctime)s] %(message)s'))
+            _configured.append(handler)
+        if logCfg.get('audit_log_collection'):
+            _configured.append(MongoAuditLogHandler(logCfg['audit_log_collection']))
+    return _configured
+
+
+def addHandler(handler):
+    """
+    Add a handler for audit log records that runs on the background writer.
+    If the writer isn't running, the handler is added to the audit logger.
+
+    :param handler: The log handler.
+    :type handler: logging.Handler
+    """
+    with _lock:
+        _extraHandlers.append(handler)
+        if _writer is not None:
+            _writer.handlers.append(handler)
+            return
+    auditLogger.addHandler(handler)
+
+
+def start():
+    """
+    Start writing audit log records on a background thread.  This moves the
+    current handlers of the audit logger to the writer.
+    """
+    global _writer
+    with _lock:
+        if _writer is not None:
+            return
+        logCfg = config.getConfig().get('logging', {})
+        queueSize = int(logCfg.get('audit_log_queue_size', AUDIT_QUEUE_SIZE))
+        block = logCfg.get('audit_log_queue_policy', 'drop') == 'block'
+
+        handlers = list(auditLogger.handlers)
+        handlers.extend(
+            h for h in _configuredHandlers() + _extraHandlers if h not in handlers)
+        for handler in handlers:
+            auditLogger.removeHandler(handler)
+        _writer = _AuditWriter(handlers, queueSize)
+        _writer.queueHandler = _AuditQueueHandler(_writer.queue, block)
+        auditLogger.addHandler(_writer.queueHandler)
+        _writer.start()
+
+
+def stop():
+    """
+    Write any queued audit log records and stop the background writer.  The
+    audit logger's handlers are restored, so records logged afterwards are
+    written synchronously.
+    """
+    global _writer
+    with _lock:
+        writer, _writer = _writer, None
+    if writer is None:
+        return
+    auditLogger.removeHandler(writer.queueHandler)
+    writer.queue.put(_STOP)
+    writer.join()
+    for handler in writer.handlers:
+        auditLogger.addHandler(handler)
+
+
+def getStats():
+    """
+    Get the counters of the audit log writer.
+
+    :returns: a dictionary of counters.
+    """
+    with _lock:
+        stats = dict(_stats)
+        writer = _writer
+    stats['running'] = writer is not None
+    stats['queueDepth'] = writer.queue.qsize() if writer is not None else 0
+    return stats
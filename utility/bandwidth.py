@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Token-bucket bandwidth shaping for file downloads.  Limits are configured in
+bytes per second through settings: a global limit shared by all downloads, a
+limit for each user, and limits for tokens with particular scopes.  A
+download is paced by every bucket that applies to it.
+"""
+import threading
+import time
+
+from girder.settings import SettingKey
+
+# Each bucket can accumulate this many seconds worth of its rate, which is the
+# largest burst a stream can send after being idle.
+BURST_SECONDS = 1.0
+# Streams are paced in pieces of at most this many bytes, so that a waiting
+# stream only ever sleeps for a short time before sending more data.
+PIECE_SIZE = 64 * 1024
+# Idle, full per-user buckets are discarded when there are more than this many.
+MAX_USER_BUCKETS = 10000
+
+_lock = threading.Lock()
+_globalBucket = None
+_userBuckets = {}
+_scopeBuckets = {}
+_stats = {
+    'bytesThrottled': 0,
+    'activeStreams': 0,
+    'waits': 0,
+    'waitSeconds': 0.0,
+}
+
+
+class _TokenBucket:
+    """
+    A token bucket holding up to BURST_SECONDS worth of bytes at its rate.
+    This must only be used while holding the module lock.
+
+    :param rate: the rate in bytes per second.
+    :type rate: int
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.tokens = rate * BURST_SECONDS
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(
+            self.rate * BURST_SECONDS, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    @property
+    def full(self):
+        return self.tokens >= self.rate * BURST_SECONDS
+
+
+def _bucket(buckets, key, rate):
+    bucket = buckets.get(key)
+    if bucket is None:
+        bucket = buckets[key] = _TokenBucket(rate)
+    bucket.rate = rate
+    return bucket
+
+
+def _pruneUserBuckets(now):
+    for key, bucket in list(_userBuckets.items()):
+        bucket.refill(now)
+        if bucket.full:
+            del _userBuckets[key]
+
+
+def requestBuckets(user=None, token=None):
+    """
+    Get the token buckets that apply to a download by a user with a token.
+    This reads the current limits from the settings, so must be called when
+    the download starts rather than as data is sent.
+
+    :param user: the user downloading, if any.
+    :type user: dict or None
+    :param token: the token used for the download, if any.
+    :type token: dict or None
+    :returns: a list of buckets, which is empty if the download is not limited.
+    """
+    global _globalBucket
+    from girder.models.setting import Setting
+
+    globalRate = Setting().get(SettingKey.DOWNLOAD_RATE_LIMIT)
+    userRate = Setting().get(SettingKey.DOWNLOAD_RATE_LIMIT_PER_USER)
+    scopeRates = Setting().get(SettingKey.DOWNLOAD_RATE_LIMIT_SCOPES)
+    buckets = []
+    with _lock:
+        if globalRate:
+            if _globalBucket is None:
+                _globalBucket = _TokenBucket(globalRate)
+            _globalBucket.rate = globalRate
+            buckets.append(_globalBucket)
+        if userRate and user is not None:
+            if len(_userBuckets) > MAX_USER_BUCKETS:
+                _pruneUserBuckets(time.monotonic())
+            buckets.append(_bucket(_userBuckets, str(user['_id']), userRate))
+        if scopeRates and token is not None:
+            for scope in token.get('scope') or ():
+                if scopeRates.get(scope):
+                    buckets.append(_bucket(_scopeBuckets, scope, scopeRates[scope]))
+    return buckets
+
+
+def _acquire(buckets, want):
+    """
+    Take up to ``want`` bytes from every bucket.
+
+    :returns: a tuple of the number of bytes granted and, if none were, the
+        number of seconds until some will be available.
+    """
+    with _lock:
+        now = time.monotonic()
+        for bucket in buckets:
+            bucket.refill(now)
+        available = int(min(bucket.tokens for bucket in buckets))
+        # A piece can't be larger than the smallest bucket can ever hold
+        piece = max(1, min(PIECE_SIZE, int(min(
+            bucket.rate * BURST_SECONDS for bucket in buckets))))
+        need = min(want, piece)
+        if available >= need:
+            granted = min(want, available, piece)
+            for bucket in buckets:
+                bucket.tokens -= granted
+            return granted, 0
+        return 0, max((need - bucket.tokens) / bucket.rate for bucket in buckets)
+
+
+def throttle(generator):
+    """
+    Wrap a download generator function so that its output is paced by the
+    bandwidth limits that apply to the current request.  Rather than holding
+    back whole buffers, data is passed on in pieces as bandwidth becomes
+    available, so a limited stream only pauses briefly between pieces.  This
+    must be called while handling the request, not from the generator.
+
+    :param generator: a generator function yielding the download's bytes.
+    :returns: a generator function.
+    """
+    from girder.api.rest import getCurrentUser
+
+    buckets = requestBuckets(*getCurrentUser(returnToken=True))
+    if not buckets:
+        return generator
+
+    def throttled():
+        with _lock:
+            _stats['activeStreams'] += 1
+        try:
+            for data in generator():
+                if isinstance(data, str):
+                    data = data.encode('utf8')
+                offset = 0
+                while offset < len(data):
+                    granted, wait = _acquire(buckets, len(data) - offset)
+                    if not granted:
+                        with _lock:
+                            _stats['waits'] += 1
+                            _stats['waitSeconds'] += wait
+                        time.sleep(wait)
+                        continue
+                    with _lock:
+                        _stats['bytesThrottled'] += granted
+                    yield data[offset:offset + granted]
+                    offset += granted
+        finally:
+            with _lock:
+                _stats['activeStreams'] -= 1
+    return throttled
+
+
+def getStats():
+    """
+    Get the counters of the bandwidth limiter.
+
+    :returns: a dictionary of counters.
+    """
+    with _lock:
+        stats = dict(_stats)
+        stats['userBuckets'] = len(_userBuckets)
+        stats['scopeBuckets'] = len(_scopeBuckets)
+    return stats
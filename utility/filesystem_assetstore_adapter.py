@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import cherrypy
 import filelock
 from hashlib import sha512
 import io
@@ -7,9 +8,10 @@ import psutil
 import shutil
 import stat
 import tempfile
+import urllib.parse
 
 from girder import events, logger
-from girder.api.rest import setResponseHeader
+from girder.api.rest import setContentDisposition, setResponseHeader
 from girder.exceptions import ValidationException, GirderException
 from girder.models.file import File
 from girder.models.folder import Folder
@@ -20,6 +22,15 @@ from . import _hash_state
 from .abstract_assetstore_adapter import AbstractAssetstoreAdapter
 
 BUF_SIZE = 65536
+# Read size used when a single file is served directly over HTTP
+DIRECT_BUF_SIZE = 1024 * 1024
+
+# Ways in which serving the bytes of an HTTP download can be handed to a
+# fronting proxy.  With 'x-accel-redirect' (nginx), the assetstore's
+# downloadOffloadPrefix must name an internal location that maps to its root.
+DOWNLOAD_OFFLOAD_MODES = ('none', 'x-sendfile', 'x-accel-redirect')
+# Query parameters that select part of a file to download
+_QUERY_RANGE_PARAMS = frozenset({'offset', 'endByte'})
 
 # Default permissions for the files written to the filesystem
 DEFAULT_PERMS = stat.S_IRUSR | stat.S_IWUSR
@@ -35,6 +46,9 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
     :type assetstore: dict
     """
 
+    canReconcileUploads = True
+    supportsRangeReads = True
+
     @staticmethod
     def validateInfo(doc):
         """
@@ -76,6 +90,16 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
                 raise ValidationException(
                     'File permissions must be an octal integer.')
 
+        doc['downloadOffload'] = doc.get('downloadOffload') or 'none'
+        if doc['downloadOffload'] not in DOWNLOAD_OFFLOAD_MODES:
+            raise ValidationException(
+                'Download offload must be one of %s.' % ', '.join(DOWNLOAD_OFFLOAD_MODES),
+                'downloadOffload')
+        if doc['downloadOffload'] == 'x-accel-redirect' and not doc.get('downloadOffloadPrefix'):
+            raise ValidationException(
+                'A download offload prefix is required for X-Accel-Redirect.',
+                'downloadOffloadPrefix')
+
     @staticmethod
     def fileIndexFields():
         """
@@ -145,22 +169,13 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
         if isinstance(chunk, bytes):
             chunk = io.BytesIO(chunk)
 
-        # Restore the internal state of the streaming SHA-512 checksum
-        checksum = _hash_state.restoreHex(upload['sha512state'], 'sha512')
-
-        if self.requestOffset(upload) > upload['received']:
-            # This probably means the server died midway through writing last
-            # chunk to disk, and the database record was not updated. This
-            # means we need to update the sha512 state with the difference.
-            with open(upload['tempFile'], 'rb') as tempFile:
-                tempFile.seek(upload['received'])
-                while True:
-                    data = tempFile.read(BUF_SIZE)
-                    if not data:
-                        break
-                    checksum.update(data)
-
         with open(upload['tempFile'], 'a+b') as tempFile:
+            if tempFile.seek(0, os.SEEK_END) != upload['received']:
+                # The server died midway through writing a chunk, or the
+                # upload's progress lags the temp file.
+                upload = self.reconcileUpload(upload)
+            # Restore the internal state of the streaming SHA-512 checksum
+            checksum = _hash_state.restoreHex(upload['sha512state'], 'sha512')
             size = 0
             while not upload['received'] + size > upload['size']:
                 data = chunk.read(BUF_SIZE)
@@ -183,6 +198,33 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
         upload['received'] += size
         return upload
 
+    def reconcileUpload(self, upload):
+        """
+        If the temp file is longer than the upload document records, either
+        the server died midway through writing a chunk or the upload's progress
+        was not saved after the last chunks.  Update the sha512 state and the
+        received count with the difference.
+        """
+        size = self.requestOffset(upload)
+        if size > upload['received']:
+            checksum = _hash_state.restoreHex(upload['sha512state'], 'sha512')
+            with open(upload['tempFile'], 'rb') as tempFile:
+                tempFile.seek(upload['received'])
+                while True:
+                    data = tempFile.read(BUF_SIZE)
+                    if not data:
+                        break
+                    checksum.update(data)
+            upload['sha512state'] = _hash_state.serializeHex(checksum)
+            upload['received'] = size
+        return upload
+
+    def isUploadCurrent(self, upload):
+        """
+        The upload is current if the temp file is as long as it has received.
+        """
+        return self.requestOffset(upload) == upload['received']
+
     def requestOffset(self, upload):
         """
         Returns the size of the temp file.
@@ -260,9 +302,26 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
                 'file-does-not-exist')
 
         if headers:
+            # The proxy honors a Range header, but knows nothing of a range
+            # passed in the query string, so those are streamed directly.
+            queryRange = not _QUERY_RANGE_PARAMS.isdisjoint(cherrypy.request.params or ())
+            if not queryRange and self._offloadDownload(file, path, contentDisposition):
+                return lambda: iter(())
+
             setResponseHeader('Accept-Ranges', 'bytes')
             self.setContentHeaders(file, offset, endByte, contentDisposition)
 
+            def directStream():
+                with open(path, 'rb') as f:
+                    if hasattr(os, 'posix_fadvise'):
+                        os.posix_fadvise(
+                            f.fileno(), offset, endByte - offset, os.POSIX_FADV_SEQUENTIAL)
+                    f.seek(offset)
+                    yield from cherrypy.lib.file_generator_limited(
+                        f, endByte - offset, DIRECT_BUF_SIZE)
+
+            return directStream
+
         def stream():
             bytesRead = offset
             with open(path, 'rb') as f:
@@ -283,6 +342,73 @@ class FilesystemAssetstoreAdapter(AbstractAssetstoreAdapter):
 
         return stream
 
+    def downloadRanges(self, file, ranges, contentDisposition=None, extraParameters=None):
+        """
+        Offloaded downloads leave multi-range requests to the proxy, too.
+        """
+        if self._offloadDownload(file, self.fullPath(file), contentDisposition):
+            return lambda: iter(())
+        return super().downloadRanges(file, ranges, contentDisposition, extraParameters)
+
+    def iterRanges(self, file, ranges, extraParameters=None):
+        """
+        Read each range with positional reads on a single open file.
+        """
+        path = self.fullPath(file)
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            for start, end in ranges:
+                yield self._preadRange(fd, start, end)
+        finally:
+            os.close(fd)
+
+    def readRange(self, file, start, end):
+        """
+        Read a range of the file with positional reads.
+        """
+        fd = os.open(self.fullPath(file), os.O_RDONLY)
+        try:
+            return b''.join(self._preadRange(fd, start, end))
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _preadRange(fd, start, end):
+        while start < end:
+            data = os.pread(fd, min(BUF_SIZE, end - start), start)
+            if not data:
+                break
+            start += len(data)
+            yield data
+
+    def _offloadDownload(self, file, path, contentDisposition):
+        """
+        If this assetstore is configured to have a fronting proxy serve
+        downloads, set the headers that hand the file to it.  The proxy handles
+        any Range header itself, so no length or range headers are set here.
+
+        :returns: True if the download was offloaded.
+        """
+        mode = self.assetstore.get('downloadOffload', 'none')
+        if mode == 'x-sendfile':
+            setResponseHeader('X-Sendfile', path)
+        elif mode == 'x-accel-redirect':
+            relpath = os.path.relpath(path, self.assetstore['root'])
+            if relpath.startswith(os.pardir):
+                # Imported files outside of the root can't be mapped to the
+                # proxy's internal location.
+                return False
+            setResponseHeader('X-Accel-Redirect', '/'.join((
+                self.assetstore['downloadOffloadPrefix'].rstrip('/'),
+                urllib.parse.quote(relpath.replace(os.sep, '/')))))
+        else:
+            return False
+
+        setResponseHeader(
+            'Content-Type', file.get('mimeType') or 'application/octet-stream')
+        setContentDisposition(file['name'], contentDisposition or 'attachment')
+        return True
+
     def deleteFile(self, file):
         """
         Deletes the file from disk if it is the only File in this assetstore
@@ -18,6 +18,13 @@ from .abstract_assetstore_adapter import AbstractAssetstoreAdapter
 # 2MB chunks. Clients must not send any chunks that are smaller than this
 # unless they are sending the final chunk.
 CHUNK_SIZE = 2097152
+# Number of chunks that are buffered during an upload before they are written
+# to the database with a single insert_many call.
+UPLOAD_BATCH_CHUNKS = 8
+# Number of chunks fetched from the database per cursor batch when downloading.
+DOWNLOAD_BATCH_CHUNKS = 4
+# MongoDB's error code for a duplicate key
+DUPLICATE_KEY_ERROR = 11000
 
 # Cache recent connections so we can skip some start up actions
 RECENT_CONNECTION_CACHE_TIME = 600  # seconds
@@ -43,6 +50,10 @@ class GridFsAssetstoreAdapter(AbstractAssetstoreAdapter):
     model.
     """
 
+    canReconcileUploads = True
+    uploadProgressFields = ('received', 'sha512state', 'chunkN')
+    supportsRangeReads = True
+
     @staticmethod
     def validateInfo(doc):
         """
@@ -117,9 +128,36 @@ class GridFsAssetstoreAdapter(AbstractAssetstoreAdapter):
         Creates a UUID that will be used to uniquely link each chunk to
         """
         upload['chunkUuid'] = uuid.uuid4().hex
+        upload['chunkN'] = 0
         upload['sha512state'] = _hash_state.serializeHex(sha512())
         return upload
 
+    def _insertChunks(self, upload, docs):
+        """
+        Write a batch of chunk documents to the database.  The writes are
+        unordered, so a duplicate chunk doesn't prevent the remainder of the
+        batch from being written.
+
+        :param upload: the upload document the chunks belong to.
+        :param docs: a list of chunk documents.
+        """
+        if not docs:
+            return
+        # If a timeout occurs while we are trying to load data, we might have
+        # succeeded, in which case we will get a DuplicateKeyError when it
+        # automatically retries.  Therefore, log this error but don't stop.
+        try:
+            self.chunkColl.insert_many(docs, ordered=False)
+        except pymongo.errors.BulkWriteError as exc:
+            errors = exc.details.get('writeErrors', [])
+            if (exc.details.get('writeConcernErrors')
+                    or any(err.get('code') != DUPLICATE_KEY_ERROR for err in errors)):
+                raise
+            logger.info('Received a DuplicateKeyError while uploading, '
+                        'probably because we reconnected to the database '
+                        '(chunk uuid %s parts %s)', upload['chunkUuid'],
+                        ', '.join(str(docs[err['index']]['n']) for err in errors))
+
     def uploadChunk(self, upload, chunk):
         """
         Stores the uploaded chunk in fixed-sized pieces in the chunks
@@ -134,57 +172,35 @@ class GridFsAssetstoreAdapter(AbstractAssetstoreAdapter):
         if isinstance(chunk, bytes):
             chunk = io.BytesIO(chunk)
 
+        if upload.get('chunkN') is None:
+            # Progress that lagged behind the stored chunks was already
+            # reconciled when the client's offset didn't match or the upload
+            # was resumed; only legacy uploads need their chunk index found.
+            upload = self.reconcileUpload(upload)
         # Restore the internal state of the streaming SHA-512 checksum
         checksum = _hash_state.restoreHex(upload['sha512state'], 'sha512')
-
-        # TODO: when saving uploads is optional, we can conditionally try to
-        # fetch the last chunk.  Add these line before `lastChunk = ...`:
-        #   lastChunk = None
-        #   if '_id' in upload or upload['received'] != 0:
-        lastChunk = self.chunkColl.find_one({
-            'uuid': upload['chunkUuid']
-        }, projection=['n'], sort=[('n', pymongo.DESCENDING)])
-        if lastChunk:
-            # This bit of code will only do anything if there is a discrepancy
-            # between the received count of the upload record and the length of
-            # the file stored as chunks in the database. This code updates the
-            # sha512 state with the difference before reading the bytes sent
-            # from the user.
-            if self.requestOffset(upload) > upload['received']:
-                # This isn't right -- the last received amount may not be a
-                # complete chunk.
-                cursor = self.chunkColl.find({
-                    'uuid': upload['chunkUuid'],
-                    'n': {'$gte': upload['received'] // CHUNK_SIZE}
-                }, projection=['data']).sort('n', pymongo.ASCENDING)
-                for result in cursor:
-                    checksum.update(result['data'])
-        n = lastChunk['n'] + 1 if lastChunk else 0
+        n = upload['chunkN']
 
         size = 0
         startingN = n
+        pending = []
 
         while upload['received'] + size < upload['size']:
             data = chunk.read(CHUNK_SIZE)
             if not data:
                 break
-            # If a timeout occurs while we are trying to load data, we might
-            # have succeeded, in which case we will get a DuplicateKeyError
-            # when it automatically retries.  Therefore, log this error but
-            # don't stop.
-            try:
-                self.chunkColl.insert_one({
-                    'n': n,
-                    'uuid': upload['chunkUuid'],
-                    'data': bson.binary.Binary(data)
-                })
-            except pymongo.errors.DuplicateKeyError:
-                logger.info('Received a DuplicateKeyError while uploading, '
-                            'probably because we reconnected to the database '
-                            '(chunk uuid %s part %d)', upload['chunkUuid'], n)
+            pending.append({
+                'n': n,
+                'uuid': upload['chunkUuid'],
+                'data': bson.binary.Binary(data)
+            })
+            if len(pending) >= UPLOAD_BATCH_CHUNKS:
+                self._insertChunks(upload, pending)
+                pending = []
             n += 1
             size += len(data)
             checksum.update(data)
+        self._insertChunks(upload, pending)
         chunk.close()
 
         try:
@@ -201,8 +217,61 @@ class GridFsAssetstoreAdapter(AbstractAssetstoreAdapter):
         # Persist the internal state of the checksum
         upload['sha512state'] = _hash_state.serializeHex(checksum)
         upload['received'] += size
+        upload['chunkN'] = n
         return upload
 
+    def reconcileUpload(self, upload):
+        """
+        The index of the next chunk is carried in the upload document.  Any
+        chunks at or beyond that index were stored after the upload's progress
+        was last saved, so add them to the sha512 state and the received count.
+        """
+        n = upload.get('chunkN')
+        if n is None:
+            # Uploads started before the chunk index was tracked have to
+            # consult the last chunk that is actually stored.
+            checksum = _hash_state.restoreHex(upload['sha512state'], 'sha512')
+            lastChunk = self.chunkColl.find_one({
+                'uuid': upload['chunkUuid']
+            }, projection=['n'], sort=[('n', pymongo.DESCENDING)])
+            if lastChunk and lastChunk['n'] * CHUNK_SIZE > upload['received']:
+                # This isn't right -- the last received amount may not be a
+                # complete chunk.
+                cursor = self.chunkColl.find({
+                    'uuid': upload['chunkUuid'],
+                    'n': {'$gte': upload['received'] // CHUNK_SIZE}
+                }, projection=['data']).sort('n', pymongo.ASCENDING)
+                for result in cursor:
+                    checksum.update(result['data'])
+                upload['sha512state'] = _hash_state.serializeHex(checksum)
+            upload['chunkN'] = lastChunk['n'] + 1 if lastChunk else 0
+            return upload
+
+        checksum = None
+        cursor = self.chunkColl.find({
+            'uuid': upload['chunkUuid'],
+            'n': {'$gte': n}
+        }, projection={'n': True, 'data': True, '_id': False}).sort('n', pymongo.ASCENDING)
+        for result in cursor:
+            if checksum is None:
+                checksum = _hash_state.restoreHex(upload['sha512state'], 'sha512')
+            checksum.update(result['data'])
+            upload['received'] += len(result['data'])
+            upload['chunkN'] = result['n'] + 1
+        if checksum is not None:
+            upload['sha512state'] = _hash_state.serializeHex(checksum)
+        return upload
+
+    def isUploadCurrent(self, upload):
+        """
+        The upload is current if the last stored chunk is the one before its
+        chunk index.
+        """
+        lastChunk = self.chunkColl.find_one({
+            'uuid': upload['chunkUuid']
+        }, projection=['n'], sort=[('n', pymongo.DESCENDING)])
+        return upload.get('chunkN') == (lastChunk['n'] + 1 if lastChunk else 0)
+
     def requestOffset(self, upload):
         """
         The offset will be the CHUNK_SIZE * total number of chunks in the
@@ -257,11 +326,14 @@ class GridFsAssetstoreAdapter(AbstractAssetstoreAdapter):
         if offset > 0:
             n = offset // file['chunkSize']
             chunkOffset = offset % file['chunkSize']
+        # Only fetch the chunks that overlap the requested range
+        endN = (endByte + file['chunkSize'] - 1) // file['chunkSize']
 
         cursor = self.chunkColl.find({
             'uuid': file['chunkUuid'],
-            'n': {'$gte': n}
-        }, projection=['data']).sort('n', pymongo.ASCENDING)
+            'n': {'$gte': n, '$lt': endN}
+        }, projection={'data': True, '_id': False}).sort('n', pymongo.ASCENDING)
+        cursor.batch_size(min(DOWNLOAD_BATCH_CHUNKS, endN - n))
 
         def stream():
             co = chunkOffset  # Can't assign to outer scope without "nonlocal"
@@ -287,6 +359,41 @@ class GridFsAssetstoreAdapter(AbstractAssetstoreAdapter):
 
         return stream
 
+    def iterRanges(self, file, ranges, extraParameters=None):
+        """
+        Fetch every chunk that overlaps any of the ranges with a single query,
+        so chunks shared by neighbouring ranges are read only once.
+        """
+        chunkSize = file['chunkSize']
+        chunkNs = sorted({
+            n for start, end in ranges
+            for n in range(start // chunkSize, (end + chunkSize - 1) // chunkSize)})
+        cursor = self.chunkColl.find({
+            'uuid': file['chunkUuid'],
+            'n': {'$in': chunkNs}
+        }, projection={'n': True, 'data': True, '_id': False}).sort('n', pymongo.ASCENDING)
+        cursor.batch_size(DOWNLOAD_BATCH_CHUNKS)
+        chunks = iter(cursor)
+        current = {'n': -1, 'data': b''}
+
+        def rangeData(start, end):
+            nonlocal current
+            while start < end:
+                n = start // chunkSize
+                while current['n'] < n:
+                    current = next(chunks, None)
+                    if current is None:
+                        return
+                chunkStart = n * chunkSize
+                data = current['data'][start - chunkStart:end - chunkStart]
+                if not data:
+                    return
+                start += len(data)
+                yield data
+
+        for start, end in ranges:
+            yield rangeData(start, end)
+
     def deleteFile(self, file):
         """
         Delete all of the chunks in the collection that correspond to the
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Serialization of REST responses to JSON.  The encoder backend is chosen by
+the ``json_backend`` option in the ``[server]`` section of the config file,
+which may be ``auto`` (the default), ``json``, ``orjson``, or the name of a
+backend added with ``registerBackend``.  ``auto`` uses orjson when it is
+installed and the standard library otherwise.
+
+Keys are sorted in testing mode, so responses are deterministic, or when the
+``json_sort_keys`` option is set.  Sorting is skipped otherwise, as it costs
+noticeable time on large responses.
+
+The orjson backend writes NaN and infinite floats in responses larger than
+``NON_FINITE_CHECK_SIZE`` bytes as null, where the standard library refuses
+them.
+"""
+import json
+import math
+
+from girder import logger
+from girder.constants import ServerMode
+from girder.utility import config, JsonEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson writes NaN and infinity as null.  Responses up to this many bytes
+# that contain a null are checked for them, so that they are refused as with
+# the standard library; larger responses are sent as orjson encoded them.
+NON_FINITE_CHECK_SIZE = 65536
+
+_backends = {}
+_warnedBackends = set()
+
+
+def _stdlibEncode(val, sortKeys):
+    return json.dumps(
+        val, sort_keys=sortKeys, allow_nan=False, cls=JsonEncoder).encode('utf8')
+
+
+def _hasNonFinite(val):
+    """
+    Check whether a value contains NaN or infinite floats.
+    """
+    if isinstance(val, float):
+        return not math.isfinite(val)
+    if isinstance(val, dict):
+        return any(_hasNonFinite(v) for v in val.values())
+    if isinstance(val, (list, tuple)):
+        return any(_hasNonFinite(v) for v in val)
+    return False
+
+
+def _orjsonEncode(val, sortKeys):
+    # Datetimes are passed to the encoder's default method so that they are
+    # formatted the same way as with the standard library.
+    option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+    if sortKeys:
+        option |= orjson.OPT_SORT_KEYS
+    try:
+        result = orjson.dumps(val, default=JsonEncoder().default, option=option)
+    except TypeError:
+        # orjson refuses some values the standard library accepts, such as
+        # integers larger than 64 bits.
+        return _stdlibEncode(val, sortKeys)
+    # Only look for non-finite floats in small responses with a null, so that
+    # large responses are never walked a second time.
+    if len(result) <= NON_FINITE_CHECK_SIZE and b'null' in result and _hasNonFinite(val):
+        raise ValueError('Out of range float values are not JSON compliant')
+    return result
+
+
+def registerBackend(name, encode):
+    """
+    Add a JSON encoder backend that can be selected with the ``json_backend``
+    config option.
+
+    :param name: The name of the backend.
+    :type name: str
+    :param encode: A function taking the value to encode and whether to sort
+        keys, and returning the encoded JSON as bytes.  Values that JSON does
+        not support should be converted with ``JsonEncoder().default``.
+    :type encode: callable
+    """
+    _backends[name] = encode
+
+
+def getBackend():
+    """
+    Get the name of the JSON encoder backend selected by the config.
+
+    :returns: the backend name.
+    """
+    name = config.getConfig().get('server', {}).get('json_backend', 'auto')
+    if name == 'auto':
+        return 'orjson' if 'orjson' in _backends else 'json'
+    if name not in _backends:
+        if name not in _warnedBackends:
+            _warnedBackends.add(name)
+            logger.warning('JSON backend "%s" is not available, using "json".', name)
+        return 'json'
+    return name
+
+
+def shouldSortKeys():
+    """
+    Whether encoded objects should have their keys sorted.
+    """
+    serverConfig = config.getConfig().get('server', {})
+    return (serverConfig.get('json_sort_keys', False)
+            or serverConfig.get('mode') == ServerMode.TESTING)
+
+
+def dumps(val, sortKeys=None):
+    """
+    Encode a value as JSON with the configured backend.
+
+    :param val: The value to encode.
+    :param sortKeys: Whether to sort the keys of objects.  If ``None``, this
+        is determined by the config.
+    :type sortKeys: bool or None
+    :returns: the encoded JSON as bytes.
+    """
+    if sortKeys is None:
+        sortKeys = shouldSortKeys()
+    return _backends[getBackend()](val, sortKeys)
+
+
+registerBackend('json', _stdlibEncode)
+if orjson is not None:
+    registerBackend('orjson', _orjsonEncode)
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+Metrics of REST requests: a latency histogram, response status counts, and
+response bytes for each route, and a gauge of the requests in flight on each
+thread.  Each thread records into its own counters without taking a lock;
+the counters of all threads are only combined when the metrics are read, in
+the Prometheus text exposition format.
+
+Latency is measured until the handler returns, so for a streamed response it
+does not include the time spent sending the stream.
+
+The counters of threads that have exited are merged into a single set of
+retired counters when the metrics are read.
+"""
+import bisect
+import threading
+import time
+
+import cherrypy
+
+# The upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# The content type of the Prometheus text exposition format
+PROMETHEUS_MIME_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_local = threading.local()
+_registryLock = threading.Lock()
+_threadMetrics = []
+
+
+class _ThreadMetrics:
+    """
+    The counters of a single thread.  Only the owning thread modifies these;
+    readers take copies of the dictionaries, which is atomic.
+
+    :param thread: The owning thread, or None for combined counters.
+    :type thread: threading.Thread or None
+    """
+
+    __slots__ = ('thread', 'latency', 'statuses', 'bytes', 'inFlight')
+
+    def __init__(self, thread=None):
+        self.thread = thread
+        # (method, route) -> count per bucket, the +Inf bucket, then the sum
+        self.latency = {}
+        # (method, route, status) -> count
+        self.statuses = {}
+        # (method, route) -> bytes
+        self.bytes = {}
+        self.inFlight = 0
+
+
+def _metrics():
+    metrics = getattr(_local, 'metrics', None)
+    if metrics is None:
+        metrics = _local.metrics = _ThreadMetrics(threading.current_thread())
+        with _registryLock:
+            _threadMetrics.append(metrics)
+    return metrics
+
+
+def requestStarted():
+    """
+    Record that this thread has started handling a request.
+
+    :returns: the start time, to pass to ``requestHandled``.
+    """
+    _metrics().inFlight += 1
+    return time.perf_counter()
+
+
+def requestHandled(start, method, route, status):
+    """
+    Record the latency and status of a request when its handler returns.
+
+    :param start: The value returned by ``requestStarted``.
+    :type start: float
+    :param method: The HTTP method.
+    :type method: str
+    :param route: The route that handled the request, e.g. ``item/:id``.
+    :type route: str
+    :param status: The response status code.
+    :type status: int
+    """
+    elapsed = time.perf_counter() - start
+    metrics = _metrics()
+    key = (method, route)
+    histogram = metrics.latency.get(key)
+    if histogram is None:
+        histogram = metrics.latency[key] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+    histogram[bisect.bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+    histogram[-1] += elapsed
+    statusKey = (method, route, status)
+    metrics.statuses[statusKey] = metrics.statuses.get(statusKey, 0) + 1
+
+
+def requestFinished(method, route, nbytes):
+    """
+    Record that a request is complete, including sending its response.
+
+    :param method: The HTTP method.
+    :type method: str
+    :param route: The route that handled the request.
+    :type route: str
+    :param nbytes: The number of bytes in the response body.
+    :type nbytes: int
+    """
+    metrics = _metrics()
+    metrics.inFlight -= 1
+    if nbytes:
+        key = (method, route)
+        metrics.bytes[key] = metrics.bytes.get(key, 0) + nbytes
+
+
+class _CountedStream:
+    """
+    A streamed response that records its size, and counts the request as
+    finished when it is exhausted or closed, or when the request ends,
+    whichever happens first.
+    """
+
+    def __init__(self, stream, method, route):
+        self._stream = stream
+        self._iter = iter(stream)
+        self.method = method
+        self.route = route
+        self.nbytes = 0
+        self.finished = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            data = next(self._iter)
+        except BaseException:
+            self.finish()
+            raise
+        self.nbytes += len(data)
+        return data
+
+    def close(self):
+        try:
+            if hasattr(self._stream, 'close'):
+                self._stream.close()
+        finally:
+            self.finish()
+
+    def finish(self):
+        if not self.finished:
+            self.finished = True
+            requestFinished(self.method, self.route, self.nbytes)
+
+
+def countStream(stream, method, route):
+    """
+    Wrap a streamed response so that its size is recorded and the request is
+    counted as finished once the stream ends.  This must be called while
+    handling the request.
+
+    :param stream: The response body.
+    :type stream: iterable
+    :param method: The HTTP method.
+    :type method: str
+    :param route: The route that handled the request.
+    :type route: str
+    :returns: an iterator yielding the same data.
+    """
+    counted = _CountedStream(stream, method, route)
+    # The stream may be dropped without being read or closed, for instance
+    # if the client disconnects first, but the request always ends.
+    cherrypy.request.hooks.attach('on_end_request', counted.finish)
+    return counted
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{%s}' % ','.join('%s="%s"' % (k, _escape(v)) for k, v in labels.items())
+
+
+def _addCounters(total, metrics):
+    """
+    Add the counters of a thread to a combined set of counters.
+    """
+    for key, histogram in metrics.latency.copy().items():
+        combined = total.latency.setdefault(key, [0] * len(histogram))
+        for i, value in enumerate(list(histogram)):
+            combined[i] += value
+    for key, count in metrics.statuses.copy().items():
+        total.statuses[key] = total.statuses.get(key, 0) + count
+    for key, count in metrics.bytes.copy().items():
+        total.bytes[key] = total.bytes.get(key, 0) + count
+
+
+# The counters of threads that have exited
+_retired = _ThreadMetrics()
+
+
+def render():
+    """
+    Get the current metrics in the Prometheus text exposition format.
+
+    :returns: the metrics as a string.
+    """
+    total = _ThreadMetrics()
+    inFlight = {}
+    with _registryLock:
+        for metrics in [metrics for metrics in _threadMetrics if not metrics.thread.is_alive()]:
+            _threadMetrics.remove(metrics)
+            _addCounters(_retired, metrics)
+        threads = list(_threadMetrics)
+        _addCounters(total, _retired)
+    for metrics in threads:
+        _addCounters(total, metrics)
+        name = metrics.thread.name
+        inFlight[name] = inFlight.get(name, 0) + metrics.inFlight
+    latency, statuses, nbytes = total.latency, total.statuses, total.bytes
+
+    lines = [
+        '# HELP girder_http_request_duration_seconds Time until the route handler returned.',
+        '# TYPE girder_http_request_duration_seconds histogram',
+    ]
+    for (method, route), histogram in sorted(latency.items()):
+        count = 0
+        for bound, value in zip(LATENCY_BUCKETS + ('+Inf',), histogram):
+            count += value
+            lines.append('girder_http_request_duration_seconds_bucket%s %d' % (
+                _labels(method=method, route=route, le=bound), count))
+        labels = _labels(method=method, route=route)
+        lines.append('girder_http_request_duration_seconds_sum%s %r' % (labels, histogram[-1]))
+        lines.append('girder_http_request_duration_seconds_count%s %d' % (labels, count))
+
+    lines += [
+        '# HELP girder_http_responses_total Responses by route and status code.',
+        '# TYPE girder_http_responses_total counter',
+    ]
+    for (method, route, status), count in sorted(statuses.items()):
+        lines.append('girder_http_responses_total%s %d' % (
+            _labels(method=method, route=route, status=status), count))
+
+    lines += [
+        '# HELP girder_http_response_bytes_total Bytes sent in response bodies.',
+        '# TYPE girder_http_response_bytes_total counter',
+    ]
+    for (method, route), count in sorted(nbytes.items()):
+        lines.append('girder_http_response_bytes_total%s %d' % (
+            _labels(method=method, route=route), count))
+
+    lines += [
+        '# HELP girder_http_requests_in_flight Requests being handled by each thread.',
+        '# TYPE girder_http_requests_in_flight gauge',
+    ]
+    for thread, count in sorted(inFlight.items()):
+        lines.append('girder_http_requests_in_flight%s %d' % (_labels(thread=thread), count))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+Sampled profiling of REST requests.  While a profiling session is running, a
+fraction of requests, or every request whose path matches a pattern, is run
+under cProfile, and the call stats of all of them are aggregated.  At the same
+time, the stack of the profiled thread is sampled periodically, so that the
+session can also be downloaded as collapsed stacks for flame graph tools.
+
+Only one request is profiled at a time; requests that would be sampled while
+another is being profiled are not.  When no session is running, checking
+whether to profile a request costs a single comparison.
+"""
+import collections
+import cProfile
+import fnmatch
+import marshal
+import pstats
+import random
+import sys
+import threading
+import time
+
+from girder.exceptions import ValidationException
+
+# How often the stack of the profiled thread is sampled, in seconds
+STACK_SAMPLE_INTERVAL = 0.005
+# Distinct stacks beyond this many are counted together, to bound memory use
+MAX_STACKS = 10000
+# The longest a session may run, in seconds
+MAX_DURATION = 3600
+
+_OTHER_STACK = '[other]'
+
+# The current or last session, whose results can be read
+_session = None
+# The session while it is running, checked by every request
+_activeSession = None
+_lock = threading.Lock()
+# Held while a request is being profiled
+_profileLock = threading.Lock()
+
+
+class _ProfileSession:
+    """
+    The settings and results of a profiling session.
+    """
+
+    def __init__(self, rate, route, duration):
+        self.rate = rate
+        self.route = route
+        self.started = time.time()
+        self.until = time.monotonic() + duration
+        self.stopped = None
+        self.requests = 0
+        self.stats = None
+        self.stacks = collections.Counter()
+        self.profiledThread = None
+        self.done = threading.Event()
+
+    @property
+    def running(self):
+        return not self.done.is_set() and time.monotonic() < self.until
+
+    def wants(self, path):
+        if not self.running:
+            return False
+        if self.route is not None and fnmatch.fnmatchcase(path, self.route):
+            return True
+        return self.rate > 0 and random.random() < self.rate
+
+
+def _frameName(frame):
+    code = frame.f_code
+    return '%s:%s:%d' % (code.co_filename, code.co_name, code.co_firstlineno)
+
+
+def _sampleStacks(session):
+    """
+    Periodically record the stack of the thread being profiled, until the
+    session ends.
+    """
+    while session.running:
+        threadId = session.profiledThread
+        frame = sys._current_frames().get(threadId) if threadId is not None else None
+        if frame is not None:
+            names = []
+            while frame is not None:
+                names.append(_frameName(frame))
+                frame = frame.f_back
+            stack = ';'.join(reversed(names))
+            with _lock:
+                if stack not in session.stacks and len(session.stacks) >= MAX_STACKS:
+                    stack = _OTHER_STACK
+                session.stacks[stack] += 1
+        session.done.wait(STACK_SAMPLE_INTERVAL)
+
+
+def startProfiling(rate=0.0, route=None, duration=300):
+    """
+    Start a profiling session, discarding the results of any previous one.
+
+    :param rate: The fraction of requests to profile, between 0 and 1.
+    :type rate: float
+    :param route: A glob pattern, e.g. ``item/*/download``; requests whose
+        path below the API root matches it are always profiled.
+    :type route: str or None
+    :param duration: How long the session runs, in seconds.
+    :type duration: int
+    :returns: the status of the session.
+    """
+    global _session, _activeSession
+    if not 0 <= rate <= 1:
+        raise ValidationException('The sampling rate must be between 0 and 1.', 'rate')
+    if not 0 < duration <= MAX_DURATION:
+        raise ValidationException(
+            'The duration must be between 1 and %d seconds.' % MAX_DURATION, 'duration')
+    if not rate and not route:
+        raise ValidationException('Either a sampling rate or a route pattern is required.')
+    stopProfiling()
+    session = _ProfileSession(rate, route or None, duration)
+    with _lock:
+        _session = _activeSession = session
+    threading.Thread(
+        target=_sampleStacks, args=(session,), name='girder-profiler', daemon=True).start()
+    return getStatus()
+
+
+def stopProfiling():
+    """
+    Stop the current profiling session, if any.  Its results are kept until
+    another session is started.
+
+    :returns: the status of the session.
+    """
+    global _activeSession
+    session = _session
+    _activeSession = None
+    if session is not None and not session.done.is_set():
+        session.stopped = time.time()
+        session.done.set()
+    return getStatus()
+
+
+def getStatus():
+    """
+    Get the settings and progress of the current or last profiling session.
+
+    :returns: a dictionary, or None if no session was started.
+    """
+    session = _session
+    if session is None:
+        return None
+    with _lock:
+        return {
+            'running': session.running,
+            'rate': session.rate,
+            'route': session.route,
+            'started': session.started,
+            'stopped': session.stopped,
+            'requests': session.requests,
+            'stackSamples': sum(session.stacks.values()),
+        }
+
+
+def profileRequest(resource, path):
+    """
+    Start profiling the current request, if the current session samples it.
+    This must be called on the thread handling the request.
+
+    :param resource: The resource handling the request.
+    :type resource: girder.api.rest.Resource
+    :param path: The path of the request below the resource.
+    :type path: tuple[str]
+    :returns: a profiler to pass to ``finishRequest``, or None if the
+        request is not being profiled.
+    """
+    global _activeSession
+    session = _activeSession
+    if session is None:
+        return None
+    if not session.running:
+        # The session has run out of time; stop checking it
+        with _lock:
+            if _activeSession is session:
+                _activeSession = None
+        return None
+    path = '/'.join((getattr(resource, 'resourceName', resource.__class__.__name__),) + path)
+    if not session.wants(path):
+        return None
+    if not _profileLock.acquire(blocking=False):
+        return None
+    profiler = cProfile.Profile()
+    profiler.session = session
+    session.profiledThread = threading.get_ident()
+    profiler.enable()
+    return profiler
+
+
+def finishRequest(profiler):
+    """
+    Stop profiling a request and add its stats to its session.
+
+    :param profiler: The value returned by ``profileRequest``.
+    """
+    profiler.disable()
+    session = profiler.session
+    session.profiledThread = None
+    _profileLock.release()
+    with _lock:
+        if session.stats is None:
+            session.stats = pstats.Stats(profiler)
+        else:
+            session.stats.add(profiler)
+        session.requests += 1
+
+
+def getPstats():
+    """
+    Get the aggregated call stats of the current or last session, in the
+    format written by ``pstats.Stats.dump_stats``.
+
+    :returns: the stats as bytes, or None if no request has been profiled.
+    """
+    session = _session
+    if session is None or session.stats is None:
+        return None
+    with _lock:
+        return marshal.dumps(session.stats.stats)
+
+
+def getCollapsedStacks():
+    """
+    Get the stack samples of the current or last session in the collapsed
+    format read by flame graph tools: one line per distinct stack, with
+    frames separated by semicolons, followed by the number of samples.
+
+    :returns: the stacks as a string.
+    """
+    session = _session
+    if session is None:
+        return ''
+    with _lock:
+        stacks = session.stacks.most_common()
+    return ''.join('%s %d\n' % (stack, count) for stack, count in stacks)
@@ -2,9 +2,13 @@
 import boto3
 import botocore
 import cherrypy
+import collections
+import concurrent.futures
 import json
 import re
 import requests
+import requests.adapters
+import threading
 import uuid
 import urllib.parse
 
@@ -16,8 +20,53 @@ from girder.models.folder import Folder
 from girder.models.item import Item
 from .abstract_assetstore_adapter import AbstractAssetstoreAdapter
 
-BUF_LEN = 65536  # Buffer size for download stream
+BUF_LEN = 1024 * 1024  # Buffer size for download stream
 DEFAULT_REGION = 'us-east-1'
+# Maximum number of pooled HTTP connections kept open per assetstore
+SESSION_POOL_SIZE = 32
+# Size of the ranged parts fetched concurrently when streaming large objects
+DOWNLOAD_PART_SIZE = 8 * 1024 * 1024
+
+# Pooled HTTP sessions and part upload and download pools are shared by all
+# adapters for the same assetstore, since adapters are instantiated per request.
+_sessions = {}
+_partUploadPools = {}
+_partDownloadPools = {}
+_poolLock = threading.Lock()
+# Part uploads that have been handed to a worker pool but may not have been
+# collected yet, keyed by the S3 key of the upload.  Each is a tuple of the part
+# number, the offset of the part in the file, and the future of its upload.
+_pendingParts = {}
+
+
+class _PartPool:
+    """
+    A bounded pool of worker threads that transfer parts of objects to or from
+    S3.  At most twice as many parts as there are workers may be in flight;
+    submitting more blocks the caller until a part finishes, so the memory
+    used by buffered parts is bounded.
+
+    :param workers: the number of worker threads.
+    :type workers: int
+    :param name: the prefix for the names of the worker threads.
+    :type name: str
+    """
+
+    def __init__(self, workers, name):
+        self.workers = workers
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(workers * 2)
+
+    def submit(self, fn, *args, **kwargs):
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda f: self._slots.release())
+        return future
 
 
 class S3AssetstoreAdapter(AbstractAssetstoreAdapter):
@@ -29,6 +78,11 @@ class S3AssetstoreAdapter(AbstractAssetstoreAdapter):
 
     CHUNK_LEN = 1024 * 1024 * 32  # Chunk size for uploading
     HMAC_TTL = 120  # Number of seconds each signed message is valid
+    supportsRangeReads = True
+    uploadProgressFields = ('received', 's3')
+    # Each range of a multi-range download is a separate request to S3, so
+    # merge ranges that are close together.
+    rangeCoalesceGap = 1024 * 1024
 
     @staticmethod
     def _s3Client(connectParams):
@@ -56,6 +110,21 @@ class S3AssetstoreAdapter(AbstractAssetstoreAdapter):
         doc['prefix'] = doc['prefix'].strip('/')
         if not doc.get('bucket'):
             raise ValidationException('Bucket must not be empty.', 'bucket')
+        try:
+            doc['proxiedUploadConcurrency'] = int(doc.get('proxiedUploadConcurrency') or 0)
+        except ValueError:
+            doc['proxiedUploadConcurrency'] = -1
+        if doc['proxiedUploadConcurrency'] < 0:
+            raise ValidationException(
+                'Proxied upload concurrency must be an integer >= 0.', 'proxiedUploadConcurrency')
+        try:
+            doc['proxiedDownloadConcurrency'] = int(doc.get('proxiedDownloadConcurrency') or 0)
+        except ValueError:
+            doc['proxiedDownloadConcurrency'] = -1
+        if doc['proxiedDownloadConcurrency'] < 0:
+            raise ValidationException(
+                'Proxied download concurrency must be an integer >= 0.',
+                'proxiedDownloadConcurrency')
 
         # construct a set of connection parameters based on the keys and the service
         if 'service' not in doc:
@@ -97,6 +166,189 @@ class S3AssetstoreAdapter(AbstractAssetstoreAdapter):
                 self.assetstore.get('inferCredentials'))
             self.client = S3AssetstoreAdapter._s3Client(self.connectParams)
 
+    def _session(self):
+        """
+        Get the pooled HTTP session for this assetstore.  Connections to S3 are
+        reused across requests rather than being opened per chunk.
+
+        :returns: a requests session.
+        """
+        key = str(self.assetstore.get('_id'))
+        with _poolLock:
+            if key not in _sessions:
+                session = requests.Session()
+                adapter = requests.adapters.HTTPAdapter(
+                    pool_connections=SESSION_POOL_SIZE, pool_maxsize=SESSION_POOL_SIZE)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _sessions[key] = session
+            return _sessions[key]
+
+    def _partUploadPool(self):
+        """
+        Get the worker pool used to upload parts of proxied multipart uploads
+        concurrently.  This is only enabled if the assetstore has a non-zero
+        ``proxiedUploadConcurrency``.
+
+        :returns: a _PartPool or None to upload parts synchronously.
+        """
+        workers = self.assetstore.get('proxiedUploadConcurrency') or 0
+        if workers <= 0:
+            return None
+        key = str(self.assetstore.get('_id'))
+        with _poolLock:
+            pool = _partUploadPools.get(key)
+            if pool is None or pool.workers != workers:
+                pool = _partUploadPools[key] = _PartPool(workers, 's3-part-upload')
+            return pool
+
+    def _partDownloadPool(self):
+        """
+        Get the worker pool used to fetch ranged parts of large objects
+        concurrently when streaming them through the server.  This is only
+        enabled if the assetstore has a non-zero ``proxiedDownloadConcurrency``.
+
+        :returns: a _PartPool or None to stream objects with a single request.
+        """
+        workers = self.assetstore.get('proxiedDownloadConcurrency') or 0
+        if workers <= 0:
+            return None
+        key = str(self.assetstore.get('_id'))
+        with _poolLock:
+            pool = _partDownloadPools.get(key)
+            if pool is None or pool.workers != workers:
+                pool = _partDownloadPools[key] = _PartPool(workers, 's3-part-download')
+            return pool
+
+    def _putPart(self, upload, url, data, size):
+        """
+        Send one part of a proxied multipart upload to S3.
+
+        :param upload: the upload document.
+        :param url: the presigned URL for the part.
+        :param data: a file-like object or bytes with the part's data.
+        :param size: the length of the part.
+        :returns: the ETag of the uploaded part.
+        """
+        resp = self._session().put(url, data=data, headers={'Content-Length': str(size)})
+        if resp.status_code not in (200, 201):
+            logger.error('S3 multipart upload failure %d (uploadId=%s):\n%s' % (
+                resp.status_code, upload.get('_id'), resp.text))
+            raise GirderException('Upload failed (bad gateway)')
+        return resp.headers.get('ETag')
+
+    def _collectParts(self, upload, wait=True):
+        """
+        Gather the parts of a proxied multipart upload that were handed to the
+        worker pool by this process, adding them to the upload's list of parts.
+
+        :param upload: the upload document.
+        :param wait: if False, only collect parts that have already finished.
+        :raises GirderException: if any of the parts failed to upload.  The
+            upload is rolled back to the start of the first failed part, so
+            the client can resume from there.
+        """
+        key = upload['s3']['key']
+        pending = _pendingParts.pop(key, None)
+        if not pending:
+            return
+        remaining = []
+        failed = None
+        for partNumber, offset, future in pending:
+            if not wait and not future.done():
+                remaining.append((partNumber, offset, future))
+                continue
+            try:
+                etag = future.result()
+            except Exception:
+                if failed is None or partNumber < failed[0]:
+                    failed = (partNumber, offset)
+                continue
+            upload['s3'].setdefault('parts', []).append({
+                'ETag': etag,
+                'PartNumber': partNumber
+            })
+        if failed is None:
+            if remaining:
+                _pendingParts[key] = remaining
+            return
+        for partNumber, offset, future in sorted(remaining, key=lambda entry: entry[0]):
+            if partNumber > failed[0]:
+                # This part will be sent again after the failed one
+                future.cancel()
+                continue
+            try:
+                upload['s3'].setdefault('parts', []).append({
+                    'ETag': future.result(),
+                    'PartNumber': partNumber
+                })
+            except Exception:
+                failed = (partNumber, offset)
+        self._rollBackUpload(upload, *failed)
+        raise GirderException('Upload failed (bad gateway)')
+
+    def _rollBackUpload(self, upload, partNumber, offset):
+        """
+        Discard the progress of a proxied multipart upload from a part that
+        failed or is missing onward, so that the client resumes uploading from
+        the start of that part.  The rolled back progress is saved, since the
+        request that discovers the failure does not save the upload.
+
+        :param upload: the upload document.
+        :param partNumber: the first part to discard.
+        :type partNumber: int
+        :param offset: the offset of that part in the file.
+        :type offset: int
+        """
+        from girder.models.upload import Upload
+
+        upload['received'] = offset
+        upload['s3']['partNumber'] = partNumber - 1
+        upload['s3']['parts'] = [
+            part for part in upload['s3'].get('parts', []) if part['PartNumber'] < partNumber]
+        if '_id' in upload:
+            Upload().update({'_id': upload['_id']}, {'$set': {
+                'received': upload['received'],
+                's3': upload['s3']
+            }})
+
+    def _listParts(self, upload):
+        """
+        Ask S3 which parts of a multipart upload it has.
+
+        :param upload: the upload document.
+        :returns: a list of parts as returned by S3, in order.
+        """
+        parts = []
+        kwargs = {}
+        while True:
+            resp = self.client.list_parts(
+                Bucket=self.assetstore['bucket'], Key=upload['s3']['key'],
+                UploadId=upload['s3']['uploadId'], **kwargs)
+            parts.extend(resp.get('Parts', []))
+            if not resp.get('IsTruncated'):
+                return parts
+            kwargs['PartNumberMarker'] = resp['NextPartNumberMarker']
+
+    def _contiguousParts(self, upload, parts):
+        """
+        Get the parts of a multipart upload from the first, in order, up to
+        the upload's last part or the first part that is missing.
+
+        :param upload: the upload document.
+        :param parts: the known parts, in any order.
+        :type parts: list[dict]
+        :returns: a list of parts.
+        """
+        byNumber = {part['PartNumber']: part for part in parts}
+        result = []
+        for partNumber in range(1, upload['s3']['partNumber'] + 1):
+            part = byNumber.get(partNumber)
+            if part is None or not part.get('ETag'):
+                break
+            result.append(part)
+        return result
+
     def _getRequestHeaders(self, upload):
         headers = {
             'Content-Disposition': setContentDisposition(upload['name'], setHeader=False),
@@ -256,9 +508,6 @@ class S3AssetstoreAdapter(AbstractAssetstoreAdapter):
 
             upload['s3']['partNumber'] += 1
             size = chunk.getSize()
-            headers = {
-                'Content-Length': str(size)
-            }
 
             # We can't just call upload_part directly because they require a
             # seekable file object, and ours isn't.
@@ -270,11 +519,24 @@ class S3AssetstoreAdapter(AbstractAssetstoreAdapter):
                 'PartNumber': upload['s3']['partNumber']
             })
 
-            resp = requests.request(method='PUT', url=url, data=chunk, headers=headers)
-            if resp.status_code not in (200, 201):
-                logger.error('S3 multipart upload failure %d (uploadId=%s):\n%s' % (
-                    resp.status_code, upload['_id'], resp.text))
-                raise GirderException('Upload failed (bad gateway)')
+            pool = self._partUploadPool()
+            if pool is None:
+                upload['s3'].setdefault('parts', []).append({
+                    'ETag': self._putPart(upload, url, chunk, size),
+                    'PartNumber': upload['s3']['partNumber']
+                })
+            else:
+                # Report a failure of an earlier part as soon as we know of it
+                self._collectParts(upload, wait=False)
+                # The request body is gone once this request finishes, so the
+                # part must be buffered before handing it to a worker.
+                data = chunk.read()
+                if len(data) != size:
+                    raise ValidationException('Expected chunk size %d, but got %d.' % (
+                        size, len(data)))
+                future = pool.submit(self._putPart, upload, url, data, size)
+                _pendingParts.setdefault(upload['s3']['key'], []).append(
+                    (upload['s3']['partNumber'], upload['received'], future))
 
             upload['received'] += size
         else:
@@ -283,7 +545,7 @@ class S3AssetstoreAdapter(AbstractAssetstoreAdapter):
                 raise ValidationException('Uploads of this length must be sent in a single chunk.')
 
             reqInfo = upload['s3']['request']
-            resp = requests.request(
+            resp = self._session().request(
                 method=reqInfo['method'], url=reqInfo['url'], data=chunk,
                 headers=dict(reqInfo['headers'], **{'Content-Length': str(size)}))
             if resp.status_code not in (200, 201):
@@ -340,16 +602,27 @@ class S3AssetstoreAdapter(AbstractAssetstoreAdapter):
         if upload['s3']['chunked']:
             if upload['received'] > 0:
                 # We proxied the data to S3
-                parts = self.client.list_parts(
-                    Bucket=self.assetstore['bucket'], Key=file['s3Key'],
-                    UploadId=upload['s3']['uploadId'])
-                parts = [{
-                    'ETag': part['ETag'],
-                    'PartNumber': part['PartNumber']
-                } for part in parts.get('Parts', [])]
+                self._collectParts(upload)
+                parts = self._contiguousParts(upload, upload['s3'].get('parts', []))
+                if len(parts) != upload['s3']['partNumber']:
+                    # Some parts were sent by another process or before we
+                    # recorded ETags, so ask S3 which parts it has.
+                    parts = self._contiguousParts(upload, self._listParts(upload))
+                    if len(parts) != upload['s3']['partNumber']:
+                        # Never complete an object with a gap in it; have the
+                        # client resend from the first missing part instead.
+                        missing = len(parts) + 1
+                        self._rollBackUpload(
+                            upload, missing, sum(part['Size'] for part in parts))
+                        raise GirderException(
+                            'Upload failed (part %d is missing); resume from offset %d.' % (
+                                missing, upload['received']))
                 self.client.complete_multipart_upload(
                     Bucket=self.assetstore['bucket'], Key=file['s3Key'],
-                    UploadId=upload['s3']['uploadId'], MultipartUpload={'Parts': parts})
+                    UploadId=upload['s3']['uploadId'], MultipartUpload={'Parts': [{
+                        'ETag': part['ETag'],
+                        'PartNumber': part['PartNumber']
+                    } for part in parts]})
             else:
                 url = self._generatePresignedUrl(
                     ClientMethod='complete_multipart_upload', Params={
@@ -392,19 +665,58 @@ class S3AssetstoreAdapter(AbstractAssetstoreAdapter):
 
         if headers:
             raise cherrypy.HTTPRedirect(url)
-        else:
-            headers = {}
-            if offset or endByte is not None:
-                if endByte is None or endByte > file['size']:
-                    endByte = file['size']
-                headers = {'Range': 'bytes=%d-%d' % (offset, endByte - 1)}
 
-            def stream():
-                pipe = requests.get(url, stream=True, headers=headers)
-                for chunk in pipe.iter_content(chunk_size=BUF_LEN):
-                    if chunk:
-                        yield chunk
-            return stream
+        if endByte is None or endByte > file['size']:
+            endByte = file['size']
+        pool = self._partDownloadPool()
+        if pool is None or endByte - offset <= DOWNLOAD_PART_SIZE:
+            return lambda: self._getRange(url, offset, endByte)
+
+        def stream():
+            parts = iter(range(offset, endByte, DOWNLOAD_PART_SIZE))
+            pending = collections.deque()
+
+            def submitNext():
+                start = next(parts, None)
+                if start is not None:
+                    end = min(start + DOWNLOAD_PART_SIZE, endByte)
+                    pending.append(pool.submit(
+                        lambda: b''.join(self._getRange(url, start, end))))
+
+            # Keep as many parts in flight as there are workers, and yield
+            # them in order as they complete.
+            try:
+                for _ in range(pool.workers):
+                    submitNext()
+                while pending:
+                    data = pending.popleft().result()
+                    submitNext()
+                    yield data
+            finally:
+                for future in pending:
+                    future.cancel()
+        return stream
+
+    def iterRanges(self, file, ranges, extraParameters=None):
+        """
+        Issue a ranged GET for each range using a single presigned URL and the
+        assetstore's pooled connections.
+        """
+        url = self._generatePresignedUrl(ClientMethod='get_object', Params={
+            'Bucket': self.assetstore['bucket'],
+            'Key': file['s3Key']
+        })
+        for start, end in ranges:
+            yield self._getRange(url, start, end)
+
+    def _getRange(self, url, start, end):
+        pipe = self._session().get(
+            url, stream=True, headers={'Range': 'bytes=%d-%d' % (start, end - 1)})
+        with pipe:
+            pipe.raise_for_status()
+            for chunk in pipe.iter_content(chunk_size=BUF_LEN):
+                if chunk:
+                    yield chunk
 
     def importData(self, parent, parentType, params, progress, user, **kwargs):
         importPath = params.get('importPath', '').strip().lstrip('/')
@@ -510,6 +822,8 @@ class S3AssetstoreAdapter(AbstractAssetstoreAdapter):
             return
         bucket = self.assetstore['bucket']
         key = upload['s3']['key']
+        for partNumber, offset, future in _pendingParts.pop(key, ()):
+            future.cancel()
         self.client.delete_object(Bucket=bucket, Key=key)
 
         # check if this is an abandoned multipart upload
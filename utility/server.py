@@ -9,7 +9,7 @@ from girder import constants, logprint, __version__, logStdoutStderr, _setupCach
 from girder.models.setting import Setting
 from girder import plugin
 from girder.settings import SettingKey
-from girder.utility import config
+from girder.utility import auditlog, config
 from girder.constants import ServerMode
 from . import webroot
 
@@ -82,6 +82,9 @@ def configureServer(mode=None, plugins=None, curConfig=None):
     girder.events.setupDaemon()
     cherrypy.engine.subscribe('start', girder.events.daemon.start)
     cherrypy.engine.subscribe('stop', girder.events.daemon.stop)
+    # Plugins may attach audit log handlers, so start writing after they load
+    cherrypy.engine.subscribe('start', auditlog.start)
+    cherrypy.engine.subscribe('stop', auditlog.stop)
 
     routeTable = loadRouteTable()
     info = {
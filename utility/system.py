@@ -7,8 +7,9 @@ import threading
 import time
 
 import girder
-from girder import logger
+from girder import events, logger
 from girder.models import getDbConnection
+from girder.utility import auditlog, bandwidth
 
 
 def _objectToDict(obj):
@@ -130,6 +131,9 @@ def getStatus(mode='basic', user=None):
             True for threadId in cherrypy.tools.status.seenThreads
             if 'end' not in cherrypy.tools.status.seenThreads[threadId]])
         status['cherrypyThreadPoolSize'] = cherrypy.server.thread_pool
+        status['downloadBandwidth'] = bandwidth.getStats()
+        status['auditLog'] = auditlog.getStats()
+        status['eventDaemon'] = events.daemon.getStats()
 
     if mode == 'slow' and isAdmin:
         _computeSlowStatus(process, status, db)
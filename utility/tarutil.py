@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+This module writes tar archives as streams, using generators for both the
+input and the output.  Unlike a zip archive, a tar archive has no central
+directory, so nothing needs to be kept in memory for the entries that have
+already been written.
+
+Example of creating and consuming a streaming tar:
+
+    tar = tarutil.TarGenerator('TopLevelFolder')
+
+    for data in tar.addFile(lambda: [b'hello world'], 'hello.txt', 11):
+        yield data
+
+    yield tar.footer()
+"""
+
+import calendar
+import collections
+import concurrent.futures
+import os
+import tarfile
+import time
+import zlib
+
+__all__ = ('TarGenerator', 'fileEntries', 'FORMATS')
+
+BLOCK_SIZE = tarfile.BLOCKSIZE
+
+# Content type and file extension of each supported archive format
+FORMATS = {
+    'tar': ('application/x-tar', '.tar'),
+    'tgz': ('application/gzip', '.tar.gz'),
+}
+
+# The number of buffers that may be waiting to be compressed or sent when
+# compressing on a worker thread
+COMPRESS_QUEUE_SIZE = 16
+
+
+def _mtime(dt):
+    """
+    Convert a naive UTC datetime from a document into a POSIX timestamp.
+    """
+    return calendar.timegm(dt.utctimetuple())
+
+
+def fileEntries(fileList):
+    """
+    Convert the results of a model's ``fileList`` method called with
+    ``data=False`` into entries for ``TarGenerator.addFiles``.  The size of
+    each entry must be known before its data, so generated entries are read
+    in advance.
+
+    :param fileList: an iterable of (path, file document or stream function).
+    :returns: a generator of (path, stream function, size, modification time).
+    """
+    from girder.models.file import File
+
+    for path, file in fileList:
+        if callable(file):
+            data = b''.join(
+                buf.encode('utf8') if isinstance(buf, str) else buf for buf in file())
+            yield path, lambda data=data: [data], len(data), time.time()
+        elif not file.get('assetstoreId'):
+            data = file.get('linkUrl', '').encode('utf8')
+            yield path, lambda data=data: [data], len(data), _mtime(file['created'])
+        else:
+            yield (path, File().download(file, headers=False), file['size'],
+                   _mtime(File().getModifiedTime(file)))
+
+
+class TarGenerator:
+    """
+    This class can be used to create a streaming tar file that consumes from
+    generators and writes to another.  Long paths and large files are written
+    with PAX extended headers.
+
+    :param rootPath: The root path for all files within this archive.
+    :type rootPath: str
+    """
+
+    def __init__(self, rootPath=''):
+        self.rootPath = rootPath
+
+    def addFile(self, generator, path, size, mtime=None):
+        """
+        Generates data to add a file at the given path in the archive.
+
+        :param generator: Generator function that will yield the file contents.
+        :type generator: function
+        :param path: The path within the archive for this entry.
+        :type path: str
+        :param size: The size of the file in bytes.  If the generator yields
+            less data, the entry is padded with zeros; more is truncated.
+        :type size: int
+        :param mtime: The modification time of the file as a POSIX timestamp.
+        :type mtime: float or None
+        """
+        info = tarfile.TarInfo(os.path.join(self.rootPath, path))
+        info.size = size
+        info.mtime = int(mtime if mtime is not None else time.time())
+        info.mode = 0o644
+        yield info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+
+        remaining = size
+        for buf in generator():
+            if isinstance(buf, str):
+                buf = buf.encode('utf8')
+            if len(buf) > remaining:
+                buf = buf[:remaining]
+            if buf:
+                remaining -= len(buf)
+                yield buf
+            if not remaining:
+                break
+        while remaining:
+            pad = min(remaining, 65536)
+            remaining -= pad
+            yield b'\0' * pad
+        if size % BLOCK_SIZE:
+            yield b'\0' * (BLOCK_SIZE - size % BLOCK_SIZE)
+
+    def addFiles(self, entries):
+        """
+        Generates data to add many files to the archive.
+
+        :param entries: an iterable of (path, generator function, size,
+            modification time).
+        """
+        for path, generator, size, mtime in entries:
+            yield from self.addFile(generator, path, size, mtime)
+
+    def footer(self):
+        """
+        Once all files have been added, you must call this to get the end of
+        the archive.
+        """
+        return b'\0' * (BLOCK_SIZE * 2)
+
+    def stream(self, entries, compress=False):
+        """
+        Return a generator function that streams a complete archive of the
+        given entries.  If compressing, the archive is written on the calling
+        thread and gzipped on a worker thread, so the compression overlaps
+        with reading and sending the data.
+
+        :param entries: an iterable of (path, generator function, size,
+            modification time).
+        :param compress: Whether to gzip the archive.
+        :type compress: bool
+        """
+        def archive():
+            yield from self.addFiles(entries)
+            yield self.footer()
+
+        if not compress:
+            return archive
+        return lambda: _gzipInThread(archive())
+
+
+def _gzipInThread(data):
+    """
+    Gzip a stream of bytes on a worker thread, yielding the compressed data.
+    The input is read on the calling thread, so the files are opened with the
+    request's context; only the compression is done by the worker.  The input
+    stream is closed if the returned generator is closed early.
+    """
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, 31)
+    pending = collections.deque()
+    # A single worker compresses the buffers in the order they are submitted
+    executor = concurrent.futures.ThreadPoolExecutor(
+        max_workers=1, thread_name_prefix='tar-gzip')
+    try:
+        for buf in data:
+            pending.append(executor.submit(compressor.compress, buf))
+            while len(pending) > COMPRESS_QUEUE_SIZE or (pending and pending[0].done()):
+                buf = pending.popleft().result()
+                if buf:
+                    yield buf
+        pending.append(executor.submit(compressor.flush))
+        while pending:
+            buf = pending.popleft().result()
+            if buf:
+                yield buf
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+        # Release the files the input was reading from, since the input may be
+        # left part way through.
+        if hasattr(data, 'close'):
+            data.close()
@@ -12,12 +12,20 @@ Example of creating and consuming a streaming zip:
         yield data
 
     yield zip.footer()
+
+Many files can be added with ``addFiles``, which reads, checksums, and
+compresses several entries concurrently while still writing them in order.
 """
 
 import binascii
+import collections
+import concurrent.futures
+import hashlib
 import os
+import queue
 import struct
 import sys
+import threading
 import time
 
 try:
@@ -25,7 +33,8 @@ try:
 except ImportError:
     zlib = None
 
-__all__ = ('STORE', 'DEFLATE', 'ZipGenerator')
+__all__ = ('STORE', 'DEFLATE', 'ZipGenerator', 'ZipPlan', 'ZipPlanEntry', 'fileEntries',
+           'seekableEntries')
 
 
 Z64_LIMIT = (1 << 31) - 1
@@ -33,6 +42,203 @@ Z_FILECOUNT_LIMIT = 1 << 16
 STORE = 0
 DEFLATE = 8
 
+# The number of entries that addFiles reads and compresses concurrently
+PIPELINE_WORKERS = 4
+# The number of buffers each concurrently read entry may hold before its
+# worker waits for them to be written
+PIPELINE_QUEUE_SIZE = 16
+
+# MIME types whose content is already compressed, so deflating it again only
+# costs CPU time.  Entries of these types are always stored.
+COMPRESSED_MIME_TYPES = {
+    'application/gzip',
+    'application/vnd.rar',
+    'application/x-7z-compressed',
+    'application/x-bzip2',
+    'application/x-gzip',
+    'application/x-xz',
+    'application/zip',
+    'application/zstd',
+    'image/avif',
+    'image/gif',
+    'image/heic',
+    'image/jp2',
+    'image/jpeg',
+    'image/png',
+    'image/webp',
+}
+COMPRESSED_MIME_PREFIXES = ('audio/', 'video/')
+
+# Timestamp used for generated archive entries, which have no modification
+# time of their own.  A fixed value keeps seekable archives reproducible.
+GENERATED_ENTRY_TIMESTAMP = (1980, 1, 1, 0, 0, 0)
+
+
+def _dosDateTime(timestamp):
+    """
+    Pack a timestamp into the DOS date and time of an archive entry.  These
+    can only hold the years 1980 to 2107, so other times are clamped.
+
+    :param timestamp: (year, month, day, hour, minute, second)
+    :returns: the DOS date and time.
+    """
+    if timestamp[0] < 1980:
+        timestamp = (1980, 1, 1, 0, 0, 0)
+    elif timestamp[0] > 2107:
+        timestamp = (2107, 12, 31, 23, 59, 58)
+    dosdate = (timestamp[0] - 1980) << 9 | timestamp[1] << 5 | timestamp[2]
+    dostime = timestamp[3] << 11 | timestamp[4] << 5 | (timestamp[5] // 2)
+    return dosdate, dostime
+
+
+def _crcSource(file):
+    """
+    Identify the contents of a file that a cached CRC-32 applies to, by the
+    file's size and modification time.
+
+    :param file: The file document.
+    :type file: dict
+    :returns: a string to store with the CRC-32.
+    """
+    from girder.models.file import File
+
+    return '%d %s' % (file['size'], File().getModifiedTime(file).isoformat())
+
+
+def isCompressedMimeType(mimeType):
+    """
+    Check if content of a MIME type is already compressed.
+
+    :param mimeType: the MIME type, or None if unknown.
+    :type mimeType: str or None
+    :rtype: bool
+    """
+    if not mimeType:
+        return False
+    mimeType = mimeType.split(';')[0].strip().lower()
+    return mimeType in COMPRESSED_MIME_TYPES or mimeType.startswith(COMPRESSED_MIME_PREFIXES)
+
+
+def fileEntries(fileList):
+    """
+    Convert the results of a model's ``fileList`` method called with
+    ``data=False`` into entries for ``ZipGenerator.addFiles``.  Files are
+    opened for download as their entries are reached.
+
+    :param fileList: an iterable of (path, file document or stream function).
+    :returns: a generator of (path, stream function, MIME type).
+    """
+    from girder.models.file import File
+
+    for path, file in fileList:
+        if callable(file):
+            yield path, file, None
+        else:
+            yield path, File().download(file, headers=False), file.get('mimeType')
+
+
+def seekableEntries(fileList):
+    """
+    Convert the results of a model's ``fileList`` method called with
+    ``data=False`` into entries for a ``ZipPlan``.  CRCs are taken from, and
+    once computed saved to, the ``crc32`` field of file documents.  A cached
+    CRC is only used if the file's size and modification time, recorded in
+    ``crc32Source``, haven't changed since it was computed.
+
+    :param fileList: an iterable of (path, file document or stream function).
+    :returns: a generator of ZipPlanEntry.
+    """
+    from girder.models.file import File
+
+    def generatedEntry(path, data, key):
+        data = b''.join(buf.encode('utf8') if isinstance(buf, str) else buf for buf in data)
+        return ZipPlanEntry(
+            path, len(data), GENERATED_ENTRY_TIMESTAMP, lambda start, end: [data[start:end]],
+            crc=binascii.crc32(data) & 0xFFFFFFFF, key=key)
+
+    for path, file in fileList:
+        if callable(file):
+            yield generatedEntry(path, file(), path)
+        elif not file.get('assetstoreId'):
+            yield generatedEntry(path, [file.get('linkUrl', '')], str(file['_id']))
+        else:
+            yield ZipPlanEntry(
+                path, file['size'], File().getModifiedTime(file).timetuple()[:6],
+                lambda start, end, file=file: File().download(
+                    file, offset=start, endByte=end, headers=False)(),
+                crc=file.get('crc32') if file.get('crc32Source') == _crcSource(file) else None,
+                saveCrc=lambda crc, file=file: File().update(
+                    {'_id': file['_id']},
+                    {'$set': {'crc32': crc, 'crc32Source': _crcSource(file)}}, multi=False),
+                key='%s %s' % (file['_id'], File().getETag(file)))
+
+
+class _EntryReader:
+    """
+    Reads, checksums, and optionally compresses the data of one archive entry
+    on a worker thread, handing the output buffers to the writing thread
+    through a bounded queue.
+    """
+
+    _END = object()
+
+    def __init__(self, generator, compressType, useCRC, cancelled):
+        self.generator = generator
+        self.compressType = compressType
+        self.useCRC = useCRC
+        self.cancelled = cancelled
+        self.queue = queue.Queue(PIPELINE_QUEUE_SIZE)
+        self.crc = self.compressSize = self.fileSize = 0
+        self.error = None
+
+    def _put(self, item):
+        while not self.cancelled.is_set():
+            try:
+                self.queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run(self):
+        try:
+            if self.compressType == DEFLATE:
+                compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+            else:
+                compressor = None
+            for buf in self.generator():
+                if not buf:
+                    break
+                if isinstance(buf, str):
+                    buf = buf.encode('utf8')
+                self.fileSize += len(buf)
+                if self.useCRC:
+                    self.crc = binascii.crc32(buf, self.crc) & 0xFFFFFFFF
+                if compressor:
+                    buf = compressor.compress(buf)
+                    self.compressSize += len(buf)
+                if buf and not self._put(buf):
+                    return
+            if compressor:
+                buf = compressor.flush()
+                self.compressSize += len(buf)
+                if not self._put(buf):
+                    return
+            else:
+                self.compressSize = self.fileSize
+        except Exception as exc:
+            self.error = exc
+        self._put(self._END)
+
+    def __iter__(self):
+        while True:
+            buf = self.queue.get()
+            if buf is self._END:
+                break
+            yield buf
+        if self.error is not None:
+            raise self.error
+
 
 class ZipInfo:
 
@@ -84,9 +290,7 @@ class ZipInfo:
         """
         Return the per-file header as a string.
         """
-        dt = self.timestamp
-        dosdate = (dt[0] - 1980) << 9 | dt[1] << 5 | dt[2]
-        dostime = dt[3] << 11 | dt[4] << 5 | (dt[5] // 2)
+        dosdate, dostime = _dosDateTime(self.timestamp)
 
         header = struct.pack(
             b'<4s2B4HLLL2H', b'PK\003\004', self.extractVersion, 0, 0x8,
@@ -125,19 +329,75 @@ class ZipGenerator:
         self.offset += len(data)
         return data
 
-    def addFile(self, generator, path):
+    def _entryHeader(self, path, mimeType=None):
+        fullpath = os.path.join(self.rootPath, path)
+        header = ZipInfo(fullpath, time.localtime()[0:6])
+        header.externalAttr = (0o100644 & 0xFFFF) << 16
+        header.compressType = self.compression
+        if isCompressedMimeType(mimeType):
+            header.compressType = STORE
+        header.headerOffset = self.offset
+        return header
+
+    def addFiles(self, entries, workers=PIPELINE_WORKERS):
+        """
+        Generates data to add many files to the archive.  Up to ``workers``
+        entries are read, checksummed, and compressed concurrently on a thread
+        pool, while the entries are still written in the order given.  Entries
+        of already compressed MIME types are stored rather than deflated.
+
+        :param entries: an iterable of (path, generator function, MIME type),
+            where the MIME type may be None.
+        :param workers: the number of entries to process concurrently.
+        :type workers: int
+        """
+        entries = iter(entries)
+        cancelled = threading.Event()
+        pending = collections.deque()
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='zip-entry')
+
+        def submitNext():
+            entry = next(entries, None)
+            if entry is not None:
+                path, generator, mimeType = entry
+                header = self._entryHeader(path, mimeType)
+                reader = _EntryReader(generator, header.compressType, self.useCRC, cancelled)
+                executor.submit(reader.run)
+                pending.append((header, reader))
+
+        try:
+            for _ in range(workers):
+                submitNext()
+            while pending:
+                header, reader = pending.popleft()
+                header.headerOffset = self.offset
+                header.crc = header.compressSize = header.fileSize = 0
+                yield self._advanceOffset(header.fileHeader())
+                for buf in reader:
+                    yield self._advanceOffset(buf)
+                header.crc = reader.crc
+                header.compressSize = reader.compressSize
+                header.fileSize = reader.fileSize
+                yield self._advanceOffset(header.dataDescriptor())
+                self.files.append(header)
+                submitNext()
+        finally:
+            cancelled.set()
+            executor.shutdown(wait=False)
+
+    def addFile(self, generator, path, mimeType=None):
         """
         Generates data to add a file at the given path in the archive.
         :param generator: Generator function that will yield the file contents.
         :type generator: function
         :param path: The path within the archive for this entry.
         :type path: str
+        :param mimeType: The MIME type of the file, if known.  Files of already
+            compressed types are stored rather than deflated.
+        :type mimeType: str or None
         """
-        fullpath = os.path.join(self.rootPath, path)
-        header = ZipInfo(fullpath, time.localtime()[0:6])
-        header.externalAttr = (0o100644 & 0xFFFF) << 16
-        header.compressType = self.compression
-        header.headerOffset = self.offset
+        header = self._entryHeader(path, mimeType)
 
         header.crc = crc = 0
         header.compressSize = compressSize = 0
@@ -179,69 +439,224 @@ class ZipGenerator:
         Once all zip files have been added with addFile, you must call this
         to get the footer of the archive.
         """
-        data = []
-        count = 0
-        pos1 = self.offset
-        for header in self.files:
-            count += 1
-            dt = header.timestamp
-            dosdate = (dt[0] - 1980) << 9 | dt[1] << 5 | dt[2]
-            dostime = dt[3] << 11 | dt[4] << 5 | (dt[5] // 2)
-            extra = []
-            if header.fileSize > Z64_LIMIT or header.compressSize > Z64_LIMIT:
-                extra.append(header.fileSize)
-                extra.append(header.compressSize)
-                fileSize = compressSize = 0xffffffff
-            else:
-                fileSize = header.fileSize
-                compressSize = header.compressSize
+        return self._advanceOffset(_centralDirectory(self.files, self.offset))
 
-            if header.headerOffset > Z64_LIMIT:
-                extra.append(header.headerOffset)
-                headerOffset = 0xffffffff
-            else:
-                headerOffset = header.headerOffset
 
-            if extra:
-                extraData = struct.pack(
-                    b'<hh' + b'q' * len(extra), 1, 8 * len(extra), *extra)
-                extractVersion = max(45, header.extractVersion)
-                createVersion = max(45, header.createVersion)
+def _centralDirectory(files, offset):
+    """
+    Build the central directory and end records of an archive.
+
+    :param files: the ZipInfo headers of the archive entries.
+    :param offset: the offset in the archive at which the directory starts.
+    :returns: the bytes of the end of the archive.
+    """
+    data = []
+    count = 0
+    pos1 = offset
+    for header in files:
+        count += 1
+        dosdate, dostime = _dosDateTime(header.timestamp)
+        extra = []
+        if header.fileSize > Z64_LIMIT or header.compressSize > Z64_LIMIT:
+            extra.append(header.fileSize)
+            extra.append(header.compressSize)
+            fileSize = compressSize = 0xffffffff
+        else:
+            fileSize = header.fileSize
+            compressSize = header.compressSize
+
+        if header.headerOffset > Z64_LIMIT:
+            extra.append(header.headerOffset)
+            headerOffset = 0xffffffff
+        else:
+            headerOffset = header.headerOffset
+
+        if extra:
+            extraData = struct.pack(
+                b'<hh' + b'q' * len(extra), 1, 8 * len(extra), *extra)
+            extractVersion = max(45, header.extractVersion)
+            createVersion = max(45, header.createVersion)
+        else:
+            extraData = b''
+            extractVersion = header.extractVersion
+            createVersion = header.createVersion
+
+        centdir = struct.pack(
+            b'<4s4B4HLLL5HLL', b'PK\001\002', createVersion,
+            header.createSystem, extractVersion, 0, 0x8,
+            header.compressType, dostime, dosdate, header.crc, compressSize,
+            fileSize, len(header.filename), len(extraData), 0, 0, 0,
+            header.externalAttr, headerOffset)
+
+        data.append(centdir)
+        data.append(header.filename)
+        data.append(extraData)
+        offset += len(centdir) + len(header.filename) + len(extraData)
+
+    pos2 = offset
+    offsetVal = pos1
+    size = pos2 - pos1
+
+    if pos1 > Z64_LIMIT or size > Z64_LIMIT or count >= Z_FILECOUNT_LIMIT:
+        zip64endrec = struct.pack(
+            b'<4sqhhLLqqqq', b'PK\x06\x06', 44, 45, 45, 0, 0, count, count,
+            size, pos1)
+        data.append(zip64endrec)
+
+        zip64locrec = struct.pack(b'<4sLqL', b'PK\x06\x07', 0, pos2, 1)
+        data.append(zip64locrec)
+
+        count = min(count, 0xFFFF)
+        size = min(size, 0xFFFFFFFF)
+        offsetVal = min(offsetVal, 0xFFFFFFFF)
+
+    endrec = struct.pack(b'<4s4H2LH', b'PK\005\006', 0, 0, count, count,
+                         size, offsetVal, 0)
+    data.append(endrec)
+
+    return b''.join(data)
+
+
+class ZipPlanEntry:
+    """
+    A file to be stored in a ``ZipPlan``.
+
+    :param path: The path within the archive for this entry.
+    :type path: str
+    :param size: The size of the file in bytes.
+    :type size: int
+    :param timestamp: The modification time as (year, month, day, hour,
+        minute, second).
+    :type timestamp: tuple
+    :param read: A function taking (start, end) byte offsets that returns an
+        iterable of the bytes of that range of the file.
+    :param crc: The CRC-32 of the file, if known.
+    :type crc: int or None
+    :param saveCrc: A function called with the CRC-32 once it has been
+        computed, so that it can be cached.
+    :param key: A string that identifies the file and its contents.
+    :type key: str
+    """
+
+    __slots__ = ('path', 'size', 'timestamp', 'read', 'crc', 'saveCrc', 'key')
+
+    def __init__(self, path, size, timestamp, read, crc=None, saveCrc=None, key=''):
+        self.path = path
+        self.size = size
+        self.timestamp = timestamp
+        self.read = read
+        self.crc = 0 if size == 0 else crc
+        self.saveCrc = saveCrc
+        self.key = key
+
+
+class ZipPlan:
+    """
+    The complete layout of an uncompressed archive, computed before any file
+    data is read.  This gives the exact length of the archive, and any byte
+    range of it can be generated independently, so downloads can be resumed.
+    The layout is the same as ``ZipGenerator`` produces with STORE
+    compression, but each entry carries its file's modification time rather
+    than the time the archive was made, so the archive does not change
+    between requests.
+
+    The CRC of each file is needed only for its data descriptor and the
+    central directory.  Unknown CRCs are computed while the file is streamed
+    to its end; if the range starts part way through the file, only the part
+    before the range is read in addition.  Files that are not streamed at all
+    are only read for their CRC when the range includes the central directory.
+
+    :param entries: an iterable of ZipPlanEntry.
+    :param rootPath: The root path for all files within this archive.
+    :type rootPath: str
+    """
+
+    def __init__(self, entries, rootPath=''):
+        self._entries = []
+        self._headers = []
+        # Each segment is (start, length, kind, index)
+        self._segments = []
+        offset = 0
+        tag = hashlib.sha256()
+        for index, entry in enumerate(entries):
+            header = ZipInfo(os.path.join(rootPath, entry.path), entry.timestamp)
+            header.externalAttr = (0o100644 & 0xFFFF) << 16
+            header.headerOffset = offset
+            header.crc = entry.crc or 0
+            header.compressSize = header.fileSize = entry.size
+            self._entries.append(entry)
+            self._headers.append(header)
+            for kind, length in (
+                    ('header', len(header.fileHeader())),
+                    ('data', entry.size),
+                    ('descriptor', len(header.dataDescriptor()))):
+                if length:
+                    self._segments.append((offset, length, kind, index))
+                    offset += length
+            tag.update(('%s\0%d\0%s\0' % (entry.path, entry.size, entry.key)).encode('utf8'))
+        self._directoryOffset = offset
+        directoryLength = len(_centralDirectory(self._headers, offset))
+        self._segments.append((offset, directoryLength, 'directory', None))
+        self.size = offset + directoryLength
+        self.etag = '"%s"' % tag.hexdigest()
+
+    def _setCrc(self, index, crc):
+        entry = self._entries[index]
+        entry.crc = self._headers[index].crc = crc
+        if entry.saveCrc:
+            entry.saveCrc(crc)
+
+    def _ensureCrc(self, index):
+        entry = self._entries[index]
+        if entry.crc is None:
+            crc = 0
+            for buf in entry.read(0, entry.size):
+                crc = binascii.crc32(buf, crc)
+            self._setCrc(index, crc & 0xFFFFFFFF)
+
+    def _data(self, index, start, end):
+        entry = self._entries[index]
+        if entry.crc is not None or end != entry.size:
+            yield from entry.read(start, end)
+            return
+        crc = 0
+        if start:
+            for buf in entry.read(0, start):
+                crc = binascii.crc32(buf, crc)
+        for buf in entry.read(start, end):
+            if isinstance(buf, str):
+                buf = buf.encode('utf8')
+            crc = binascii.crc32(buf, crc)
+            yield buf
+        self._setCrc(index, crc & 0xFFFFFFFF)
+
+    def generate(self, start=0, end=None):
+        """
+        Generate a byte range of the archive.
+
+        :param start: The first byte to generate.
+        :type start: int
+        :param end: The byte after the last byte to generate, or None for the
+            end of the archive.
+        :type end: int or None
+        """
+        if end is None or end > self.size:
+            end = self.size
+        for segStart, length, kind, index in self._segments:
+            if segStart + length <= start:
+                continue
+            if segStart >= end:
+                break
+            lo = max(start, segStart) - segStart
+            hi = min(end, segStart + length) - segStart
+            if kind == 'header':
+                yield self._headers[index].fileHeader()[lo:hi]
+            elif kind == 'data':
+                yield from self._data(index, lo, hi)
+            elif kind == 'descriptor':
+                self._ensureCrc(index)
+                yield self._headers[index].dataDescriptor()[lo:hi]
             else:
-                extraData = b''
-                extractVersion = header.extractVersion
-                createVersion = header.createVersion
-
-            centdir = struct.pack(
-                b'<4s4B4HLLL5HLL', b'PK\001\002', createVersion,
-                header.createSystem, extractVersion, 0, 0x8,
-                header.compressType, dostime, dosdate, header.crc, compressSize,
-                fileSize, len(header.filename), len(extraData), 0, 0, 0,
-                header.externalAttr, headerOffset)
-
-            data.append(self._advanceOffset(centdir))
-            data.append(self._advanceOffset(header.filename))
-            data.append(self._advanceOffset(extraData))
-
-        pos2 = self.offset
-        offsetVal = pos1
-        size = pos2 - pos1
-
-        if pos1 > Z64_LIMIT or size > Z64_LIMIT or count >= Z_FILECOUNT_LIMIT:
-            zip64endrec = struct.pack(
-                b'<4sqhhLLqqqq', b'PK\x06\x06', 44, 45, 45, 0, 0, count, count,
-                size, pos1)
-            data.append(self._advanceOffset(zip64endrec))
-
-            zip64locrec = struct.pack(b'<4sLqL', b'PK\x06\x07', 0, pos2, 1)
-            data.append(self._advanceOffset(zip64locrec))
-
-            count = min(count, 0xFFFF)
-            size = min(size, 0xFFFFFFFF)
-            offsetVal = min(offsetVal, 0xFFFFFFFF)
-
-        endrec = struct.pack(b'<4s4H2LH', b'PK\005\006', 0, 0, count, count,
-                             size, offsetVal, 0)
-        data.append(self._advanceOffset(endrec))
-
-        return b''.join(data)
+                for entryIndex in range(len(self._entries)):
+                    self._ensureCrc(entryIndex)
+                yield _centralDirectory(self._headers, self._directoryOffset)[lo:hi]